@@ -7,13 +7,20 @@ from cache.cache import *
 from prompt_engineering.prompts import *
 import warnings
 import traceback
+import time
 import zipfile
 from kernel import *
 from display import *
 from pathlib import Path
 from utils.utils import *
 import tiktoken
-from sfassist_client import SFAssistClient
+from sfassist_registry import get_shared_client, get_shared_async_client
+from sfassist_ratelimit import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from sfassist_routing import ROLE_REPORT, ROLE_RESULT_SUMMARY
+from logger import logger
+from deadline import Deadline
+from kernel_pool import get_kernel_pool
+from kernel_forkserver import fork_kernel_factory, get_fork_server
 #from horizon_client import SFAssistClient
 # warnings.filterwarnings("ignore")
 
@@ -22,9 +29,9 @@ class Conversation:
 
     def __init__(self, config) -> None:
         self.config = config    
-        # Use Snowflake Cortex
-        from sfassist_client import SFAssistClient
-        self.client = SFAssistClient(config)
+        # Use Snowflake Cortex (one shared client per endpoint/app/model)
+        self.client = get_shared_client(config)
+        self.aclient = get_shared_async_client(config)
         self.is_anthropic = False
         self.model = config['conv_model']
         self.programmer = Programmer(api_key=config['api_key'], model=config['programmer_model'],
@@ -32,10 +39,23 @@ class Conversation:
         self.inspector = Inspector(api_key=config['api_key'], model=config['inspector_model'],
                                    base_url=config['base_url_inspector'], config=config)
         self.session_cache_path = config["session_cache_path"]
+        # Token usage of this session's LLM calls is metered under the cache folder name
+        self.session_id = os.path.basename(os.path.normpath(self.session_cache_path))
+        self.programmer.session_id = self.inspector.session_id = self.session_id
         self.chat_history_display = config["chat_history_display"] if "chat_history_display" in config else []
         self.retrieval = self.config['retrieval']
-        self.kernel = CodeKernel(session_cache_path=self.session_cache_path, max_exe_time=config['max_exe_time'])
+        # Kernels forked from a template process with the stack imported (kernel_provisioning: fork)
+        # (the server is resolved per kernel, so a template that died is replaced)
+        self.fork_server = get_fork_server(config, preload=IMPORT)
+        self.kernel_factory = fork_kernel_factory(config, preload=IMPORT) if self.fork_server is not None else CodeKernel
+        # Warm kernels with startup.py and IMPORT already run (None when kernel_pool_size is 0)
+        self.kernel_pool = get_kernel_pool(config, preamble=IMPORT, kernel_factory=self.kernel_factory)
+        self.kernel = self._start_kernel()
         self.max_attempts = config['max_attempts']
+        # Latency budget of one stream_workflow turn (0 = unlimited)
+        self.turn_time_budget = config.get('turn_time_budget', 0)
+        # Min seconds between UI updates with the output of running code (0 = final results only)
+        self.kernel_output_interval = config.get('kernel_output_interval', 0.5)
         self.error_count = 0
         self.repair_count = 0
         self.file_list = []
@@ -44,9 +64,16 @@ class Conversation:
         self.my_data_cache = None
         self.max_context_tokens = config.get('max_context_tokens', 7000)  # Default to 7000 tokens
         self.encoding = tiktoken.get_encoding("cl100k_base")  # GPT-4 encoding
-        self.run_code(IMPORT)
+        if self.kernel_pool is None:
+            self.run_code(IMPORT)
 
 
+    def _start_kernel(self):
+        """Kernel for this session: from the warm pool, forked from the template or started fresh"""
+        if self.kernel_pool is not None:
+            return self.kernel_pool.acquire(self.session_cache_path, self.config['max_exe_time'])
+        return self.kernel_factory(session_cache_path=self.session_cache_path, max_exe_time=self.config['max_exe_time'])
+
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
@@ -54,12 +81,9 @@ class Conversation:
         self.my_data_cache = data_cache(data_path)
 
     def check_folder(self):
-        print(f"DEBUG: check_folder called for path: {self.session_cache_path}")
         current_files = os.listdir(self.session_cache_path)
-        print(f"DEBUG: current_files: {current_files}")
-        print(f"DEBUG: file_list before: {self.file_list}")
         new_files = set(current_files) - set(self.file_list)
-        print(f"DEBUG: new_files: {new_files}")
+        logger.debug("check_folder %s: %d files, new: %s", self.session_cache_path, len(current_files), new_files)
         self.file_list = current_files
         display = False
         display_link = ''
@@ -70,16 +94,14 @@ class Conversation:
                 file_ext = os.path.splitext(file)[1].lower()
                 
                 if file_ext in ['.png','.jpg','.jpeg']:
-                    print(f"DEBUG: Found image file: {file}")
+                    logger.debug("Found image file: %s", file)
                     display_link += display_image(file_link)
                     absolute_path = Path(file_link).resolve()
-                    print("absolute_path",absolute_path)
                     self.figure_list.append(absolute_path)
                 elif file_ext not in ['.pkl', '.joblib', '.model']:
                     # Only create download links for non-model files
                     display_link += display_download_file(file_link, file)
-        print("display_link:", display_link)
-        print(f"DEBUG: check_folder returning display={display}")
+        logger.debug("check_folder returning display=%s (%d chars of links)", display, len(display_link))
         return display, display_link
 
 
@@ -121,16 +143,56 @@ class Conversation:
         message = {"role": role, "content": CODE_INSPECT.format(bug_code=bug_code, error_message=error_msg)}
         self.inspector.messages.append(message)
 
-    def run_code(self, code):
+    def run_code(self, code, deadline=None):
         try:
-            sign, msg_llm, exe_res = execute(code, self.kernel)
-            print(f"DEBUG: run_code returned - sign: {sign}, msg_llm: {msg_llm}, exe_res: {exe_res}")
+            sign, msg_llm, exe_res = execute(code, self.kernel, deadline)
+            logger.debug("run_code returned - sign: %s, msg_llm: %s, exe_res: %s", sign, msg_llm, exe_res)
         except Exception as e:  # this error is due to the outer programme, not the error in the kernel
             print(f'Error in executing code (outer): {e}')
             sign, msg_llm, exe_res = 'text', f'{e}\nThis error is due to the outer programme, not the error in the kernel, you should tell the user to check the system code.', str(e) # tell the user, the code have problems.
 
         return sign, msg_llm, exe_res
 
+    def run_code_stream(self, code, chat_history_display, deadline=None):
+        """
+        run_code that shows the output of the code in the last chat message while it runs
+
+        Yields chat_history_display at most every kernel_output_interval seconds;
+        returns run_code's (sign, msg_llm, exe_res).
+        """
+        if not self.kernel_output_interval or not chat_history_display:
+            return self.run_code(code, deadline)
+        base_text = chat_history_display[-1][1]
+        lines, images = [], 0
+        start = last_update = time.monotonic()
+        try:
+            stream = execute_stream(code, self.kernel, deadline)
+            while True:
+                try:
+                    mark, out_str = next(stream)
+                except StopIteration as stop:
+                    sign, msg_llm, exe_res = stop.value
+                    break
+                if mark in ('stdout', 'execute_result_text', 'display_text'):
+                    lines.append(out_str)
+                elif mark == 'error':
+                    lines.append(delete_color_control_char(out_str))
+                elif mark.endswith(('_png', '_jpeg')):
+                    images += 1
+                now = time.monotonic()
+                if now - last_update >= self.kernel_output_interval:
+                    last_update = now
+                    text = ''.join(lines) + (f"\n[{images} image(s) generated]" if images else '')
+                    chat_history_display[-1][1] = base_text + display_live_output(text, now - start)
+                    yield chat_history_display
+            logger.debug("run_code_stream returned - sign: %s, msg_llm: %s, exe_res: %s", sign, msg_llm, exe_res)
+        except Exception as e:  # this error is due to the outer programme, not the error in the kernel
+            print(f'Error in executing code (outer): {e}')
+            sign, msg_llm, exe_res = 'text', f'{e}\nThis error is due to the outer programme, not the error in the kernel, you should tell the user to check the system code.', str(e) # tell the user, the code have problems.
+        # The final results are rendered by the caller
+        chat_history_display[-1][1] = base_text
+        return sign, msg_llm, exe_res
+
     def rendering_code(self):
         for i in range(len(self.programmer.messages) - 1, 0, -1):
             if self.programmer.messages[i]["role"] == "assistant":
@@ -185,7 +247,8 @@ No conversation history found. Please ensure you have had a conversation with th
             self.messages = [{"role": "system", "content": Basic_Report}] + truncated_chat + [{"role": "user", "content": f"Now, you should generate a report according to the above chat history (Do not give further suggestions at the end of report).\nNote: Here is figure list with links in the chat history: {self.figure_list}"}]
             
             print("DEBUG: Calling chat model for report generation...")
-            response = self.call_chat_model()
+            # Reports queue behind interactive programmer / inspector calls
+            response = self.call_chat_model(priority=PRIORITY_BACKGROUND, role=ROLE_REPORT)
             if response and hasattr(response, 'choices') and len(response.choices) > 0:
                 report = response.choices[0].message.content
                 print("DEBUG: Report generated successfully")
@@ -253,11 +316,14 @@ Please try again or contact support if the issue persists.
             print(f"An error occurred when exporting notebook: {e}")
         return notebook_path
 
-    def call_chat_model(self, functions=None, include_functions=False):
+    def call_chat_model(self, functions=None, include_functions=False, priority=PRIORITY_INTERACTIVE, role=None):
         # Use OpenAI API format
         params = {
             "model": self.model,
             "messages": self.messages,
+            "priority": priority,
+            "role": role,
+            "session": self.session_id,
         }
 
         if include_functions:
@@ -266,6 +332,20 @@ Please try again or contact support if the issue persists.
 
         return self.client.chat.completions.create(**params)
 
+    async def acall_chat_model(self, functions=None, include_functions=False, priority=PRIORITY_INTERACTIVE, role=None):
+        params = {
+            "model": self.model,
+            "messages": self.messages,
+            "priority": priority,
+            "role": role,
+            "session": self.session_id,
+        }
+
+        if include_functions:
+            params["functions"] = functions
+            params["function_call"] = "auto"
+
+        return await self.aclient.chat.completions.create(**params)
 
     def clear(self):
         import shutil
@@ -281,13 +361,17 @@ Please try again or contact support if the issue persists.
         self.messages = []
         self.programmer.clear()
         self.inspector.clear()
-        self.kernel.shutdown()
+        if self.kernel_pool is not None:
+            self.kernel_pool.release(self.kernel)
+        else:
+            self.kernel.shutdown()
         del self.kernel
-        self.kernel = CodeKernel(session_cache_path=self.session_cache_path, max_exe_time=self.config['max_exe_time'])
+        self.kernel = self._start_kernel()
         self.my_data_cache = None
 
 
     def stream_workflow(self, chat_history_display, code=None) -> object:
+        deadline = Deadline(self.turn_time_budget)
         try:
             if chat_history_display and len(chat_history_display) > 0:
                 chat_history_display[-1][1] = ""
@@ -300,7 +384,8 @@ Please try again or contact support if the issue persists.
                 self.programmer.messages = self.manage_context(self.programmer.messages, "programmer")
                 
                 prog_response = ''
-                for message in self.programmer._call_chat_model_streaming(retrieval=self.retrieval, kernel=self.kernel):
+                for message in self.programmer._call_chat_model_streaming(retrieval=self.retrieval, kernel=self.kernel,
+                                                                          deadline=deadline):
                     if chat_history_display and len(chat_history_display) > 0:
                         chat_history_display[-1][1] += message
                     yield chat_history_display
@@ -313,13 +398,20 @@ Please try again or contact support if the issue persists.
                 if chat_history_display and len(chat_history_display) > 0:
                     chat_history_display[-1][1] += '\n🖥️ Execute code...'
                 yield chat_history_display
-                sign, msg_llm, exe_res = self.run_code(code)
+                sign, msg_llm, exe_res = yield from self.run_code_stream(code, chat_history_display, deadline)
                 if sign and 'error' not in sign:
-                    yield from self._handle_execution_result(exe_res, msg_llm, chat_history_display)
+                    yield from self._handle_execution_result(exe_res, msg_llm, chat_history_display, deadline)
                 else:
                     self.error_count += 1
                     round = 0
                     while 'error' in sign and round < self.max_attempts:
+                        if deadline.expired:
+                            # Out of turn budget - stop repairing and return the partial results
+                            if chat_history_display and len(chat_history_display) > 0:
+                                chat_history_display[-1][1] += (f'\n⏱️ Time budget of this turn ({deadline.budget:.0f}s) '
+                                                                f'is used up, stopped after {round} repair attempts.\n')
+                            yield chat_history_display
+                            break
                         if chat_history_display and len(chat_history_display) > 0:
                             chat_history_display[-1][1] = f'⭕ Execution error, try to repair the code, attempts: {round + 1}....\n'
                         yield chat_history_display
@@ -330,13 +422,18 @@ Please try again or contact support if the issue persists.
                             # Manage context before calling the inspector
                             self.inspector.messages = self.manage_context(self.inspector.messages, "inspector")
                             
-                            response = self.inspector._call_chat_model()
-                            insp_response = response.choices[0].message.content
+                            # After a failed repair round the inspector moves up to the large model
+                            response = self.inspector._call_chat_model(escalate=round > 0, deadline=deadline)
+                            if response and hasattr(response, 'choices') and len(response.choices) > 0:
+                                insp_response = response.choices[0].message.content
+                            else:
+                                # Inspector unavailable (endpoint down / circuit open) - fall back to a generic hint
+                                insp_response = "Try other packages or methods."
                         self.inspector.messages.append({"role": "assistant", "content": insp_response})
 
                         self.add_programmer_repair_msg(code, msg_llm, insp_response)
                         prog_response = ''
-                        for message in self.programmer._call_chat_model_streaming():
+                        for message in self.programmer._call_chat_model_streaming(escalate=round > 0, deadline=deadline):
                             if chat_history_display and len(chat_history_display) > 0:
                                 chat_history_display[-1][1] += message
                             prog_response += message
@@ -347,7 +444,7 @@ Please try again or contact support if the issue persists.
                         self.add_programmer_msg({"role": "assistant", "content": prog_response})
                         is_python, code = extract_code(prog_response)
                         if is_python:
-                            sign, msg_llm, exe_res = self.run_code(code)
+                            sign, msg_llm, exe_res = yield from self.run_code_stream(code, chat_history_display, deadline)
                             if sign and 'error' not in sign:
                                 self.repair_count += 1
                                 break
@@ -356,7 +453,7 @@ Please try again or contact support if the issue persists.
                     if round == self.max_attempts:
                         return prog_response + f"\nSorry, I can't fix the code with {self.max_attempts} attempts, can you help me to modified it or give some suggestions?"
 
-                    yield from self._handle_execution_result(exe_res, msg_llm, chat_history_display)
+                    yield from self._handle_execution_result(exe_res, msg_llm, chat_history_display, deadline)
 
         except Exception as e:
             if chat_history_display and len(chat_history_display) > 0:
@@ -367,7 +464,7 @@ Please try again or contact support if the issue persists.
             if self.programmer.messages[-1]["role"] == "user":
                 self.programmer.messages.append({"role": "assistant", "content": f"An error occurred in program: {e}"})
 
-    def _handle_execution_result(self, exe_res, msg_llm, chat_history_display):
+    def _handle_execution_result(self, exe_res, msg_llm, chat_history_display, deadline=None):
         if chat_history_display and len(chat_history_display) > 0:
             chat_history_display[-1][1] += display_exe_results(exe_res)
         yield chat_history_display
@@ -378,8 +475,18 @@ Please try again or contact support if the issue persists.
         yield chat_history_display
 
         self.add_programmer_msg({"role": "user", "content": RESULT_PROMPT.format(msg_llm)})
+        if deadline is not None and deadline.expired:
+            # No budget left for the explanation call - the raw results above are the answer
+            if chat_history_display and len(chat_history_display) > 0:
+                chat_history_display[-1][1] += (f"\n⏱️ Time budget of this turn ({deadline.budget:.0f}s) "
+                                                f"is used up, skipped the result explanation.")
+            self.add_programmer_msg({"role": "assistant",
+                                     "content": "Explanation skipped: the turn ran out of time."})
+            yield chat_history_display
+            return
+
         prog_response = ''
-        for message in self.programmer._call_chat_model_streaming():
+        for message in self.programmer._call_chat_model_streaming(role=ROLE_RESULT_SUMMARY, deadline=deadline):
             if chat_history_display and len(chat_history_display) > 0:
                 chat_history_display[-1][1] += message
             yield chat_history_display
@@ -399,11 +506,12 @@ Please try again or contact support if the issue persists.
 
         if self.config['api_key'] != api_key:
             self.config['api_key'] = api_key
-            # Update Snowflake clients
-            from horizon_client import SFAssistClient
-            self.client = SFAssistClient(self.config)
-            self.programmer.client = SFAssistClient(self.config)
-            self.inspector.client = SFAssistClient(self.config)
+            # The registry keys clients by API key: this session moves to a client of its own
+            # key, sessions still using the old key keep theirs
+            self.client = get_shared_client(self.config)
+            self.aclient = get_shared_async_client(self.config)
+            self.programmer.client = self.inspector.client = self.client
+            self.programmer.aclient = self.inspector.aclient = self.aclient
 
         if self.model != conv_model:
             self.model = conv_model
@@ -424,6 +532,10 @@ Please try again or contact support if the issue persists.
         if self.max_attempts != max_attempts:
             self.config['max_attempts'] = max_attempts
 
+    def token_usage(self, by='role'):
+        """Prompt / completion tokens of this session, grouped by 'role' or 'model'"""
+        return self.client.usage_stats(by, session=self.session_id)
+
     def count_tokens(self, text):
         """Count tokens in text using tiktoken"""
         return len(self.encoding.encode(text))
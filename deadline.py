@@ -0,0 +1,60 @@
+import time
+from typing import Optional
+
+
+MIN_STAGE_TIMEOUT = 0.01  # transports reject a zero timeout
+
+
+class DeadlineExceeded(Exception):
+    """The time budget of the current turn is used up"""
+
+
+class Deadline:
+    """
+    Latency budget of one chat turn, handed down to every stage of it
+
+    Each stage (rate-limit queue, LLM request, retry backoff, kernel
+    execution) takes min(its own timeout, remaining budget), so a turn
+    cannot outlive its budget however many repair rounds it runs. A budget
+    of None / 0 never expires and leaves every stage timeout unchanged.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.budget = float(seconds) if seconds and seconds > 0 else None
+        self.started = time.monotonic()
+        self.expires_at = self.started + self.budget if self.budget else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (None when unlimited)"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def timeout(self, default: float) -> float:
+        """Timeout of a stage: its default capped by the remaining budget"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(min(default, remaining), MIN_STAGE_TIMEOUT)
+
+    def check(self, stage: str = ''):
+        """
+        Raises:
+            DeadlineExceeded: the budget is used up
+        """
+        if self.expired:
+            where = f" before {stage}" if stage else ''
+            raise DeadlineExceeded(f"Turn time budget of {self.budget:.0f}s exhausted{where}")
+
+    def __repr__(self):
+        if self.budget is None:
+            return "Deadline(unlimited)"
+        return f"Deadline(budget={self.budget:.0f}s, remaining={self.remaining():.1f}s)"
@@ -44,6 +44,15 @@ def display_exe_results(text):
     return f"""<details style="border: 1px solid #ccc; padding: 10px; margin-bottom: 10px;"><summary style="font-weight: bold; cursor: pointer;">✅Click to view execution results</summary><pre>{escaped_text}</pre></details>"""
 
 
+def display_live_output(text, elapsed, max_chars=4000):
+    """Output of code that is still running: the latest max_chars characters and the time so far"""
+    if len(text) > max_chars:
+        text = '...' + text[-max_chars:]
+    escaped_text = html.escape(text)
+    output = f"<pre>{escaped_text}</pre>" if text else ''
+    return f"""<div style="border: 1px solid #ccc; padding: 10px; margin-bottom: 10px;"><span style="font-weight: bold;">⏳ Running... {elapsed:.0f}s</span>{output}</div>"""
+
+
 def display_download_file(path, filename):
     abs_path = os.path.abspath(path)
     # For Gradio file serving, we need to use the file= prefix with the absolute path
@@ -1,5 +1,6 @@
 import openai
-from sfassist_client import SFAssistClient
+from sfassist_registry import get_shared_client, get_shared_async_client
+from sfassist_routing import ROLE_INSPECTOR
 #from horizon_client import SFAssistClient
 
 class Inspector:
@@ -7,8 +8,8 @@ class Inspector:
     def __init__(self, api_key, model=None, base_url='', config=None):
         # Use Snowflake Cortex
         #from snowflake_cortex_client import SnowflakeCortexClient
-        from sfassist_client import SFAssistClient
-        self.client = SFAssistClient(config)
+        self.client = get_shared_client(config)
+        self.aclient = get_shared_async_client(config)
         self.is_snowflake = False
         self.is_anthropic = False
         # Get model from config dynamically
@@ -22,14 +23,19 @@ class Inspector:
             self.model = 'claude-4-sonnet'  # Only if NO config at all
         self.messages = []
         self.function_repository = {}
+        self.session_id = None  # set by Conversation, attributes token usage
 
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
-    def _call_chat_model(self, functions=None, include_functions=False):
+    def _call_chat_model(self, functions=None, include_functions=False, escalate=False, deadline=None):
         params = {
             "model": self.model,
             "messages": self.messages,
+            "role": ROLE_INSPECTOR,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
         }
 
         if include_functions:
@@ -43,6 +49,26 @@ class Inspector:
             print(f"Error calling chat model: {e}")
             return None
 
+    async def _acall_chat_model(self, functions=None, include_functions=False, escalate=False, deadline=None):
+        params = {
+            "model": self.model,
+            "messages": self.messages,
+            "role": ROLE_INSPECTOR,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
+        }
+
+        if include_functions:
+            params['functions'] = functions
+            params['function_call'] = "auto"
+
+        try:
+            return await self.aclient.chat.completions.create(**params)
+        except Exception as e:
+            print(f"Error calling chat model: {e}")
+            return None
+
     def clear(self):
         self.messages = []
         self.function_repository = {}
\ No newline at end of file
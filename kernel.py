@@ -14,8 +14,38 @@ from nbformat import v4 as nbf
 import time
 import ansi2html
 from utils.utils import check_install_kernel
+from kernel_supervisor import (INTERRUPT_GRACE, LIVENESS_INTERVAL, OUTCOME_CANCELLED, OUTCOME_DIED, OUTCOME_OK,
+                               OUTCOME_TIMEOUT, get_kernel_supervisor)
 
 IPYKERNEL = os.environ.get('IPYKERNEL', 'dsa')
+SILENT_EXEC_TIMEOUT = 300  # seconds allowed for session setup code run by run_silent
+
+# Prepended to code using matplotlib / seaborn: plt.show() saves the figure to the session folder
+CUSTOM_SHOW_CODE = """
+import os
+import time
+import hashlib
+import matplotlib.pyplot as plt
+
+# Custom show function
+def custom_show(*args, **kwargs):
+    fig = plt.gcf()
+    if fig.get_axes():
+        timestamp = str(time.time())
+        filename = f"{hashlib.md5(timestamp.encode()).hexdigest()}.png"
+        cache_path = os.environ.get('DSA_SESSION_CACHE_PATH', './cache')
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+        filepath = os.path.join(cache_path, filename)
+        try:
+            fig.savefig(filepath, dpi=100, bbox_inches='tight')
+            print(f"Plot saved: {filepath}")
+        except Exception as e:
+            print(f"Error saving plot: {e}")
+
+# Replace plt.show with custom function
+plt.show = custom_show
+"""
 
 
 class CodeKernel(object):
@@ -28,7 +58,8 @@ class CodeKernel(object):
                  init_file_path="./startup.py",
                  session_cache_path="",
                  max_exe_time=18000,
-                 verbose=1):
+                 verbose=1,
+                 kernel_manager=None):
 
         self.kernel_name = kernel_name
         self.kernel_id = kernel_id
@@ -45,13 +76,32 @@ class CodeKernel(object):
         self.nb = nbf.new_notebook()
         self.nb_path = os.path.join(session_cache_path, 'notebook.ipynb')
         self.verbose = verbose
-        self.interrupt_signal = False
+        self.execution = None  # KernelExecution of the running code, see cancel()
+        self.preamble = ''
 
         if python_path is None and ipython_path is None:
             env = None
         else:
             env = {"PATH": self.python_path + ":$PATH", "PYTHONPATH": self.python_path}
 
+        if kernel_manager is not None:
+            # Kernel already running, e.g. forked from the template process (see kernel_forkserver)
+            self.kernel_manager = kernel_manager
+        else:
+            self._start_kernel_manager(env)
+
+        if verbose:
+            pprint(self.kernel_manager.get_connection_info())
+
+        self.kernel = self.kernel_manager.blocking_client()
+        # No iopub: nothing would read it, so it would queue a copy of every output
+        self.kernel.start_channels(iopub=False)
+        # Code is run and its output read by the process-wide supervisor thread
+        self.supervisor = get_kernel_supervisor()
+        self.supervisor.watch(self)
+        print("Code kernel started.")
+
+    def _start_kernel_manager(self, env):
         check_install_kernel('dsa')
 
         self.kernel_manager = jupyter_client.KernelManager(
@@ -82,118 +132,108 @@ class CodeKernel(object):
             print("Backend kernel started with the configuration: {}".format(
                 self.kernel_manager.connection_file))
 
-        if verbose:
-            pprint(self.kernel_manager.get_connection_info())
-
-        self.kernel = self.kernel_manager.blocking_client()
-        self.kernel.start_channels()
-        print("Code kernel started.")
-
-    def execute_code_(self, code):
-        # Inject custom plt.show function if matplotlib is being used
-        if 'matplotlib' in code or 'plt.' in code or 'seaborn' in code or 'sns.' in code:
-            custom_show_code = """
-import os
-import time
-import hashlib
-import matplotlib.pyplot as plt
-
-# Custom show function
-def custom_show(*args, **kwargs):
-    fig = plt.gcf()
-    if fig.get_axes():
-        timestamp = str(time.time())
-        filename = f"{hashlib.md5(timestamp.encode()).hexdigest()}.png"
-        cache_path = os.environ.get('DSA_SESSION_CACHE_PATH', './cache')
-        if not os.path.exists(cache_path):
-            os.makedirs(cache_path)
-        filepath = os.path.join(cache_path, filename)
+    def execute_code_(self, code, deadline=None):
+        return list(self.iter_code_output(code, deadline))
+
+    def iter_code_output(self, code, deadline=None, cancel=None):
+        """Execute code and yield its (mark, output) entries as the kernel produces them
+
+        Yields the entries execute_code_ returns once execution ends. Closing the iterator
+        early, cancel() or cancelling the `cancel` CancelToken interrupts the execution.
+        """
+        code = inject_custom_show(code)
+        # Execution time: max_exe_time, capped by the turn's remaining budget
+        exe_time = deadline.timeout(self.max_exe_time) if deadline is not None else self.max_exe_time
+        # The supervisor thread reads the output and interrupts the kernel on timeout or cancel()
+        execution = self.supervisor.execute(self, code, exe_time, cancel)
+        self.execution = execution
         try:
-            fig.savefig(filepath, dpi=100, bbox_inches='tight')
-            print(f"Plot saved: {filepath}")
-        except Exception as e:
-            print(f"Error saving plot: {e}")
-
-# Replace plt.show with custom function
-plt.show = custom_show
-"""
-            code = custom_show_code + "\n" + code
-        
-        msg_id = self.kernel.execute(code)
-        # Get the output of the code
-        msg_list = []
-        while True:
-            try:
-                iopub_msg = self.kernel.get_iopub_msg(timeout=self.max_exe_time)
-                msg_list.append(iopub_msg)
-                if iopub_msg['msg_type'] == 'status' and iopub_msg['content'].get('execution_state') == 'idle':
-                    break
-            except:
-                if self.interrupt_signal:
-                    self.kernel_manager.interrupt_kernel()
-                    self.interrupt_signal = False
-                continue
-
+            for iopub_msg in execution:
+                yield from self._parse_iopub_msg(iopub_msg)
+        finally:
+            self.execution = None
+            if not execution.done:
+                # Abandoned by the caller: stop the code and let the kernel settle, otherwise
+                # it aborts the next request queued behind the interrupted one
+                execution.cancel.cancel()
+                execution.wait(INTERRUPT_GRACE + LIVENESS_INTERVAL)
+
+        if execution.outcome != OUTCOME_OK:
+            yield ('error', outcome_error(execution.outcome, exe_time))
+
+    def _parse_iopub_msg(self, iopub_msg):
+        """(mark, output) entries of one iopub message; images are saved to the session folder"""
         all_output = []
-        # sign = None
-        for iopub_msg in msg_list:
-            if iopub_msg['msg_type'] == 'stream':
-                if iopub_msg['content'].get('name') == 'stdout':
-                    output = iopub_msg['content']['text']
-                    all_output.append(('stdout', output))
-            elif iopub_msg['msg_type'] == 'execute_result':
-                if 'data' in iopub_msg['content']:
-                    if 'text/plain' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['text/plain']
-                        all_output.append(('execute_result_text', output))
-
-                    if 'text/html' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['text/html']
-                        all_output.append(('execute_result_html', output))
-
-                    if 'image/png' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['image/png']
-                        all_output.append(('execute_result_png', output))
-                        save_b64_2_img(output, self.session_cache_path)
-
-                    if 'image/jpeg' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['image/jpeg']
-                        all_output.append(('execute_result_jpeg', output))
-                        save_b64_2_img(output, self.session_cache_path)
-            elif iopub_msg['msg_type'] == 'display_data':
-                if 'data' in iopub_msg['content']:
-                    if 'text/plain' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['text/plain']
-                        all_output.append(('display_text', output))
-
-                    if 'text/html' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['text/html']
-                        all_output.append(('display_html', output))
-
-                    if 'image/png' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['image/png']
-                        all_output.append(('display_png', output))
-                        save_b64_2_img(output, self.session_cache_path)
-
-                    if 'image/jpeg' in iopub_msg['content']['data']:
-                        output = iopub_msg['content']['data']['image/jpeg']
-                        all_output.append(('display_jpeg', output))
-                        save_b64_2_img(output, self.session_cache_path)
-            elif iopub_msg['msg_type'] == 'error':
-                if 'traceback' in iopub_msg['content']:
-                    output = '\n'.join(iopub_msg['content']['traceback'])
-                    all_output.append(('error', output))
-        # print("len of console messages: " + str(len(all_output)))
-
+        if iopub_msg['msg_type'] == 'stream':
+            if iopub_msg['content'].get('name') == 'stdout':
+                output = iopub_msg['content']['text']
+                all_output.append(('stdout', output))
+        elif iopub_msg['msg_type'] == 'execute_result':
+            if 'data' in iopub_msg['content']:
+                if 'text/plain' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['text/plain']
+                    all_output.append(('execute_result_text', output))
+
+                if 'text/html' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['text/html']
+                    all_output.append(('execute_result_html', output))
+
+                if 'image/png' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['image/png']
+                    all_output.append(('execute_result_png', output))
+                    save_b64_2_img(output, self.session_cache_path)
+
+                if 'image/jpeg' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['image/jpeg']
+                    all_output.append(('execute_result_jpeg', output))
+                    save_b64_2_img(output, self.session_cache_path)
+        elif iopub_msg['msg_type'] == 'display_data':
+            if 'data' in iopub_msg['content']:
+                if 'text/plain' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['text/plain']
+                    all_output.append(('display_text', output))
+
+                if 'text/html' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['text/html']
+                    all_output.append(('display_html', output))
+
+                if 'image/png' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['image/png']
+                    all_output.append(('display_png', output))
+                    save_b64_2_img(output, self.session_cache_path)
+
+                if 'image/jpeg' in iopub_msg['content']['data']:
+                    output = iopub_msg['content']['data']['image/jpeg']
+                    all_output.append(('display_jpeg', output))
+                    save_b64_2_img(output, self.session_cache_path)
+        elif iopub_msg['msg_type'] == 'error':
+            if 'traceback' in iopub_msg['content']:
+                output = '\n'.join(iopub_msg['content']['traceback'])
+                all_output.append(('error', output))
         return all_output
 
-    def execute_code(self, code) -> Tuple[
+    def execute_code(self, code, deadline=None) -> Tuple[
         list, str, str]:  # list[list, list, list]: #  Return: 1. sginal of resut, eg: text, error. 2. test to LLM. 3. The content to display.
+        result = self.execute_code_(code, deadline)
+        return self._summarize_output(code, result)
+
+    def execute_code_stream(self, code, deadline=None, cancel=None):
+        """execute_code that yields each (mark, output) entry as it arrives
+
+        The generator's return value (StopIteration.value) is execute_code's
+        (sign, text_to_llm, content_to_display).
+        """
+        result = []
+        for entry in self.iter_code_output(code, deadline, cancel):
+            result.append(entry)
+            yield entry
+        return self._summarize_output(code, result)
+
+    def _summarize_output(self, code, result):
         text_to_llm = ["Summary of console output:\n"]
         sign = list()
         content_to_display = []
         images = []
-        result = self.execute_code_(code)
         self.add_code_cell_to_notebook(code)
         # print("Console output: " ,content_to_display)
         for mark, out_str in result:
@@ -238,6 +278,57 @@ plt.show = custom_show
     #         nbf.write(nb, f)
     #     print(f"Notebook exported to {file_path}")
 
+    def run_preamble(self, code):
+        """Run session setup code (IMPORT) and keep it as a notebook cell"""
+        self.preamble = code
+        return self.execute_code(code)
+
+    def bind_session(self, session_cache_path):
+        """Point a pooled kernel at a session: plots, images and the notebook go to its cache folder"""
+        self.session_cache_path = session_cache_path
+        self.nb_path = os.path.join(session_cache_path, 'notebook.ipynb')
+        os.environ['DSA_SESSION_CACHE_PATH'] = session_cache_path
+        self.run_silent(f"import os\nos.environ['DSA_SESSION_CACHE_PATH'] = {session_cache_path!r}")
+
+    def reconnect(self):
+        """Open a new client in the calling thread
+
+        Channels are bound to the event loop of the thread that started them and stall
+        while that thread is busy, so a kernel handed to another thread reconnects first.
+        """
+        # Not stop_channels(): it would open the iopub channel this client never started
+        for channel in (self.kernel.shell_channel, self.kernel.stdin_channel, self.kernel.hb_channel,
+                        self.kernel.control_channel):
+            if channel.is_alive():
+                channel.stop()
+        self.start()
+
+    def wait_ready(self, timeout=SILENT_EXEC_TIMEOUT):
+        """Block until the kernel answers requests and its output reaches the supervisor"""
+        self.supervisor.wait_ready(self, timeout)
+
+    def reset(self):
+        """Clear the namespace and notebook for the next session, then rerun startup and preamble
+
+        Imported modules stay loaded in the kernel, so this is much faster than a new kernel.
+        """
+        self.run_silent("%reset -f")
+        # Like exec_files at kernel start, a failing startup file does not stop the kernel
+        with open(self.init_file_path, 'r', encoding='utf-8') as f:
+            self.run_silent(f.read(), check=False)
+        self.nb = nbf.new_notebook()
+        if self.preamble:
+            self.run_preamble(self.preamble)
+
+    def run_silent(self, code, timeout=SILENT_EXEC_TIMEOUT, check=True):
+        """Execute code without output or history; raises RuntimeError if it fails and check is set"""
+        execution = self.supervisor.execute(self, code, timeout, silent=True)
+        execution.wait()
+        reply = execution.reply or {'status': execution.outcome}
+        if check and reply['status'] != 'ok':
+            raise RuntimeError(f"Kernel setup code failed: {reply.get('evalue', reply)}")
+        return reply
+
     def execute_interactive(self, code, verbose=False):
         shell_msg = self.kernel.execute_interactive(code)
         if shell_msg is queue.Empty:
@@ -282,6 +373,7 @@ plt.show = custom_show
                     print(line)
 
     def shutdown(self):
+        self.supervisor.unwatch(self)
         # Shutdown the backend kernel
         self.kernel_manager.shutdown_kernel(now=True)
         print("Backend kernel shutdown.")
@@ -292,13 +384,15 @@ plt.show = custom_show
     def restart(self):
         # Restart the backend kernel
         self.kernel_manager.restart_kernel()
+        # Subscribe again: the new process does not see the old subscription
+        self.supervisor.watch(self)
         print("Backend kernel restarted.")
 
     def start(self):
         # Initialize the code kernel
         self.kernel = self.kernel_manager.blocking_client()
         # self.kernel.load_connection_file()
-        self.kernel.start_channels()
+        self.kernel.start_channels(iopub=False)
         print("Code kernel started.")
 
     def interrupt(self):
@@ -306,6 +400,12 @@ plt.show = custom_show
         self.kernel_manager.interrupt_kernel()
         print("Backend kernel interrupted.")
 
+    def cancel(self):
+        """Stop the code execute_code is running (from any thread); its output so far is kept"""
+        execution = self.execution
+        if execution is not None:
+            execution.cancel.cancel()
+
     def is_alive(self):
         return self.kernel.is_alive()
 
@@ -354,6 +454,25 @@ def delete_color_control_char(string):
     return ansi_escape.sub('', string)
 
 
+def inject_custom_show(code):
+    # Inject custom plt.show function if matplotlib is being used
+    if 'matplotlib' in code or 'plt.' in code or 'seaborn' in code or 'sns.' in code:
+        code = CUSTOM_SHOW_CODE + "\n" + code
+    return code
+
+
+def outcome_error(outcome, exe_time):
+    """Error entry closing the output of an execution that did not finish normally"""
+    if outcome == OUTCOME_TIMEOUT:
+        return (f"TimeoutError: execution stopped after {exe_time:.0f}s "
+                f"(time budget exhausted), output above is partial")
+    if outcome == OUTCOME_CANCELLED:
+        return "CancelledError: execution cancelled, output above is partial"
+    if outcome == OUTCOME_DIED:
+        return "KernelDiedError: the kernel process exited during execution, variables and imports of earlier cells are lost"
+    return f"Execution ended: {outcome}"
+
+
 def save_b64_2_img(data, path):
     bs64_img = base64.b64decode(data)
     img_path = os.path.join(path, f"{hash(time.time())}.png")
@@ -368,11 +487,15 @@ def clean_ansi_codes(input_string):
     return ansi_escape.sub('', input_string)
 
 
-def execute(code, kernel: CodeKernel):
-    msg = kernel.execute_code(code)
+def execute(code, kernel: CodeKernel, deadline=None):
+    msg = kernel.execute_code(code, deadline)
     return msg
 
 
+def execute_stream(code, kernel: CodeKernel, deadline=None):
+    return kernel.execute_code_stream(code, deadline)
+
+
 # @st.cache_resource
 def get_kernel():
     kernel = CodeKernel()
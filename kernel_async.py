@@ -0,0 +1,207 @@
+import asyncio
+import os
+import queue
+from subprocess import PIPE
+from typing import AsyncIterator, Optional, Tuple
+
+import jupyter_client
+from nbformat import v4 as nbf
+
+from kernel import CodeKernel, IPYKERNEL, inject_custom_show, outcome_error
+from kernel_supervisor import (CancelToken, INTERRUPT_GRACE, LIVENESS_INTERVAL, OUTCOME_CANCELLED, OUTCOME_DIED,
+                               OUTCOME_OK, OUTCOME_TIMEOUT)
+from logger import logger
+from utils.utils import check_install_kernel
+
+
+DEFAULT_MAX_EXE_TIME = 18000   # CodeKernel default
+KERNEL_READY_TIMEOUT = 120     # seconds a new kernel may take to answer its first request
+
+
+# ============================================================================
+#                         ASYNC CODE KERNEL
+# ============================================================================
+
+class AsyncCodeKernel:
+    """
+    asyncio-native CodeKernel on jupyter_client's AsyncKernelManager / AsyncKernelClient
+
+    execute_code is a coroutine with CodeKernel.execute_code's result, so one
+    event loop can keep many sessions' code running without a thread each:
+
+        kernel = await AsyncCodeKernel.create(session_cache_path=..., max_exe_time=...)
+        sign, text_to_llm, content_to_display = await kernel.execute_code(code)
+        await kernel.shutdown()
+
+    Timeouts, cancel tokens and kernel death end an execution like they do
+    for CodeKernel; cancelling the awaiting task interrupts the kernel.
+    Output parsing, images and the notebook are shared with CodeKernel.
+    """
+
+    def __init__(self, init_file_path: str = "./startup.py", session_cache_path: str = "",
+                 max_exe_time: float = DEFAULT_MAX_EXE_TIME, python_path: str = None, verbose: int = 1):
+        """
+        Args:
+            init_file_path: Startup file run in the kernel before the first request
+            session_cache_path: Folder of the session's plots, images and notebook
+            max_exe_time: Seconds an execution may run before the kernel is interrupted
+            python_path: Python environment of the kernel (the server's when omitted)
+            verbose: Print kernel start / shutdown messages
+        """
+        self.init_file_path = init_file_path
+        self.session_cache_path = session_cache_path
+        self.max_exe_time = max_exe_time
+        self.python_path = python_path
+        self.verbose = verbose
+        self.nb = nbf.new_notebook()
+        self.nb_path = os.path.join(session_cache_path, 'notebook.ipynb')
+        self.cancel_token: Optional[CancelToken] = None  # of the running code, see cancel()
+        self.kernel_manager: Optional[jupyter_client.AsyncKernelManager] = None
+        self.kernel = None
+        self._lock = None  # asyncio.Lock serializing executions, created on the kernel's loop
+
+    @classmethod
+    async def create(cls, **kwargs) -> 'AsyncCodeKernel':
+        """Start a kernel; takes __init__'s keyword arguments"""
+        kernel = cls(**kwargs)
+        await kernel.start()
+        return kernel
+
+    async def start(self, timeout: float = KERNEL_READY_TIMEOUT):
+        """Launch the kernel process and wait until it answers"""
+        await asyncio.to_thread(check_install_kernel, 'dsa')
+        env = dict(os.environ, DSA_SESSION_CACHE_PATH=self.session_cache_path)
+        if self.python_path is not None:
+            env.update(PATH=self.python_path + ":" + env.get("PATH", ""), PYTHONPATH=self.python_path)
+        self.kernel_manager = jupyter_client.AsyncKernelManager(kernel_name=IPYKERNEL,
+                                                                exec_files=[self.init_file_path])
+        await self.kernel_manager.start_kernel(stdout=PIPE, stderr=PIPE, env=env)
+        self.kernel = self.kernel_manager.client()
+        self.kernel.start_channels()
+        try:
+            # Output of a request sent before the kernel is ready can be lost on iopub
+            await self.kernel.wait_for_ready(timeout=timeout)
+        except Exception:
+            await self.shutdown()
+            raise
+        self._lock = asyncio.Lock()
+        if self.verbose:
+            print("Async code kernel started.")
+
+    async def iter_code_output(self, code, deadline=None, cancel: CancelToken = None) -> AsyncIterator[Tuple[str, str]]:
+        """Async generator of CodeKernel.iter_code_output's (mark, output) entries"""
+        code = inject_custom_show(code)
+        # Execution time: max_exe_time, capped by the turn's remaining budget
+        exe_time = deadline.timeout(self.max_exe_time) if deadline is not None else self.max_exe_time
+        cancel = cancel or CancelToken()
+        async with self._lock:
+            self.cancel_token = cancel
+            msg_id = self.kernel.execute(code)
+            loop = asyncio.get_running_loop()
+            end_time = loop.time() + exe_time
+            outcome = None
+            reason = None
+            try:
+                while outcome is None:
+                    now = loop.time()
+                    if reason is None and (cancel.cancelled or now >= end_time):
+                        # Interrupt, then keep collecting until the kernel settles
+                        reason = OUTCOME_CANCELLED if cancel.cancelled else OUTCOME_TIMEOUT
+                        await self.kernel_manager.interrupt_kernel()
+                        end_time = now + INTERRUPT_GRACE
+                    elif reason is not None and now >= end_time:
+                        outcome = reason  # the kernel did not answer the interrupt, keep what we have
+                        break
+                    try:
+                        iopub_msg = await self.kernel.get_iopub_msg(
+                            timeout=max(min(end_time - now, LIVENESS_INTERVAL), 0.01))
+                    except queue.Empty:
+                        if not await self.kernel_manager.is_alive():
+                            outcome = OUTCOME_DIED
+                        continue
+                    if iopub_msg['parent_header'].get('msg_id') != msg_id:
+                        continue  # left over from an earlier, abandoned execution
+                    for entry in self._parse_iopub_msg(iopub_msg):
+                        yield entry
+                    if iopub_msg['msg_type'] == 'status' and iopub_msg['content'].get('execution_state') == 'idle':
+                        outcome = reason or OUTCOME_OK
+            finally:
+                self.cancel_token = None
+                if outcome is None:
+                    # Task cancelled or generator closed: stop the code and let the kernel settle,
+                    # otherwise it aborts the next request queued behind the interrupted one
+                    await self._interrupt_and_settle(msg_id)
+
+        if outcome == OUTCOME_DIED:
+            logger.warning("Kernel process exited during execution")
+        if outcome != OUTCOME_OK:
+            yield ('error', outcome_error(outcome, exe_time))
+
+    async def execute_code_(self, code, deadline=None, cancel: CancelToken = None):
+        return [entry async for entry in self.iter_code_output(code, deadline, cancel)]
+
+    async def execute_code(self, code, deadline=None, cancel: CancelToken = None) -> Tuple[list, str, str]:
+        """Like CodeKernel.execute_code: (sign, text_to_llm, content_to_display)"""
+        result = await self.execute_code_(code, deadline, cancel)
+        return self._summarize_output(code, result)
+
+    def cancel(self):
+        """Stop the running code from any thread (noticed within LIVENESS_INTERVAL); its output so far is kept"""
+        token = self.cancel_token
+        if token is not None:
+            token.cancel()
+
+    async def interrupt(self):
+        await self.kernel_manager.interrupt_kernel()
+
+    async def restart(self):
+        await self.kernel_manager.restart_kernel()
+        await self.kernel.wait_for_ready(timeout=KERNEL_READY_TIMEOUT)
+
+    async def is_alive(self) -> bool:
+        return self.kernel_manager is not None and await self.kernel_manager.is_alive()
+
+    async def shutdown(self):
+        if self.kernel is not None:
+            self.kernel.stop_channels()
+        if self.kernel_manager is not None and await self.kernel_manager.is_alive():
+            await self.kernel_manager.shutdown_kernel(now=True)
+        if self.verbose:
+            print("Async code kernel shutdown.")
+
+    async def __aenter__(self):
+        if self.kernel is None:
+            await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.shutdown()
+
+    async def _interrupt_and_settle(self, msg_id):
+        try:
+            await self.kernel_manager.interrupt_kernel()
+            loop = asyncio.get_running_loop()
+            end_time = loop.time() + INTERRUPT_GRACE
+            while loop.time() < end_time:
+                iopub_msg = await self.kernel.get_iopub_msg(timeout=max(end_time - loop.time(), 0.01))
+                if (iopub_msg['parent_header'].get('msg_id') == msg_id and iopub_msg['msg_type'] == 'status'
+                        and iopub_msg['content'].get('execution_state') == 'idle'):
+                    break
+        except (queue.Empty, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.debug("Kernel did not settle after interrupt: %s", e)
+
+    # Output parsing, the LLM / display summary and the notebook are CodeKernel's
+    _parse_iopub_msg = CodeKernel._parse_iopub_msg
+    _summarize_output = CodeKernel._summarize_output
+    add_code_cell_to_notebook = CodeKernel.add_code_cell_to_notebook
+    add_code_cell_output_to_notebook = CodeKernel.add_code_cell_output_to_notebook
+    add_code_cell_error_to_notebook = CodeKernel.add_code_cell_error_to_notebook
+    add_image_to_notebook = CodeKernel.add_image_to_notebook
+    add_markdown_to_notebook = CodeKernel.add_markdown_to_notebook
+    write_to_notebook = CodeKernel.write_to_notebook
+
+
+async def aexecute(code, kernel: AsyncCodeKernel, deadline=None):
+    return await kernel.execute_code(code, deadline)
@@ -0,0 +1,329 @@
+import atexit
+import contextlib
+import importlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from jupyter_client import BlockingKernelClient
+from jupyter_client.connect import write_connection_file
+
+from kernel import CodeKernel
+from logger import logger
+
+
+PROVISIONING_SPAWN = 'spawn'   # one `python -m ipykernel` process per kernel (jupyter_client default)
+PROVISIONING_FORK = 'fork'     # kernels forked from a template process with the stack imported
+
+DEFAULT_KERNEL_PROVISIONING = PROVISIONING_SPAWN
+TEMPLATE_START_TIMEOUT = 300   # seconds the template may take to import the stack
+SHUTDOWN_GRACE = 5             # seconds between SIGTERM and SIGKILL of a forked kernel
+PARENT_POLL_INTERVAL = 1.0     # seconds between the template's checks that the application is alive
+SPAWN_TIMEOUT = 30             # seconds to wait for the template to answer a fork request
+KERNEL_READY_TIMEOUT = 60      # seconds a forked kernel may take to answer its first request
+# Imported lazily by every kernel at start-up; none of them starts a thread on import
+TEMPLATE_IMPORTS = ('ipykernel.kernelapp', 'ipykernel.ipkernel', 'ipykernel.zmqshell', 'ipykernel.debugger')
+
+
+# ============================================================================
+#                         TEMPLATE PROCESS
+# ============================================================================
+# Runs as `python kernel_forkserver.py <socket> <init file>` with the preload
+# code (IMPORT) on stdin. It imports ipykernel and executes the startup file
+# and preload code once, then forks a kernel per request. Children share the
+# imported modules copy-on-write; their own startup / preamble run finds
+# every module in sys.modules already.
+
+def _serve(socket_path: str, init_file_path: str):
+    preload = sys.stdin.read()
+    sys.stdin.close()
+
+    for module in TEMPLATE_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"Kernel template: could not preload {module}: {e}", file=sys.stderr)
+    from ipykernel.kernelapp import IPKernelApp
+    from traitlets.config import Config
+
+    # stdout is the "ready" handshake with the parent; preload output goes to stderr
+    namespace = {"__name__": "__dsa_template__"}
+    with contextlib.redirect_stdout(sys.stderr):
+        for code in (_read(init_file_path), preload):
+            try:
+                exec(compile(code, '<kernel preload>', 'exec'), namespace)
+            except Exception as e:
+                print(f"Kernel template: preload failed, continuing with what was imported: {e}")
+    del namespace
+
+    # Forked kernels are reaped automatically; restored to default in each child
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    server.settimeout(PARENT_POLL_INTERVAL)
+    parent_pid = os.getppid()
+    print("ready", flush=True)
+
+    while True:
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            # Exit with the application; the kernels' parent pollers then stop them too
+            if os.getppid() != parent_pid:
+                break
+            continue
+        conn.settimeout(None)
+        with conn:
+            request = json.loads(conn.makefile('r').readline())
+            if request.get('op') == 'exit':
+                break
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                conn.close()
+                _run_kernel(IPKernelApp, Config, init_file_path, request)
+            conn.sendall((json.dumps({"pid": pid}) + "\n").encode())
+    server.close()
+
+
+def _run_kernel(app_class, config_class, init_file_path: str, request: Dict):
+    """Child side of a fork: become an ipykernel serving request['connection_file']"""
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        os.chdir(request.get('cwd') or os.getcwd())
+        os.environ.update(request.get('env') or {})
+        devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, 0)
+        os.dup2(devnull, 1)
+
+        config = config_class()
+        config.IPKernelApp.exec_files = [init_file_path]
+        # Like spawned kernels, exit once the parent (this template) is gone
+        config.IPKernelApp.parent_handle = os.getppid()
+        app = app_class.instance(config=config)
+        app.initialize(['-f', request['connection_file']])
+        app.start()
+    finally:
+        os._exit(0)
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return ''
+
+
+# ============================================================================
+#                         FORK SERVER CLIENT
+# ============================================================================
+
+class ForkServer:
+    """
+    Starts the template process and asks it for new kernels
+
+    Forking skips interpreter start-up and the imports of torch, pandas,
+    sklearn and matplotlib, so a new kernel answers in a fraction of a
+    second (~0.3s) instead of the seconds a spawned one needs.
+    Kernels share the template's pages until they write to them.
+    """
+
+    def __init__(self, init_file_path: str = "./startup.py", preload: str = ''):
+        """
+        Args:
+            init_file_path: Startup file run in the template and in every kernel
+            preload: Code run once in the template to import the stack (IMPORT)
+        """
+        self.init_file_path = os.path.abspath(init_file_path)
+        self._dir = tempfile.mkdtemp(prefix='dsa-forkserver-')
+        self.socket_path = os.path.join(self._dir, 'server.sock')
+        self._lock = threading.Lock()
+        self.spawned = 0
+
+        start = time.monotonic()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self.socket_path, self.init_file_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.process.stdin.write(preload)
+        self.process.stdin.close()
+        # The template prints "ready" once its socket is listening ('' at EOF if it died)
+        handshake = []
+        reader = threading.Thread(target=lambda: handshake.append(self.process.stdout.readline()), daemon=True)
+        reader.start()
+        reader.join(TEMPLATE_START_TIMEOUT)
+        if not handshake or handshake[0].strip() != "ready" or self.process.poll() is not None:
+            self.stop()
+            raise RuntimeError("Kernel template process did not start")
+        logger.info("Kernel template process ready in %.1fs (pid %s)", time.monotonic() - start, self.process.pid)
+
+    def spawn(self, connection_file: str, env: Dict[str, str] = None) -> int:
+        """Fork a kernel serving connection_file; returns its pid"""
+        request = {"op": "spawn", "connection_file": connection_file, "env": env or {}, "cwd": os.getcwd()}
+        with self._lock:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.settimeout(SPAWN_TIMEOUT)
+                conn.connect(self.socket_path)
+                conn.sendall((json.dumps(request) + "\n").encode())
+                reply = json.loads(conn.makefile('r').readline())
+            self.spawned += 1
+        return reply['pid']
+
+    def new_kernel(self, session_cache_path: str = "", **kwargs) -> CodeKernel:
+        """CodeKernel on a newly forked kernel; takes CodeKernel's keyword arguments"""
+        manager = ForkedKernelManager(self, env={"DSA_SESSION_CACHE_PATH": session_cache_path})
+        kernel = CodeKernel(session_cache_path=session_cache_path, kernel_manager=manager,
+                            init_file_path=self.init_file_path, **kwargs)
+        # A forked kernel answers before the supervisor's iopub subscription is set up,
+        # so output of an immediate first request could be lost
+        try:
+            kernel.wait_ready(timeout=KERNEL_READY_TIMEOUT)
+        except Exception:
+            kernel.shutdown()
+            raise
+        return kernel
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self):
+        """Stop the template process; kernels forked from it exit within a second"""
+        if self.process.poll() is None:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                    conn.settimeout(1)
+                    conn.connect(self.socket_path)
+                    conn.sendall((json.dumps({"op": "exit"}) + "\n").encode())
+                self.process.wait(timeout=SHUTDOWN_GRACE)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+class ForkedKernelManager:
+    """
+    The part of jupyter_client.KernelManager CodeKernel uses, for a forked kernel
+
+    Each kernel gets its own connection file (fresh ports and key); signals
+    go straight to its pid.
+    """
+
+    def __init__(self, server: ForkServer, env: Dict[str, str] = None):
+        self.server = server
+        self.env = env or {}
+        self.connection_file, self._info = write_connection_file(
+            os.path.join(server._dir, f"kernel-{uuid.uuid4()}.json"),
+            ip='127.0.0.1', key=uuid.uuid4().hex.encode())
+        self.pid = server.spawn(self.connection_file, self.env)
+
+    def get_connection_info(self) -> Dict:
+        return dict(self._info)
+
+    def blocking_client(self) -> BlockingKernelClient:
+        client = BlockingKernelClient()
+        client.load_connection_info(self._info)
+        return client
+
+    def is_alive(self) -> bool:
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+
+    def interrupt_kernel(self):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGINT)
+
+    def shutdown_kernel(self, now: bool = False, restart: bool = False):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGKILL if now else signal.SIGTERM)
+            deadline = time.monotonic() + SHUTDOWN_GRACE
+            while self.is_alive() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if self.is_alive():
+                os.kill(self.pid, signal.SIGKILL)
+        if not restart and os.path.exists(self.connection_file):
+            os.unlink(self.connection_file)
+
+    def restart_kernel(self, now: bool = False):
+        """Fork a fresh kernel on the same connection file (the client stays connected)"""
+        self.shutdown_kernel(now=now, restart=True)
+        self.pid = self.server.spawn(self.connection_file, self.env)
+
+
+# ============================================================================
+#                         PROCESS-WIDE SERVER
+# ============================================================================
+
+_server: Optional[ForkServer] = None
+_server_failed = False  # a template that could not start is not retried on every kernel
+_server_lock = threading.Lock()
+
+
+def get_fork_server(config, preload: str = '') -> Optional[ForkServer]:
+    """
+    Process-wide fork server when kernel_provisioning is 'fork' in config.yaml
+
+    A template process that exited (e.g. OOM-killed) is replaced by a new one.
+
+    Returns:
+        The shared ForkServer, or None for spawned kernels (also where fork is
+        unavailable or the template cannot start)
+    """
+    global _server, _server_failed
+    provisioning = str(config.get('kernel_provisioning', DEFAULT_KERNEL_PROVISIONING)).lower()
+    if provisioning != PROVISIONING_FORK:
+        return None
+    if not hasattr(os, 'fork') or getattr(sys, 'frozen', False):
+        logger.warning("kernel_provisioning=fork needs os.fork and a Python interpreter, spawning kernels")
+        return None
+    with _server_lock:
+        if _server_failed:
+            return None
+        if _server is None or not _server.is_alive():
+            if _server is not None:
+                logger.warning("Kernel template process exited, starting a new one")
+            try:
+                _server = ForkServer(preload=preload)
+            except Exception as e:
+                logger.warning("Kernel fork server unavailable, spawning kernels: %s", e)
+                _server = None
+                _server_failed = True
+                return None
+            atexit.register(_server.stop)
+        return _server
+
+
+def fork_kernel_factory(config, preload: str = '') -> Callable[..., CodeKernel]:
+    """
+    Kernel factory for kernel_provisioning 'fork' (CodeKernel keyword arguments)
+
+    The fork server is looked up on every call rather than bound once, so the
+    process-wide KernelPool keeps working after the template was replaced; a
+    kernel that cannot be forked is spawned as a plain CodeKernel instead.
+    """
+    def new_kernel(**kwargs) -> CodeKernel:
+        server = get_fork_server(config, preload)
+        if server is not None:
+            try:
+                return server.new_kernel(**kwargs)
+            except Exception as e:
+                logger.warning("Could not fork a kernel, spawning one: %s", e)
+        return CodeKernel(**kwargs)
+    return new_kernel
+
+
+if __name__ == '__main__':
+    _serve(sys.argv[1], sys.argv[2])
@@ -0,0 +1,263 @@
+import atexit
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kernel import CodeKernel
+from logger import logger
+
+
+DEFAULT_KERNEL_POOL_SIZE = 0        # warm kernels kept ready; 0 starts every kernel on demand
+DEFAULT_KERNEL_MAX_IDLE = 3600      # seconds a warm kernel waits for a session before it is shut down
+DEFAULT_KERNEL_RECYCLE_AFTER = 1    # sessions a kernel serves before it is replaced (1 = never reused)
+DEFAULT_MAX_EXE_TIME = 18000        # CodeKernel default, overridden per acquire()
+START_RETRY_DELAY = 30              # seconds before the refill thread retries after a failed start
+KERNEL_READY_TIMEOUT = 120          # seconds a new kernel may take to answer its first request
+
+
+# ============================================================================
+#                         KERNEL POOL
+# ============================================================================
+
+class KernelPool:
+    """
+    Warm CodeKernel instances with startup.py and the IMPORT preamble already run
+
+    acquire() hands out a warm kernel - starting one in the caller's thread
+    only when none is ready - and a background thread refills the pool to
+    `size`. release() gives a kernel back: it is reset (%reset -f, startup
+    and preamble rerun) for the next session until it served recycle_after
+    sessions, then shut down. Sessions may keep their kernel for good, so
+    handed-out kernels do not count towards `size`; a released kernel is
+    reused only when the pool has room for it. Warm kernels no session
+    asked for within max_idle seconds are shut down and only replaced once
+    sessions start again, so an idle server does not hold kernels forever.
+    """
+
+    def __init__(self, size: int = DEFAULT_KERNEL_POOL_SIZE, max_idle: float = DEFAULT_KERNEL_MAX_IDLE,
+                 recycle_after: int = DEFAULT_KERNEL_RECYCLE_AFTER, preamble: str = '',
+                 max_exe_time: float = DEFAULT_MAX_EXE_TIME, kernel_factory: Callable[..., CodeKernel] = CodeKernel):
+        """
+        Args:
+            size: Warm kernels to keep ready
+            max_idle: Seconds a warm kernel may wait unused (0 = forever)
+            recycle_after: Sessions a kernel serves before it is shut down
+            preamble: Code run in every kernel before it is handed out (IMPORT)
+            max_exe_time: Execution timeout of kernels started by the pool
+            kernel_factory: Starts a kernel from CodeKernel keyword arguments
+                (CodeKernel, or ForkServer.new_kernel for forked kernels)
+        """
+        self.size = max(int(size), 0)
+        self.max_idle = max_idle
+        self.recycle_after = max(int(recycle_after), 1)
+        self.preamble = preamble
+        self.max_exe_time = max_exe_time
+        self.kernel_factory = kernel_factory
+        self._idle: List[Tuple[CodeKernel, float]] = []  # (kernel, warm since), oldest first
+        self._uses: Dict[CodeKernel, int] = {}
+        self._starting = 0
+        self._demand = True     # False after idle kernels expired, until the next acquire()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {"hits": 0, "misses": 0, "started": 0, "start_failures": 0,
+                       "reused": 0, "recycled": 0, "expired": 0}
+        self._thread = threading.Thread(target=self._refill_loop, name='kernel-pool', daemon=True)
+        self._thread.start()
+
+    def acquire(self, session_cache_path: str, max_exe_time: float = None) -> CodeKernel:
+        """
+        Kernel for a session, bound to its cache folder
+
+        Args:
+            session_cache_path: Folder of the session's plots, images and notebook
+            max_exe_time: Execution timeout of the session (pool default when omitted)
+        """
+        while True:
+            with self._cond:
+                self._demand = True
+                kernel = self._idle.pop(0)[0] if self._idle else None
+                self._stats["hits" if kernel is not None else "misses"] += 1
+                if kernel is not None:
+                    self._hand_out(kernel)
+                self._cond.notify_all()
+            if kernel is None:
+                kernel = self._start_kernel()
+                with self._cond:
+                    self._hand_out(kernel)
+                break
+            try:
+                if not kernel.kernel_manager.is_alive():
+                    raise RuntimeError("kernel is not running")
+                # Warm kernels were started by the refill thread
+                kernel.reconnect()
+                break
+            except Exception as e:
+                logger.warning("Warm kernel unusable, taking another one: %s", e)
+                self._discard(kernel)
+
+        kernel.max_exe_time = self.max_exe_time if max_exe_time is None else max_exe_time
+        kernel.bind_session(session_cache_path)
+        return kernel
+
+    def release(self, kernel: CodeKernel):
+        """Give a session's kernel back; it is reset for reuse or shut down in the background"""
+        with self._cond:
+            # Reused only into a free slot - the refill thread keeps the pool at size without it
+            reuse = (not self._closed and self._uses.get(kernel, 0) < self.recycle_after
+                     and self._filled() < self.size)
+            if reuse:
+                self._starting += 1
+            self._cond.notify_all()
+        target = self._recycle if reuse else self._discard
+        threading.Thread(target=target, args=(kernel,), name='kernel-pool-release', daemon=True).start()
+
+    def close(self):
+        """Stop refilling and shut down the warm kernels (kernels handed out are left alone)"""
+        with self._cond:
+            self._closed = True
+            idle = [kernel for kernel, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for kernel in idle:
+            self._discard(kernel)
+
+    def stats(self) -> Dict[str, int]:
+        """Warm / starting kernels and hit, start, reuse and expiry counters"""
+        with self._cond:
+            return dict(self._stats, warm=len(self._idle), starting=self._starting, size=self.size)
+
+    def _start_kernel(self) -> CodeKernel:
+        kernel = self.kernel_factory(max_exe_time=self.max_exe_time, verbose=0)
+        try:
+            # Output of a request sent before the kernel is ready can be lost on iopub
+            kernel.wait_ready(timeout=KERNEL_READY_TIMEOUT)
+            if self.preamble:
+                kernel.run_preamble(self.preamble)
+        except Exception:
+            self._discard(kernel)
+            raise
+        with self._cond:
+            self._stats["started"] += 1
+        return kernel
+
+    def _recycle(self, kernel: CodeKernel):
+        try:
+            if not kernel.kernel_manager.is_alive():
+                raise RuntimeError("kernel is not running")
+            kernel.reconnect()
+            kernel.reset()
+        except Exception as e:
+            logger.warning("Could not reset kernel for reuse, shutting it down: %s", e)
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify_all()
+            self._discard(kernel)
+            return
+        self._add_warm(kernel, "reused")
+
+    def _add_warm(self, kernel: CodeKernel, counter: str = None):
+        with self._cond:
+            self._starting -= 1
+            closed = self._closed
+            if not closed:
+                self._idle.append((kernel, time.monotonic()))
+                if counter:
+                    self._stats[counter] += 1
+            self._cond.notify_all()
+        if closed:
+            self._discard(kernel)
+
+    def _discard(self, kernel: CodeKernel):
+        with self._cond:
+            if self._uses.pop(kernel, 0) >= self.recycle_after:
+                self._stats["recycled"] += 1
+        try:
+            kernel.shutdown()
+        except Exception as e:
+            logger.debug("Kernel shutdown failed: %s", e)
+
+    def _hand_out(self, kernel: CodeKernel):
+        """Count a session of kernel (lock held)"""
+        self._uses[kernel] = self._uses.get(kernel, 0) + 1
+
+    def _filled(self) -> int:
+        """Pool slots taken: warm and starting (or resetting) kernels (lock held)"""
+        return len(self._idle) + self._starting
+
+    def _take_expired(self) -> List[CodeKernel]:
+        """Remove warm kernels idle for longer than max_idle (lock held)"""
+        if not self.max_idle or not self._idle:
+            return []
+        cutoff = time.monotonic() - self.max_idle
+        expired = [kernel for kernel, since in self._idle if since <= cutoff]
+        if expired:
+            self._idle = [(kernel, since) for kernel, since in self._idle if since > cutoff]
+            self._stats["expired"] += len(expired)
+            self._demand = False
+        return expired
+
+    def _wait_time(self) -> Optional[float]:
+        """Seconds until the oldest warm kernel expires (lock held; None = no expiry pending)"""
+        if not self.max_idle or not self._idle:
+            return None
+        return max(self._idle[0][1] + self.max_idle - time.monotonic(), 0.0)
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                expired = self._take_expired()
+                if self._closed:
+                    return
+                start = self._demand and self._filled() < self.size
+                if start:
+                    self._starting += 1
+                elif not expired:
+                    self._cond.wait(timeout=self._wait_time())
+            for kernel in expired:
+                self._discard(kernel)
+            if not start:
+                continue
+            try:
+                kernel = self._start_kernel()
+            except Exception as e:
+                logger.warning("Could not start a warm kernel, retrying in %ss: %s", START_RETRY_DELAY, e)
+                with self._cond:
+                    self._starting -= 1
+                    self._stats["start_failures"] += 1
+                    self._cond.wait(timeout=START_RETRY_DELAY)
+                continue
+            self._add_warm(kernel)
+
+
+# ============================================================================
+#                         PROCESS-WIDE POOL
+# ============================================================================
+
+_pool: Optional[KernelPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_kernel_pool(config, preamble: str = '',
+                    kernel_factory: Callable[..., CodeKernel] = CodeKernel) -> Optional[KernelPool]:
+    """
+    Process-wide kernel pool configured by kernel_pool_* in config.yaml
+
+    Returns:
+        The shared KernelPool, or None when kernel_pool_size is 0
+    """
+    global _pool
+    size = config.get('kernel_pool_size', DEFAULT_KERNEL_POOL_SIZE) or 0
+    if size <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = KernelPool(
+                size=size,
+                max_idle=config.get('kernel_pool_max_idle', DEFAULT_KERNEL_MAX_IDLE),
+                recycle_after=config.get('kernel_pool_recycle_after', DEFAULT_KERNEL_RECYCLE_AFTER),
+                preamble=preamble,
+                max_exe_time=config.get('max_exe_time', DEFAULT_MAX_EXE_TIME),
+                kernel_factory=kernel_factory
+            )
+            atexit.register(_pool.close)
+        return _pool
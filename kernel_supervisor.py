@@ -0,0 +1,464 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import zmq
+from jupyter_client.session import Session
+
+from logger import logger
+
+
+INTERRUPT_GRACE = 10       # seconds to wait for the kernel to go idle after an interrupt
+LIVENESS_INTERVAL = 1.0    # seconds between checks that a busy kernel's process is alive
+JOIN_TIMEOUT = 60          # seconds a kernel may take to answer on new supervisor sockets
+JOIN_PROBE_INTERVAL = 0.2  # seconds between kernel_info probes while connecting
+
+OUTCOME_OK = 'ok'                # the kernel went idle
+OUTCOME_TIMEOUT = 'timeout'      # out of time: interrupted, output is partial
+OUTCOME_CANCELLED = 'cancelled'  # cancelled by the caller: interrupted, output is partial
+OUTCOME_DIED = 'died'            # the kernel process exited during execution
+
+
+class CancelToken:
+    """Cancels an execution from any thread; the supervisor interrupts the kernel at once"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Call callback on cancel (at once if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class KernelExecution:
+    """
+    One execute request tracked by the supervisor
+
+    Iterating it yields the request's iopub messages as they arrive and
+    stops when the execution ended (the kernel went idle and sent its
+    reply); `outcome` then tells how and `reply` holds the reply content.
+    """
+
+    def __init__(self, kernel, timeout: float, cancel: CancelToken):
+        self.kernel = kernel
+        self.msg_id: Optional[str] = None
+        self.timeout = timeout
+        self.cancel = cancel
+        self.started = time.monotonic()
+        self.end_time = self.started + timeout
+        self.interrupted = False
+        self.outcome: Optional[str] = None
+        self.reply: Optional[dict] = None  # content of the execute_reply
+        self._idle = False
+        self._reason: Optional[str] = None  # OUTCOME_TIMEOUT / OUTCOME_CANCELLED once interrupted
+        self._messages = queue.Queue()
+        self._done = threading.Event()
+
+    def __iter__(self):
+        while True:
+            msg = self._messages.get()
+            if msg is None:
+                return
+            yield msg
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the execution ended; False on timeout"""
+        return self._done.wait(timeout)
+
+    def _finish(self, outcome: str):
+        self.outcome = outcome
+        self._done.set()
+        self._messages.put(None)
+
+
+class _KernelChannel:
+    """The supervisor's iopub subscription and shell socket of one kernel"""
+
+    def __init__(self, kernel, context: zmq.Context):
+        info = kernel.kernel_manager.get_connection_info()
+        key = info.get('key', b'')
+        self.kernel = kernel
+        # Own session: deserializing in the poll thread must not touch the client's
+        self.session = Session(key=key.encode() if isinstance(key, str) else key,
+                               signature_scheme=info.get('signature_scheme', 'hmac-sha256'))
+        transport = info.get('transport', 'tcp')
+        separator = ':' if transport == 'tcp' else '-'
+        self.socket = context.socket(zmq.SUB)
+        self.socket.linger = 0
+        self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.socket.connect(f"{transport}://{info['ip']}{separator}{info['iopub_port']}")
+        # Requests go out on a shell socket of our own, so every reply is read here
+        self.shell = context.socket(zmq.DEALER)
+        self.shell.linger = 0
+        self.shell.connect(f"{transport}://{info['ip']}{separator}{info['shell_port']}")
+        self.outbox: List[dict] = []  # requests for the poll thread to send (zmq sockets are single-threaded)
+        self.iopub_seen = False
+        self.shell_seen = False
+        self.joined = threading.Event()  # set once both sockets received a message
+        self.executions: Dict[str, KernelExecution] = {}
+        self.next_liveness_check = 0.0
+
+
+# ============================================================================
+#                         KERNEL SUPERVISOR
+# ============================================================================
+
+class KernelSupervisor:
+    """
+    Runs the code of any number of kernels and reads their output from one thread
+
+    Each watched kernel gets an iopub subscription and a shell socket of its
+    own in a single zmq.Poller. The poll thread sends the requests, routes
+    output and replies to the execution that sent them and enforces its deadline and cancel token by interrupting the
+    kernel; an execution whose kernel process exits ends as OUTCOME_DIED
+    instead of waiting for its timeout. Callers block only on their own
+    execution's message queue.
+    """
+
+    def __init__(self):
+        self._context = zmq.Context()
+        self._lock = threading.Lock()
+        self._channels: Dict[object, _KernelChannel] = {}
+        self._added: List[_KernelChannel] = []
+        self._removed: List[_KernelChannel] = []
+        self._closed = False
+        self._stats = {"executions": 0, OUTCOME_OK: 0, OUTCOME_TIMEOUT: 0, OUTCOME_CANCELLED: 0,
+                       OUTCOME_DIED: 0, "messages": 0, "interrupts": 0}
+        # Wakes the poll thread when kernels, executions or cancellations change
+        self._wake_address = f"inproc://kernel-supervisor-{id(self)}"
+        self._wake_recv = self._context.socket(zmq.PULL)
+        self._wake_recv.bind(self._wake_address)
+        self._wake_send = self._context.socket(zmq.PUSH)
+        self._wake_send.connect(self._wake_address)
+        self._thread = threading.Thread(target=self._poll_loop, name='kernel-supervisor', daemon=True)
+        self._thread.start()
+
+    def watch(self, kernel):
+        """Subscribe to a CodeKernel's iopub output (again after a restart)"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Kernel supervisor is closed")
+            old = self._channels.pop(kernel, None)
+            executions = []
+            if old is not None:
+                self._removed.append(old)
+                executions = list(old.executions.values())
+                old.executions.clear()
+            channel = _KernelChannel(kernel, self._context)
+            self._channels[kernel] = channel
+            self._added.append(channel)
+            self._wake()
+        for execution in executions:
+            execution._finish(OUTCOME_CANCELLED)
+
+    def unwatch(self, kernel):
+        """Stop reading a kernel's output; its running executions end as cancelled"""
+        with self._lock:
+            channel = self._channels.pop(kernel, None)
+            if channel is None:
+                return
+            self._removed.append(channel)
+            executions = list(channel.executions.values())
+            channel.executions.clear()
+            self._wake()
+        for execution in executions:
+            execution._finish(OUTCOME_CANCELLED)
+
+    def execute(self, kernel, code: str, timeout: float, cancel: CancelToken = None,
+                silent: bool = False) -> KernelExecution:
+        """
+        Send code to a watched kernel and track it
+
+        Args:
+            kernel: CodeKernel passed to watch()
+            code: Code to execute
+            timeout: Seconds before the kernel is interrupted
+            cancel: Token cancelling the execution from another thread
+            silent: Run without output or history (session setup code)
+        """
+        channel = self._channel(kernel)
+        execution = KernelExecution(kernel, timeout, cancel or CancelToken())
+        if not self._join(channel):
+            execution._finish(OUTCOME_DIED)
+            self._count(OUTCOME_DIED)
+            return execution
+        if not channel.joined.is_set():
+            logger.warning("Kernel sockets not confirmed after %ss, output may be incomplete", JOIN_TIMEOUT)
+
+        msg = channel.session.msg('execute_request', dict(
+            code=code, silent=silent, store_history=not silent, user_expressions={},
+            allow_stdin=False, stop_on_error=True))
+        execution.msg_id = msg['header']['msg_id']
+        with self._lock:
+            # Routed before the poll thread sends it, so no output can arrive unclaimed
+            channel.executions[execution.msg_id] = execution
+            channel.outbox.append(msg)
+            self._stats["executions"] += 1
+            self._wake()
+        execution.cancel.add_callback(self._wake_locked)
+        return execution
+
+    def wait_ready(self, kernel, timeout: float = JOIN_TIMEOUT):
+        """Block until a watched kernel answers requests and its output reaches the supervisor"""
+        channel = self._channel(kernel)
+        if not self._join(channel, timeout):
+            raise RuntimeError("Kernel process exited before it was ready")
+        if not channel.joined.is_set():
+            raise RuntimeError(f"Kernel did not answer within {timeout}s")
+
+    def close(self):
+        """Stop the poll thread; running executions end as cancelled"""
+        with self._lock:
+            if self._closed:
+                return
+            self._wake()
+            self._closed = True
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, int]:
+        """Watched kernels, running executions, outcome and message counters"""
+        with self._lock:
+            running = sum(len(channel.executions) for channel in self._channels.values())
+            return dict(self._stats, kernels=len(self._channels), running=running)
+
+    def _channel(self, kernel) -> _KernelChannel:
+        with self._lock:
+            channel = self._channels.get(kernel)
+        if channel is None:
+            raise RuntimeError("Kernel is not watched by the supervisor")
+        return channel
+
+    def _join(self, channel: _KernelChannel, timeout: float = JOIN_TIMEOUT) -> bool:
+        """
+        Wait until both sockets receive messages (a SUB socket misses what is sent before
+        it is connected); False if the kernel process is gone, True otherwise (also on timeout)
+        """
+        deadline = time.monotonic() + timeout
+        while not channel.joined.is_set():
+            if not channel.kernel.kernel_manager.is_alive():
+                return False
+            if time.monotonic() >= deadline:
+                break
+            # Any request is answered on shell and makes the kernel publish busy / idle status on iopub
+            with self._lock:
+                channel.outbox.append(channel.session.msg('kernel_info_request'))
+                self._wake()
+            channel.joined.wait(JOIN_PROBE_INTERVAL)
+        return True
+
+    def _wake(self):
+        """Interrupt the poll (lock held: the PUSH socket is shared by caller threads)"""
+        if not self._closed:
+            self._wake_send.send(b'', zmq.NOBLOCK)
+
+    def _wake_locked(self):
+        with self._lock:
+            self._wake()
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _poll_loop(self):
+        poller = zmq.Poller()
+        poller.register(self._wake_recv, zmq.POLLIN)
+        sockets: Dict[zmq.Socket, _KernelChannel] = {}
+        while True:
+            with self._lock:
+                closed = self._closed
+                for channel in self._removed:
+                    for sock in (channel.socket, channel.shell):
+                        if sock in sockets:
+                            poller.unregister(sock)
+                            del sockets[sock]
+                        sock.close()
+                self._removed.clear()
+                for channel in self._added:
+                    for sock in (channel.socket, channel.shell):
+                        poller.register(sock, zmq.POLLIN)
+                        sockets[sock] = channel
+                self._added.clear()
+                channels = set(sockets.values())
+                outgoing = []
+                for channel in channels:
+                    outgoing.extend((channel, msg) for msg in channel.outbox)
+                    channel.outbox.clear()
+                busy = [channel for channel in channels if channel.executions]
+                timeout = self._poll_timeout(busy)
+            if closed:
+                break
+
+            for channel, msg in outgoing:
+                channel.session.send(channel.shell, msg)
+            ready = dict(poller.poll(timeout))
+            if self._wake_recv in ready:
+                while self._wake_recv.poll(0):
+                    self._wake_recv.recv()
+            for sock, channel in sockets.items():
+                if sock in ready:
+                    if sock is channel.shell:
+                        self._read_replies(channel)
+                    else:
+                        self._read(channel)
+            now = time.monotonic()
+            for channel in busy:
+                self._check(channel, now)
+
+        for channel in set(sockets.values()):
+            for execution in list(channel.executions.values()):
+                execution._finish(OUTCOME_CANCELLED)
+            channel.socket.close()
+            channel.shell.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+        self._context.term()
+
+    @staticmethod
+    def _poll_timeout(busy: List[_KernelChannel]) -> Optional[int]:
+        """Milliseconds until the next deadline or liveness check of a busy kernel (lock held; None = none)"""
+        if not busy:
+            return None
+        now = time.monotonic()
+        soonest = min(min(channel.next_liveness_check for channel in busy),
+                      min(execution.end_time for channel in busy for execution in channel.executions.values()))
+        return max(int((soonest - now) * 1000), 0)
+
+    @staticmethod
+    def _receive(channel: _KernelChannel, sock: zmq.Socket):
+        """Messages waiting on one of a kernel's sockets"""
+        while True:
+            try:
+                frames = sock.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            if sock is channel.shell:
+                channel.shell_seen = True
+            else:
+                channel.iopub_seen = True
+            if channel.shell_seen and channel.iopub_seen:
+                channel.joined.set()
+            try:
+                _, frames = channel.session.feed_identities(frames)
+                yield channel.session.deserialize(frames)
+            except Exception as e:
+                logger.debug("Dropped undecodable kernel message: %s", e)
+
+    def _read(self, channel: _KernelChannel):
+        for msg in self._receive(channel, channel.socket):
+            with self._lock:
+                execution = channel.executions.get(msg['parent_header'].get('msg_id'))
+                if execution is None:
+                    continue  # output of requests not sent through the supervisor
+                self._stats["messages"] += 1
+                if msg['msg_type'] == 'status' and msg['content'].get('execution_state') == 'idle':
+                    execution._idle = True
+                settled = self._settled(channel, execution)
+            execution._messages.put(msg)
+            if settled:
+                self._settle(execution)
+
+    def _read_replies(self, channel: _KernelChannel):
+        for msg in self._receive(channel, channel.shell):
+            with self._lock:
+                execution = channel.executions.get(msg['parent_header'].get('msg_id'))
+                if execution is None:
+                    continue  # kernel_info probes, or a reply that came after its execution was given up
+                execution.reply = msg['content']
+                settled = self._settled(channel, execution)
+            if settled:
+                self._settle(execution)
+
+    @staticmethod
+    def _settled(channel: _KernelChannel, execution: KernelExecution) -> bool:
+        """Stop tracking an execution once it is idle and answered (lock held)"""
+        if execution._idle and execution.reply is not None:
+            del channel.executions[execution.msg_id]
+            return True
+        return False
+
+    def _settle(self, execution: KernelExecution):
+        outcome = execution._reason or OUTCOME_OK
+        execution._finish(outcome)
+        self._count(outcome)
+
+    def _check(self, channel: _KernelChannel, now: float):
+        """Enforce deadlines and cancel tokens of a kernel's executions, and notice its death"""
+        if now >= channel.next_liveness_check:
+            channel.next_liveness_check = now + LIVENESS_INTERVAL
+            try:
+                alive = channel.kernel.kernel_manager.is_alive()
+            except Exception as e:
+                logger.debug("Kernel liveness check failed: %s", e)
+                alive = True
+            if not alive:
+                with self._lock:
+                    executions = list(channel.executions.values())
+                    channel.executions.clear()
+                for execution in executions:
+                    execution._finish(OUTCOME_DIED)
+                self._count(OUTCOME_DIED, len(executions))
+                if executions:
+                    logger.warning("Kernel process exited during execution")
+                return
+
+        with self._lock:
+            executions = list(channel.executions.values())
+        for execution in executions:
+            if not execution.interrupted and (execution.cancel.cancelled or now >= execution.end_time):
+                # Interrupt, then keep collecting until the kernel settles (a request queued
+                # behind an interrupted one is aborted if it arrives too early)
+                execution._reason = OUTCOME_CANCELLED if execution.cancel.cancelled else OUTCOME_TIMEOUT
+                execution.interrupted = True
+                execution.end_time = now + INTERRUPT_GRACE
+                self._count("interrupts")
+                try:
+                    channel.kernel.kernel_manager.interrupt_kernel()
+                except Exception as e:
+                    logger.warning("Could not interrupt kernel: %s", e)
+            elif execution.interrupted and now >= execution.end_time:
+                # The kernel did not answer the interrupt - give up on it, keep what we have
+                with self._lock:
+                    channel.executions.pop(execution.msg_id, None)
+                execution._finish(execution._reason)
+                self._count(execution._reason)
+
+
+# ============================================================================
+#                         PROCESS-WIDE SUPERVISOR
+# ============================================================================
+
+_supervisor: Optional[KernelSupervisor] = None
+_supervisor_lock = threading.Lock()
+
+
+def get_kernel_supervisor() -> KernelSupervisor:
+    """Process-wide supervisor shared by every CodeKernel"""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = KernelSupervisor()
+        return _supervisor
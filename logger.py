@@ -1,5 +1,7 @@
+import json
 import logging
 import os
+import random
 
 
 def setup_logger(level=None):
@@ -12,12 +14,40 @@ def setup_logger(level=None):
 
     logger = logging.getLogger('dsa_logger')
     logger.setLevel(level)
-    handler = logging.StreamHandler()
-    handler.setLevel(level)
-    formatter = logging.Formatter('%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setLevel(level)
+        formatter = logging.Formatter('%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
     return logger
 
 
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
+
+# Share of payload dumps written at DEBUG level (DSA_LOG_PAYLOAD_SAMPLE=1 logs every payload)
+PAYLOAD_SAMPLE_RATE = float(os.getenv('DSA_LOG_PAYLOAD_SAMPLE', '0.1').strip())
+
+
+class _LazyJson:
+    """Serializes its value only if a handler actually formats the record"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, ensure_ascii=False, default=str)
+
+
+def log_payload(label, payload, sample_rate=None):
+    """Log a sampled full dump of an LLM payload / message history at DEBUG level
+
+    Costs one level check when debug logging is off.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    rate = PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.debug("%s: %s", label, _LazyJson(payload), stacklevel=2)
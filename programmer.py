@@ -3,7 +3,9 @@ from prompt_engineering.prompts import PROGRAMMER_PROMPT
 #from knw_in import retrieval_knowledge
 #from snowflake_cortex_client import SnowflakeCortexClient
 #from horizon_client import SFAssistClient
-from sfassist_client import SFAssistClient
+from sfassist_registry import get_shared_client, get_shared_async_client
+from sfassist_routing import ROLE_PROGRAMMER
+from logger import logger, log_payload
 import os
 import traceback
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -12,8 +14,9 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 class Programmer:
 
     def __init__(self, api_key, model=None, base_url=None, config=None):
-        # Use Snowflake Cortex
-        self.client = SFAssistClient(config)
+        # Use Snowflake Cortex (one shared client per endpoint/app/model)
+        self.client = get_shared_client(config)
+        self.aclient = get_shared_async_client(config)
         self.is_anthropic = False
         # Get model from config dynamically
         if model:
@@ -26,12 +29,14 @@ class Programmer:
             self.model = 'claude-4-sonnet'  # Only if NO config at all
         self.messages = []
         self.function_repository = {}
+        self.session_id = None  # set by Conversation, attributes token usage
         self.last_snaps = None
 
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
-    def _call_chat_model(self, functions=None, include_functions=False, retrieval=False):
+    def _call_chat_model(self, functions=None, include_functions=False, retrieval=False,
+                         role=ROLE_PROGRAMMER, escalate=False, deadline=None):
         if retrieval:
             snaps = retrieval_knowledge(self.messages[-1]["content"])
             if snaps:
@@ -43,6 +48,10 @@ class Programmer:
         params = {
             "model": self.model,
             "messages": self.messages,
+            "role": role,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
         }
 
         if include_functions:
@@ -58,9 +67,9 @@ class Programmer:
             print(f"Error calling chat model: {e}")
             return None
 
-    def _call_chat_model_streaming(self, functions=None, include_functions=False, retrieval=False, kernel=None):
-        print(f"DEBUG: _call_chat_model_streaming called with model={self.model}")
-        print(f"DEBUG: Messages: {self.messages}")
+    def _call_chat_model_streaming(self, functions=None, include_functions=False, retrieval=False, kernel=None,
+                                   role=ROLE_PROGRAMMER, escalate=False, deadline=None):
+        logger.debug("_call_chat_model_streaming called with model=%s, %d messages", self.model, len(self.messages))
         temp = self.messages[-1]["content"]
         if retrieval:
             snaps = retrieval_knowledge(self.messages[-1]["content"], kernel=kernel)
@@ -76,28 +85,95 @@ class Programmer:
             "model": self.model,
             "messages": self.messages,
             "max_tokens":4096,
-            "stream": True
+            "stream": True,
+            "role": role,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
         }
 
         if include_functions:
             params['functions'] = functions
             params['function_call'] = "auto"
 
-        print(f"DEBUG: About to call API with params: {params}")
+        log_payload("Programmer streaming params", params)
         try:
             # Use OpenAI API format
             stream = self.client.chat.completions.create(**params)
-            print("DEBUG: OpenAI API call successful, processing stream")
+            logger.debug("API call successful, processing stream")
             self.messages[-1]["content"] = temp
             for chunk in stream:
+                if deadline is not None and deadline.expired:
+                    # Out of turn budget - keep what has streamed so far
+                    logger.warning("Turn deadline reached, truncating the %s response", role)
+                    if hasattr(stream, 'close'):
+                        stream.close()
+                    break
                 if hasattr(chunk, 'choices') and chunk.choices[0].delta.content is not None:
                     chunk_message = chunk.choices[0].delta.content
-                    print(f"DEBUG: Received chunk: {chunk_message}")
+                    logger.debug("Received chunk: %r", chunk_message)
                     yield chunk_message
         except Exception as e:
             print(f"Error calling chat model: {e}")
             traceback.print_exc()
             return None
+
+    async def _acall_chat_model(self, functions=None, include_functions=False, role=ROLE_PROGRAMMER,
+                                escalate=False, deadline=None):
+        params = {
+            "model": self.model,
+            "messages": self.messages,
+            "role": role,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
+        }
+
+        if include_functions:
+            params['functions'] = functions
+            params['function_call'] = "auto"
+
+        try:
+            response = await self.aclient.chat.completions.create(**params)
+            usage = response.usage
+            logger.debug("Prompt tokens: %s, completion tokens: %s, total tokens: %s",
+                         usage.prompt_tokens, usage.completion_tokens, usage.total_tokens)
+            return response
+        except Exception as e:
+            print(f"Error calling chat model: {e}")
+            return None
+
+    async def _acall_chat_model_streaming(self, functions=None, include_functions=False, role=ROLE_PROGRAMMER,
+                                          escalate=False, deadline=None):
+        params = {
+            "model": self.model,
+            "messages": self.messages,
+            "max_tokens":4096,
+            "stream": True,
+            "role": role,
+            "escalate": escalate,
+            "deadline": deadline,
+            "session": self.session_id,
+        }
+
+        if include_functions:
+            params['functions'] = functions
+            params['function_call'] = "auto"
+
+        try:
+            stream = await self.aclient.chat.completions.create(**params)
+            async for chunk in stream:
+                if deadline is not None and deadline.expired:
+                    logger.warning("Turn deadline reached, truncating the %s response", role)
+                    if hasattr(stream, 'aclose'):
+                        await stream.aclose()
+                    break
+                if hasattr(chunk, 'choices') and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            print(f"Error calling chat model: {e}")
+            traceback.print_exc()
+
     def clear(self):
         self.messages = [
             {
@@ -0,0 +1,301 @@
+import asyncio
+import ssl
+from typing import Dict, List
+
+from sfassist_client import SFAssistClient, StreamingChunk, REQUEST_TIMEOUT
+from sfassist_pool import DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, DEFAULT_POOL_IDLE_TIMEOUT
+from sfassist_stream import is_streaming_response, aiter_stream_deltas
+from sfassist_cache import payload_cache_key
+from sfassist_singleflight import AsyncSingleFlight
+from sfassist_retry import acall_with_retry
+from sfassist_ratelimit import PRIORITY_INTERACTIVE
+from sfassist_tokens import count_payload_tokens
+from sfassist_hedge import ahedged_call
+from sfassist_batch import arun_batch, DEFAULT_BATCH_CONCURRENCY
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+
+# ============================================================================
+#                         ASYNC SF ASSIST CLIENT
+# ============================================================================
+
+class AsyncSFAssistClient:
+    """
+    asyncio-native SF Assist client
+
+    Mirrors SFAssistClient.chat.completions.create as a coroutine, so one event
+    loop can keep many sessions' LLM calls in flight without a thread each:
+
+        response = await client.chat.completions.create(model=..., messages=...)
+        stream = await client.chat.completions.create(model=..., messages=..., stream=True)
+        async for chunk in stream:
+            ...
+
+    Config parsing, payload building, credentials and response parsing are
+    delegated to a sync SFAssistClient; only the transport is async (httpx).
+    """
+
+    def __init__(self, config_or_client, base_url: str = None, model: str = None):
+        """
+        Initialize async SF Assist client
+
+        Args:
+            config_or_client: An existing SFAssistClient to wrap, or anything SFAssistClient accepts
+            base_url: Base URL for the SF Assist endpoint (optional if config provided)
+            model: Model name to use (optional, defaults from config)
+        """
+        if hasattr(config_or_client, '_build_payload'):
+            self.sync_client = config_or_client
+        else:
+            self.sync_client = SFAssistClient(config_or_client, base_url, model)
+        self._http = None
+        self._http_loop = None
+        self.inflight = AsyncSingleFlight() if self.sync_client.inflight is not None else None
+        self.chat = self.ChatCompletion(self)
+
+    @property
+    def base_url(self) -> str:
+        return self.sync_client.base_url
+
+    @property
+    def model(self) -> str:
+        return self.sync_client.model
+
+    def _get_http(self):
+        """httpx.AsyncClient bound to the running event loop (created lazily)"""
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpx is required for AsyncSFAssistClient (pip install httpx)")
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop or self._http.is_closed:
+            client = self.sync_client
+            pool_connections = client._get_option('pool_connections', DEFAULT_POOL_CONNECTIONS)
+            pool_maxsize = client._get_option('pool_maxsize', DEFAULT_POOL_MAXSIZE)
+            limits = httpx.Limits(
+                max_connections=pool_connections * pool_maxsize,
+                max_keepalive_connections=pool_maxsize,
+                keepalive_expiry=client._get_option('pool_idle_timeout', DEFAULT_POOL_IDLE_TIMEOUT)
+            )
+            verify = client._tls_verify()
+            if isinstance(verify, str):
+                verify = ssl.create_default_context(cafile=verify)
+            self._http = httpx.AsyncClient(verify=verify, limits=limits, timeout=httpx.Timeout(REQUEST_TIMEOUT))
+            self._http_loop = loop
+        return self._http
+
+    async def _make_request(self, payload: Dict, stream: bool = False, deadline=None):
+        """
+        Make HTTP request to SF Assist API, retrying transient failures
+
+        Retry policy, circuit breaker, hedge policy and balancer are shared with the sync client.
+
+        Args:
+            payload: Request payload from _build_payload
+            stream: Leave the body unread so it can be consumed incrementally
+            deadline: Turn deadline bounding attempt timeouts and retry backoff
+        """
+        hedge_policy = self.sync_client.hedge_policy
+
+        balancer = self.sync_client.balancer
+
+        # Serialize (and compress) once - retries, hedges and other endpoints reuse the body
+        # (_send encodes it again, plain, once a 415 turned compression off)
+        encoded = self.sync_client.codec.encode(payload)
+
+        async def send():
+            if balancer is not None:
+                return await balancer.acall(lambda url: self._send(payload, stream, url, encoded, deadline))
+            return await self._send(payload, stream, encoded=encoded, deadline=deadline)
+
+        async def attempt():
+            if hedge_policy is not None:
+                return await ahedged_call(send, hedge_policy)
+            return await send()
+
+        return await acall_with_retry(attempt, self.sync_client.retry_policy, self.sync_client.circuit_breaker,
+                                      deadline=deadline)
+
+    async def _send(self, payload: Dict, stream: bool = False, url: str = None, encoded=None, deadline=None):
+        """Send a single request attempt to url (defaults to base_url), encoded by _make_request"""
+        codec = self.sync_client.codec
+        body, body_headers = codec.refresh(payload, encoded)
+        http = self._get_http()
+        request = http.build_request(
+            'POST',
+            url or self.base_url,
+            headers=dict(self.sync_client._build_headers(stream), **body_headers),
+            content=body,
+            timeout=deadline.timeout(REQUEST_TIMEOUT) if deadline is not None else REQUEST_TIMEOUT
+        )
+        response = await http.send(request, stream=stream)
+
+        # Gateway does not accept compressed bodies - compression is now off, resend plain
+        if codec.rejected(response.status_code, body_headers):
+            await response.aclose()
+            return await self._send(payload, stream, url, deadline=deadline)
+
+        # Rotated API key - refresh the shared credentials once and retry
+        if response.status_code in (401, 403):
+            refreshed = await asyncio.to_thread(self.sync_client.refresh_credentials)
+            if refreshed:
+                await response.aclose()
+                request.headers.update(self.sync_client._build_headers(stream))
+                response = await http.send(request, stream=stream)
+        return response
+
+    async def _acquire_budget(self, payload: Dict, priority: str = PRIORITY_INTERACTIVE, deadline=None) -> int:
+        """Like SFAssistClient._acquire_budget, but queues on the event loop instead of blocking a thread"""
+        sync_client = self.sync_client
+        limiter = sync_client.rate_limiter
+        estimated = 0
+        if limiter.tokens is not None:
+            estimated = count_payload_tokens(payload) + sync_client.completion_token_estimate
+        max_wait = deadline.timeout(limiter.max_wait) if deadline is not None else None
+        waited = await limiter.aacquire(estimated, priority, max_wait)
+        if waited >= 0.01:
+            print(f"⏳ Rate limit: queued {waited:.2f}s ({priority})")
+        return estimated
+
+    async def aclose(self):
+        """Close pooled connections of the async transport"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    class ChatCompletion:
+        """Async chat completion interface for SF Assist"""
+
+        def __init__(self, client):
+            self.client = client
+            self.completions = self  # Support OpenAI-style API
+
+        async def create(self, model: str, messages: List[Dict[str, str]],
+                         stream: bool = False, **kwargs):
+            """
+            Create chat completion using SF Assist
+
+            Args:
+                model: Model name (will use client's configured model)
+                messages: List of messages
+                stream: Whether to stream the response
+                **kwargs: Additional parameters (cache=False bypasses the response cache and
+                    single-flight; priority='background' queues behind interactive calls;
+                    role / escalate pick the model through the model router; deadline=Deadline
+                    caps queueing, request timeouts and retries by the turn's remaining budget;
+                    session / role attribute the token usage, see usage_stats)
+
+            Returns:
+                CompletionResponse object or AsyncIterator[StreamingChunk] for streaming
+            """
+            sync_client = self.client.sync_client
+            payload = sync_client._build_payload(messages)
+            if stream and sync_client.server_streaming:
+                payload["query"]["stream"] = True
+
+            role = kwargs.get('role')
+            router = sync_client.model_router
+            if router is None or role is None:
+                return await self._complete(payload, stream, **kwargs)
+            return await router.aroute(role, payload, lambda routed: self._complete(routed, stream, **kwargs),
+                                       stream, escalate=kwargs.get('escalate', False))
+
+        async def batch_create(self, requests: List[Dict], max_concurrency: int = None):
+            """
+            Run independent completions concurrently
+
+            Args:
+                requests: create() keyword arguments per request
+                max_concurrency: Requests in flight at the same time
+                    (sfassist.batch_max_concurrency when omitted)
+
+            Returns:
+                List of BatchResult in input order (.response / .error / .content per item)
+            """
+            if max_concurrency is None:
+                max_concurrency = self.client.sync_client._get_option('batch_max_concurrency', DEFAULT_BATCH_CONCURRENCY)
+            return await arun_batch(self.create, requests, max_concurrency)
+
+        async def _complete(self, payload: Dict, stream: bool = False, **kwargs):
+            """Serve a built payload from the cache, an identical in-flight request or the endpoint"""
+            sync_client = self.client.sync_client
+
+            # Response cache (shared with the sync client) / single-flight - cache=False bypasses both
+            shareable = kwargs.get('cache', True)
+            cache = sync_client.response_cache if shareable else None
+            if cache is not None:
+                cached = cache.get(payload)
+                if cached is not None:
+                    result = sync_client.chat._cached_response(cached, stream)
+                    return self._iterate(result) if stream else result
+
+            priority = kwargs.get('priority', PRIORITY_INTERACTIVE)
+            deadline = kwargs.get('deadline')
+            usage_key = (kwargs.get('session'), kwargs.get('role'))
+
+            if not shareable or self.client.inflight is None:
+                return await self._request(payload, stream, cache, priority, deadline, usage_key)
+            key = (payload_cache_key(payload), stream)
+            if stream:
+                return await self.client.inflight.do_stream(
+                    key, lambda: self._request(payload, stream, cache, priority, deadline, usage_key))
+            return await self.client.inflight.do(
+                key, lambda: self._request(payload, stream, cache, priority, deadline, usage_key))
+
+        async def _request(self, payload: Dict, stream: bool, cache, priority: str = PRIORITY_INTERACTIVE,
+                           deadline=None, usage_key=(None, None)):
+            """Send one request and turn the response into a completion"""
+            sync_client = self.client.sync_client
+            session, role = usage_key
+            estimated = await self.client._acquire_budget(payload, priority, deadline)
+            response = await self.client._make_request(payload, stream=stream, deadline=deadline)
+
+            if stream and response.status_code == 200 and is_streaming_response(response):
+                chunks = self._tee(self._stream_response(response), lambda content:
+                                   sync_client.chat._record_stream_usage(payload, content, session, role))
+                if cache is not None:
+                    chunks = self._tee(chunks, lambda content: cache.put(payload, content))
+                return chunks
+            if stream:
+                # Buffered fallback / error body - read it fully before parsing
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+
+            result = sync_client.chat._handle_response(response, stream)
+            result = sync_client.chat._account_usage(payload, result, stream, session, role)
+            if not stream:
+                sync_client.rate_limiter.reconcile(estimated, result.usage.total_tokens)
+            if cache is not None:
+                result = sync_client.chat._cache_result(cache, payload, result, stream)
+            return self._iterate(result) if stream else result
+
+        async def _stream_response(self, response):
+            """Yield deltas of an incremental response as they arrive"""
+            flush_interval = self.client.sync_client.stream_flush_interval
+            async for delta in aiter_stream_deltas(response, flush_interval):
+                yield StreamingChunk(delta)
+
+        async def _tee(self, chunks, on_complete):
+            """Pass streamed chunks through and hand the full text to on_complete once the stream completes"""
+            parts = []
+            async for chunk in chunks:
+                if chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+            on_complete(''.join(parts))
+
+        async def _iterate(self, chunks):
+            """Expose the buffered-fallback chunks as an async iterator"""
+            for chunk in chunks:
+                yield chunk
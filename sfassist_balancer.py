@@ -0,0 +1,186 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from sfassist_retry import is_retryable_status
+
+
+STRATEGY_EWMA = 'ewma'                              # lowest latency EWMA weighted by outstanding requests
+STRATEGY_LEAST_OUTSTANDING = 'least_outstanding'    # fewest requests in flight, EWMA breaks ties
+
+DEFAULT_BALANCER_STRATEGY = STRATEGY_EWMA
+DEFAULT_EWMA_ALPHA = 0.3          # weight of the newest latency sample
+DEFAULT_EJECT_AFTER = 3           # consecutive failures that eject an endpoint
+DEFAULT_EJECT_SECONDS = 30.0      # base ejection time, doubled on repeated ejections
+MAX_EJECT_SECONDS = 300.0
+INITIAL_LATENCY = 0.0             # endpoints without samples are tried first
+FAILURE_LATENCY = 1.0             # minimum latency sample recorded for a failure
+
+
+def parse_endpoints(value) -> List[str]:
+    """Normalize a base_urls setting (list or comma-separated string) to a list of URLs"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(url).strip().rstrip('/') for url in value if str(url).strip()]
+
+
+# ============================================================================
+#                         ENDPOINT
+# ============================================================================
+
+class Endpoint:
+    """Health and latency state of one gateway URL"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma_latency = INITIAL_LATENCY
+        self.samples = 0
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self, now: float) -> Dict:
+        return {
+            "ewma_latency": round(self.ewma_latency, 4),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "healthy": self.is_healthy(now),
+            "ejected_for": round(max(self.ejected_until - now, 0.0), 1),
+        }
+
+
+# ============================================================================
+#                         BALANCER
+# ============================================================================
+
+class EndpointBalancer:
+    """
+    Route requests over several SF Assist gateways
+
+    Picks an endpoint by latency EWMA (scaled by the requests it already has
+    in flight) or by least outstanding requests. Endpoints failing
+    eject_after times in a row (429/5xx/timeouts) are passively ejected for
+    eject_seconds, doubling on repeat ejections; when every endpoint is
+    ejected the one returning soonest is used anyway.
+    """
+
+    def __init__(self, urls: List[str], strategy: str = DEFAULT_BALANCER_STRATEGY,
+                 ewma_alpha: float = DEFAULT_EWMA_ALPHA, eject_after: int = DEFAULT_EJECT_AFTER,
+                 eject_seconds: float = DEFAULT_EJECT_SECONDS):
+        """
+        Args:
+            urls: Gateway URLs
+            strategy: STRATEGY_EWMA or STRATEGY_LEAST_OUTSTANDING
+            ewma_alpha: Weight of the newest latency sample
+            eject_after: Consecutive failures before an endpoint is ejected
+            eject_seconds: Base ejection duration
+        """
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = strategy
+        self.ewma_alpha = ewma_alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def _score(self, endpoint: Endpoint):
+        if self.strategy == STRATEGY_LEAST_OUTSTANDING:
+            return (endpoint.outstanding, endpoint.ewma_latency)
+        return (endpoint.ewma_latency * (endpoint.outstanding + 1),)
+
+    def acquire(self) -> Endpoint:
+        """Pick an endpoint and count the request as outstanding on it"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.is_healthy(now)]
+            if healthy:
+                best = min(self._score(e) for e in healthy)
+                endpoint = random.choice([e for e in healthy if self._score(e) == best])
+            else:
+                endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _observe(self, endpoint: Endpoint, latency: float):
+        """Fold a latency sample into the endpoint's EWMA (the first sample seeds it)"""
+        if endpoint.samples == 0:
+            endpoint.ewma_latency = latency
+        else:
+            endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+        endpoint.samples += 1
+
+    def release(self, endpoint: Endpoint, latency: float, ok: Optional[bool]):
+        """Record the outcome of a request sent to endpoint (ok=None: cancelled, no verdict)"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                self._observe(endpoint, latency)
+                endpoint.consecutive_failures = 0
+                endpoint.ejections = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            # A failure is also slow from the router's point of view
+            self._observe(endpoint, max(latency, endpoint.ewma_latency * 2, FAILURE_LATENCY))
+            if endpoint.consecutive_failures >= self.eject_after:
+                duration = min(self.eject_seconds * (2 ** endpoint.ejections), MAX_EJECT_SECONDS)
+                endpoint.ejected_until = time.monotonic() + duration
+                endpoint.ejections += 1
+                endpoint.consecutive_failures = 0
+                print(f"⚠️ Endpoint {endpoint.url} ejected for {duration:.0f}s")
+
+    def call(self, send: Callable):
+        """Run send(url) against the chosen endpoint and record latency / health"""
+        endpoint = self.acquire()
+        start = time.monotonic()
+        try:
+            response = send(endpoint.url)
+        except Exception:
+            self.release(endpoint, time.monotonic() - start, False)
+            raise
+        self.release(endpoint, time.monotonic() - start, not is_retryable_status(response.status_code))
+        return response
+
+    async def acall(self, send: Callable):
+        """Async counterpart of call; send(url) is a coroutine function"""
+        endpoint = self.acquire()
+        start = time.monotonic()
+        try:
+            response = await send(endpoint.url)
+        except asyncio.CancelledError:
+            # Lost hedge - free the slot without counting against the endpoint
+            self.release(endpoint, time.monotonic() - start, None)
+            raise
+        except Exception:
+            self.release(endpoint, time.monotonic() - start, False)
+            raise
+        self.release(endpoint, time.monotonic() - start, not is_retryable_status(response.status_code))
+        return response
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-endpoint latency EWMA, outstanding requests, failures and health"""
+        now = time.monotonic()
+        with self._lock:
+            return {e.url: e.stats(now) for e in self.endpoints}
+
+
+def build_balancer(urls: List[str], strategy: str = DEFAULT_BALANCER_STRATEGY,
+                   ewma_alpha: float = DEFAULT_EWMA_ALPHA, eject_after: int = DEFAULT_EJECT_AFTER,
+                   eject_seconds: float = DEFAULT_EJECT_SECONDS) -> Optional[EndpointBalancer]:
+    """EndpointBalancer for two or more URLs, None for a single endpoint"""
+    if len(urls) < 2:
+        return None
+    return EndpointBalancer(urls, strategy, ewma_alpha, eject_after, eject_seconds)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+DEFAULT_BATCH_CONCURRENCY = 8   # requests in flight per batch_create call
+
+
+# ============================================================================
+#                         BATCH RESULT
+# ============================================================================
+
+class BatchResult:
+    """Outcome of one request of a batch: response on success, error otherwise"""
+
+    __slots__ = ('index', 'response', 'error', 'latency')
+
+    def __init__(self, index: int, response=None, error: Optional[Exception] = None, latency: float = 0.0):
+        self.index = index
+        self.response = response
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def content(self) -> Optional[str]:
+        """Message text of a successful response"""
+        return self.response.choices[0].message.content if self.ok else None
+
+    def __repr__(self):
+        state = 'ok' if self.ok else f'error={self.error!r}'
+        return f"BatchResult(index={self.index}, {state}, latency={self.latency:.2f}s)"
+
+
+# ============================================================================
+#                         BATCH RUNNERS
+# ============================================================================
+
+def _request_kwargs(request: Dict) -> Dict:
+    # Batches return whole completions - a stream per item would leave nothing to order
+    kwargs = dict(request)
+    kwargs['stream'] = False
+    kwargs.setdefault('model', None)
+    return kwargs
+
+
+def run_batch(create: Callable, requests: List[Dict],
+              max_concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> List[BatchResult]:
+    """
+    Run create(**request) for every request with at most max_concurrency in flight
+
+    Args:
+        create: chat.completions.create of a client
+        requests: create() keyword arguments per request (model, messages, ...)
+        max_concurrency: Requests sent at the same time
+
+    Returns:
+        BatchResults in input order; a failed request carries its exception instead of raising
+    """
+    def run(index: int, request: Dict) -> BatchResult:
+        start = time.monotonic()
+        try:
+            return BatchResult(index, response=create(**_request_kwargs(request)),
+                               latency=time.monotonic() - start)
+        except Exception as e:
+            return BatchResult(index, error=e, latency=time.monotonic() - start)
+
+    if not requests:
+        return []
+    workers = max(1, min(int(max_concurrency), len(requests)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sfassist-batch') as executor:
+        futures = [executor.submit(run, i, request) for i, request in enumerate(requests)]
+        return [future.result() for future in futures]
+
+
+async def arun_batch(create: Callable, requests: List[Dict],
+                     max_concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> List[BatchResult]:
+    """Async counterpart of run_batch; create is a coroutine function"""
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+
+    async def run(index: int, request: Dict) -> BatchResult:
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                response = await create(**_request_kwargs(request))
+                return BatchResult(index, response=response, latency=time.monotonic() - start)
+            except Exception as e:
+                return BatchResult(index, error=e, latency=time.monotonic() - start)
+
+    return list(await asyncio.gather(*(run(i, request) for i, request in enumerate(requests))))
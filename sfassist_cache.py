@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional
+
+
+DEFAULT_CACHE_TTL = 24 * 3600        # seconds a cached completion stays valid
+DEFAULT_CACHE_MAX_ENTRIES = 256      # in-memory LRU size
+DEFAULT_CACHE_MAX_DISK_MB = 200      # on-disk tier size limit
+CACHE_DIR_NAME = 'llm_cache'
+
+
+def payload_cache_key(payload: Dict) -> str:
+    """
+    Hash of the normalized request: model, messages and options
+
+    Application / session fields and the stream flag are left out, so a
+    replayed session or a streamed and a buffered call share one entry.
+    """
+    query = payload.get('query', {})
+    normalized = {
+        "model": query.get('model', {}).get('model'),
+        "options": query.get('model', {}).get('options', {}),
+        "messages": query.get('prompt', {}).get('messages', []),
+        "response_format": query.get('response_format'),
+    }
+    raw = json.dumps(normalized, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def default_cache_dir(config) -> Optional[str]:
+    """<project_cache_path>/llm_cache for a config dict/object, None if it has no project_cache_path"""
+    if isinstance(config, dict):
+        project_cache_path = config.get('project_cache_path')
+    else:
+        project_cache_path = getattr(config, 'project_cache_path', None)
+    if not project_cache_path:
+        return None
+    return os.path.join(os.path.abspath(project_cache_path), CACHE_DIR_NAME)
+
+
+# ============================================================================
+#                         RESPONSE CACHE
+# ============================================================================
+
+class ResponseCache:
+    """
+    Two-tier cache of completed LLM responses
+
+    Memory tier: LRU of up to max_entries responses.
+    Disk tier: one JSON file per response under cache_dir, trimmed to max_disk_mb
+    (oldest first). Both tiers expire entries after ttl seconds.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+                 max_disk_mb: float = DEFAULT_CACHE_MAX_DISK_MB):
+        """
+        Args:
+            cache_dir: Directory of the disk tier (memory only when None)
+            ttl: Seconds an entry stays valid
+            max_entries: Size of the in-memory LRU
+            max_disk_mb: Size limit of the disk tier in MB
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                       "memory_evictions": 0, "disk_evictions": 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, payload: Dict) -> Optional[Dict]:
+        """
+        Look up a payload
+
+        Returns:
+            {"content": str, "usage": dict} or None on a miss
+        """
+        key = payload_cache_key(payload)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry["created"] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, payload: Dict, content: str, usage: Optional[Dict] = None):
+        """Store a completed response in both tiers"""
+        if not content:
+            return
+        key = payload_cache_key(payload)
+        entry = {"created": time.time(), "content": content, "usage": usage or {}}
+        with self._lock:
+            self._remember(key, entry)
+            self._stats["stores"] += 1
+        self._write_disk(key, entry)
+
+    def _remember(self, key: str, entry: Dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get("created", 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._trim_disk(os.path.getsize(path))
+        except OSError as e:
+            print(f"⚠️ Response cache write failed: {e}")
+
+    def _trim_disk(self, added_bytes: int):
+        """Drop the oldest files once the disk tier is over max_disk_bytes"""
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += added_bytes
+                if self._disk_bytes <= self.max_disk_bytes:
+                    return
+            files = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json'):
+                    path = os.path.join(self.cache_dir, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self._stats["disk_evictions"] += 1
+                except OSError:
+                    pass
+            self._disk_bytes = total
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self.cache_dir:
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith('.json'):
+                        try:
+                            os.remove(os.path.join(self.cache_dir, name))
+                        except OSError:
+                            pass
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and hit rate"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def tee_stream(chunks: Iterator, on_complete: Callable[[str], None]) -> Iterator:
+    """
+    Pass streamed chunks through and hand the full text to on_complete
+
+    on_complete only runs if the stream finished; an abandoned or failed
+    stream is never cached.
+    """
+    parts = []
+    for chunk in chunks:
+        content = chunk.choices[0].delta.content
+        if content:
+            parts.append(content)
+        yield chunk
+    on_complete(''.join(parts))
+
+
+# ============================================================================
+#                         PROCESS-WIDE CACHES
+# ============================================================================
+
+_caches: Dict[tuple, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(cache_dir: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL,
+                       max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+                       max_disk_mb: float = DEFAULT_CACHE_MAX_DISK_MB) -> ResponseCache:
+    """Return the process-wide ResponseCache for the given directory and limits"""
+    key = (cache_dir, float(ttl), int(max_entries), float(max_disk_mb))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = ResponseCache(cache_dir, ttl, max_entries, max_disk_mb)
+            _caches[key] = cache
+        return cache
@@ -5,42 +5,33 @@ import json
 from typing import List, Dict, Iterator, Optional
 import time
 import urllib3
+from logger import logger, log_payload
+from sfassist_codec import (RequestEncoder, DEFAULT_REQUEST_COMPRESSION,
+                            DEFAULT_COMPRESSION_MIN_BYTES)
+from deadline import Deadline
+from sfassist_types import UsageStats, Choice, CompletionResponse, StreamingChunk
+from sfassist_pool import (get_pooled_session, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE,
+                           DEFAULT_POOL_BLOCK, DEFAULT_POOL_IDLE_TIMEOUT)
+from sfassist_stream import is_streaming_response, iter_stream_deltas, DEFAULT_FLUSH_INTERVAL
+from sfassist_cache import (get_response_cache, default_cache_dir, payload_cache_key, tee_stream,
+                            DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_DISK_MB)
+from sfassist_singleflight import SingleFlight
+from sfassist_retry import (RetryPolicy, APIResponseError, get_circuit_breaker, call_with_retry,
+                            DEFAULT_RETRY_MAX_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY, DEFAULT_RETRY_MAX_RETRY_AFTER,
+                            DEFAULT_BREAKER_FAILURE_THRESHOLD, DEFAULT_BREAKER_RECOVERY_TIMEOUT)
+from sfassist_ratelimit import (get_rate_limiter, PRIORITY_INTERACTIVE, DEFAULT_RATE_LIMIT_RPM,
+                                DEFAULT_RATE_LIMIT_TPM, DEFAULT_RATE_LIMIT_MAX_WAIT,
+                                DEFAULT_COMPLETION_TOKEN_ESTIMATE)
+from sfassist_tokens import count_payload_tokens, count_tokens, fill_usage, get_usage_meter
+from sfassist_balancer import (build_balancer, parse_endpoints, DEFAULT_BALANCER_STRATEGY, DEFAULT_EWMA_ALPHA,
+                               DEFAULT_EJECT_AFTER, DEFAULT_EJECT_SECONDS)
+from sfassist_routing import ModelRouter
+from sfassist_batch import run_batch, DEFAULT_BATCH_CONCURRENCY
+from sfassist_hedge import (HedgePolicy, hedged_call, DEFAULT_HEDGE_PERCENTILE, DEFAULT_HEDGE_MIN_DELAY,
+                            DEFAULT_HEDGE_MAX_RATIO, DEFAULT_HEDGE_MIN_SAMPLES)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-
-# ============================================================================
-#                         RESPONSE CLASSES
-# ============================================================================
-
-class UsageStats:
-    """Token usage statistics"""
-    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0):
-        self.prompt_tokens = prompt_tokens
-        self.completion_tokens = completion_tokens
-        self.total_tokens = total_tokens
-
-
-class Choice:
-    """Response choice"""
-    def __init__(self, message: Dict[str, str], finish_reason: str = "stop"):
-        self.message = type('Message', (), message)()
-        self.finish_reason = finish_reason
-        self.delta = type('Delta', (), {'content': message.get('content', '')})()
-
-
-class CompletionResponse:
-    """Response from completion API"""
-    def __init__(self, content: str, usage: UsageStats):
-        self.choices = [Choice({"role": "assistant", "content": content})]
-        self.usage = usage
-
-
-class StreamingChunk:
-    """Streaming chunk response"""
-    def __init__(self, content: str):
-        delta = type('Delta', (), {'content': content})()
-        choice = type('Choice', (), {'delta': delta})()
-        self.choices = [choice]
+REQUEST_TIMEOUT = 120  # seconds per HTTP attempt, capped by the caller's deadline
 
 
 # ============================================================================
@@ -72,6 +63,7 @@ class SFAssistClient:
             # Check if sfassist section exists
             if 'sfassist' in config:
                 sfassist_config = config['sfassist']
+                self._settings = sfassist_config
                 self.api_key = sfassist_config.get('api_key')
                 self.base_url = sfassist_config.get('base_url', '').rstrip('/')
                 self.model = sfassist_config.get('model', 'snowflake-llama-3.3-70b')
@@ -81,6 +73,7 @@ class SFAssistClient:
                 self.session_id = sfassist_config.get('session_id', 'dsa_session')
             else:
                 # Fallback to root level
+                self._settings = config
                 self.api_key = config.get('api_key')
                 self.base_url = config.get('base_url', '').rstrip('/')
                 self.model = config.get('model', 'snowflake-llama-3.3-70b')
@@ -96,6 +89,7 @@ class SFAssistClient:
             # Check if sfassist attribute exists
             if hasattr(config, 'sfassist'):
                 sfassist_config = config.sfassist
+                self._settings = sfassist_config
                 self.api_key = getattr(sfassist_config, 'api_key', None)
                 self.base_url = getattr(sfassist_config, 'base_url', '').rstrip('/')
                 self.model = getattr(sfassist_config, 'model', 'snowflake-llama-3.3-70b')
@@ -105,6 +99,7 @@ class SFAssistClient:
                 self.session_id = getattr(sfassist_config, 'session_id', 'dsa_session')
             else:
                 # Fallback to root level attributes
+                self._settings = config
                 self.api_key = getattr(config, 'api_key', None)
                 self.base_url = getattr(config, 'base_url', '').rstrip('/')
                 self.model = getattr(config, 'model', 'snowflake-llama-3.3-70b')
@@ -114,6 +109,7 @@ class SFAssistClient:
                 self.session_id = getattr(config, 'session_id', 'dsa_session')
         else:
             # Individual parameters provided
+            self._settings = None
             self.api_key = config_or_api_key
             self.base_url = base_url.rstrip('/') if base_url else ''
             self.model = model if model else 'snowflake-llama-3.3-70b'
@@ -123,13 +119,195 @@ class SFAssistClient:
             self.session_id = 'dsa_session'
         
         # Debug output
-        print(f"DEBUG INIT: api_key={'[SET]' if self.api_key else '[EMPTY]'}")
-        print(f"DEBUG INIT: base_url={self.base_url if self.base_url else '[EMPTY]'}")
-        print(f"DEBUG INIT: model={self.model}")
-        print(f"DEBUG INIT: app_id={self.app_id}, aplctn_cd={self.aplctn_cd}")
+        logger.debug("Init: api_key=%s, base_url=%s, model=%s, app_id=%s, aplctn_cd=%s",
+                     '[SET]' if self.api_key else '[EMPTY]', self.base_url or '[EMPTY]',
+                     self.model, self.app_id, self.aplctn_cd)
+        
+        # Keep-alive connection pool, shared by every client in the process
+        self.http = get_pooled_session(
+            pool_connections=self._get_option('pool_connections', DEFAULT_POOL_CONNECTIONS),
+            pool_maxsize=self._get_option('pool_maxsize', DEFAULT_POOL_MAXSIZE),
+            pool_block=self._get_option('pool_block', DEFAULT_POOL_BLOCK),
+            idle_timeout=self._get_option('pool_idle_timeout', DEFAULT_POOL_IDLE_TIMEOUT)
+        )
+        
+        # Payload encoding: fast JSON (orjson when installed), optional gzip/zstd bodies
+        self.codec = RequestEncoder(
+            compression=self._get_option('request_compression', DEFAULT_REQUEST_COMPRESSION),
+            min_bytes=self._get_option('request_compression_min_bytes', DEFAULT_COMPRESSION_MIN_BYTES),
+            level=self._get_option('request_compression_level')
+        )
+        
+        # Streaming: ask the endpoint for an incremental body, coalesce deltas for the UI
+        self.server_streaming = self._get_option('server_streaming', False)
+        self.stream_flush_interval = self._get_option('stream_flush_interval', DEFAULT_FLUSH_INTERVAL)
+        
+        # Opt-in response cache: memory LRU + JSON files under <project_cache_path>/llm_cache
+        self.response_cache = None
+        if self._get_option('response_cache', False):
+            cache_dir = None
+            if self._get_option('response_cache_disk', True):
+                cache_dir = self._get_option('response_cache_dir', default_cache_dir(config_or_api_key))
+            self.response_cache = get_response_cache(
+                cache_dir=cache_dir,
+                ttl=self._get_option('response_cache_ttl', DEFAULT_CACHE_TTL),
+                max_entries=self._get_option('response_cache_max_entries', DEFAULT_CACHE_MAX_ENTRIES),
+                max_disk_mb=self._get_option('response_cache_max_disk_mb', DEFAULT_CACHE_MAX_DISK_MB)
+            )
+        
+        # Identical payloads already in flight share one request (see sfassist_singleflight)
+        self.inflight = SingleFlight() if self._get_option('single_flight', True) else None
+        
+        # Role -> model tier routing (sfassist.model_routing), off unless enabled
+        self.model_router = ModelRouter.from_config(self._get_option('model_routing'), self.model)
+        
+        # Several gateways (sfassist.base_urls): route by latency EWMA / outstanding requests
+        # and passively eject failing ones; base_url stays the first endpoint
+        self.endpoints = parse_endpoints(self._get_option('base_urls')) or [self.base_url]
+        self.base_url = self.base_url or self.endpoints[0]
+        self.balancer = build_balancer(
+            self.endpoints,
+            strategy=self._get_option('balancer_strategy', DEFAULT_BALANCER_STRATEGY),
+            ewma_alpha=self._get_option('balancer_ewma_alpha', DEFAULT_EWMA_ALPHA),
+            eject_after=self._get_option('balancer_eject_after', DEFAULT_EJECT_AFTER),
+            eject_seconds=self._get_option('balancer_eject_seconds', DEFAULT_EJECT_SECONDS)
+        )
+        
+        # Transient failures (429/5xx/timeouts) are retried with backoff; a circuit breaker
+        # per endpoint (group) fails fast while the service is degraded
+        self.retry_policy = RetryPolicy(
+            max_attempts=self._get_option('retry_max_attempts', DEFAULT_RETRY_MAX_ATTEMPTS),
+            base_delay=self._get_option('retry_base_delay', DEFAULT_RETRY_BASE_DELAY),
+            max_delay=self._get_option('retry_max_delay', DEFAULT_RETRY_MAX_DELAY),
+            max_retry_after=self._get_option('retry_max_retry_after', DEFAULT_RETRY_MAX_RETRY_AFTER)
+        )
+        self.circuit_breaker = get_circuit_breaker(
+            ','.join(self.endpoints),
+            failure_threshold=self._get_option('breaker_failure_threshold', DEFAULT_BREAKER_FAILURE_THRESHOLD),
+            recovery_timeout=self._get_option('breaker_recovery_timeout', DEFAULT_BREAKER_RECOVERY_TIMEOUT)
+        )
+        
+        # Client-side budget of the Cortex quota shared by every session (0 = unlimited)
+        self.rate_limiter = get_rate_limiter(
+            self.base_url,
+            requests_per_minute=self._get_option('rate_limit_requests_per_minute', DEFAULT_RATE_LIMIT_RPM),
+            tokens_per_minute=self._get_option('rate_limit_tokens_per_minute', DEFAULT_RATE_LIMIT_TPM),
+            max_wait=self._get_option('rate_limit_max_wait', DEFAULT_RATE_LIMIT_MAX_WAIT)
+        )
+        self.completion_token_estimate = self._get_option('rate_limit_completion_estimate',
+                                                          DEFAULT_COMPLETION_TOKEN_ESTIMATE)
+        
+        # Token usage per session / role / model, counted locally where the endpoint omits it
+        self.usage_meter = get_usage_meter()
+        
+        # Optional hedging: duplicate a request that has not started answering within
+        # a percentile of recent latency and keep whichever answers first
+        self.hedge_policy = None
+        if self._get_option('hedge_requests', False):
+            self.hedge_policy = HedgePolicy(
+                percentile=self._get_option('hedge_percentile', DEFAULT_HEDGE_PERCENTILE),
+                min_delay=self._get_option('hedge_min_delay', DEFAULT_HEDGE_MIN_DELAY),
+                max_ratio=self._get_option('hedge_max_ratio', DEFAULT_HEDGE_MAX_RATIO),
+                min_samples=self._get_option('hedge_min_samples', DEFAULT_HEDGE_MIN_SAMPLES)
+            )
         
         self.chat = self.ChatCompletion(self)
     
+    def _get_option(self, key: str, default=None):
+        """
+        Read an optional client setting from the resolved config section
+        
+        Args:
+            key: Setting name (e.g. 'pool_maxsize')
+            default: Value used when the setting is missing or no config was given
+        """
+        if self._settings is None:
+            return default
+        if isinstance(self._settings, dict):
+            value = self._settings.get(key, default)
+        else:
+            value = getattr(self._settings, key, default)
+        return default if value is None else value
+    
+    def refresh_credentials(self) -> bool:
+        """
+        Reload credentials of a long-lived shared client (see sfassist_registry)
+        
+        The api_key here comes straight from config, so there is nothing to re-fetch.
+        """
+        return False
+    
+    def connection_stats(self) -> Dict[str, int]:
+        """Connection reuse counters of the shared keep-alive pool"""
+        return self.http.stats()
+    
+    def cache_stats(self) -> Dict[str, float]:
+        """Hit/miss counters of the response cache (empty when caching is off)"""
+        return self.response_cache.stats() if self.response_cache is not None else {}
+    
+    def single_flight_stats(self) -> Dict[str, int]:
+        """Total / coalesced request counters (empty when single-flight is off)"""
+        return self.inflight.stats() if self.inflight is not None else {}
+    
+    def circuit_stats(self) -> Dict:
+        """State and failure counters of this endpoint's circuit breaker"""
+        return self.circuit_breaker.stats()
+    
+    def rate_limit_stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-priority request counts and queue-wait metrics of the rate limiter"""
+        return self.rate_limiter.stats()
+    
+    def hedge_stats(self) -> Dict[str, float]:
+        """Hedged request counters and current hedge delay (empty when hedging is off)"""
+        return self.hedge_policy.stats() if self.hedge_policy is not None else {}
+    
+    def role_stats(self) -> Dict[str, Dict]:
+        """Per-role latency, token and escalation metrics of the model router (empty when off)"""
+        return self.model_router.stats() if self.model_router is not None else {}
+    
+    def payload_stats(self) -> Dict[str, float]:
+        """Request body sizes (raw / on the wire), serialization and response parse times"""
+        return self.codec.stats()
+    
+    def usage_stats(self, by: str = 'role', session: str = None) -> Dict[str, Dict[str, int]]:
+        """
+        Prompt / completion tokens of completed requests
+        
+        Args:
+            by: Group by 'session', 'role' or 'model'
+            session: Only count requests of this session
+        """
+        return self.usage_meter.totals(by, session)
+    
+    def endpoint_stats(self) -> Dict[str, Dict]:
+        """Per-endpoint latency / health of the balancer (empty for a single endpoint)"""
+        return self.balancer.stats() if self.balancer is not None else {}
+    
+    def _acquire_budget(self, payload: Dict, priority: str = PRIORITY_INTERACTIVE,
+                        deadline: Deadline = None) -> int:
+        """
+        Wait for rate-limit budget before sending a request
+        
+        Args:
+            payload: Request payload (its prompt tokens are estimated with tiktoken)
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND (reports, summaries)
+            deadline: Turn deadline; the queueing time is capped by its remaining budget
+            
+        Returns:
+            Estimated tokens debited, for reconciling with the real usage
+            
+        Raises:
+            RateLimitTimeout: no budget within rate_limit_max_wait
+        """
+        estimated = 0
+        if self.rate_limiter.tokens is not None:
+            estimated = count_payload_tokens(payload) + self.completion_token_estimate
+        max_wait = deadline.timeout(self.rate_limiter.max_wait) if deadline is not None else None
+        waited = self.rate_limiter.acquire(estimated, priority, max_wait)
+        if waited >= 0.01:
+            print(f"⏳ Rate limit: queued {waited:.2f}s ({priority})")
+        return estimated
+    
     def _build_payload(self, messages: List[Dict[str, str]], system_message: str = None) -> Dict:
         """
         Build request payload - OFFICIAL STRUCTURE
@@ -151,10 +329,6 @@ class SFAssistClient:
         Returns:
             Payload dict for SF Assist API
         """
-        print(f"\n{'='*80}")
-        print(f"🔍 BUILDING PAYLOAD - OFFICIAL STRUCTURE")
-        print(f"{'='*80}")
-        
         # Extract system message
         sys_msg = system_message
         filtered_messages = []
@@ -176,10 +350,6 @@ class SFAssistClient:
         # Build messages array with system first
         all_messages = [{"role": "system", "content": sys_msg}] + filtered_messages
         
-        print(f"✅ Messages array: {len(all_messages)} messages")
-        print(f"   • System message: {len(sys_msg)} chars")
-        print(f"   • User/Assistant messages: {len(filtered_messages)}")
-        
         # Build payload - OFFICIAL STRUCTURE
         payload = {
             "query": {
@@ -203,17 +373,15 @@ class SFAssistClient:
             }
         }
         
-        print(f"✅ Payload Structure:")
-        print(f"   • application.aplctn_cd: {self.aplctn_cd}")
-        print(f"   • application.app_id: {self.app_id}")
-        print(f"   • model.model: {self.model}")
-        print(f"   • prompt.messages: {len(all_messages)} messages")
-        print(f"{'='*80}\n")
+        logger.debug("Built payload: %d messages (system %d chars, %d user/assistant), "
+                     "model=%s, app_id=%s, aplctn_cd=%s", len(all_messages), len(sys_msg),
+                     len(filtered_messages), self.model, self.app_id, self.aplctn_cd)
+        log_payload("SF Assist payload", payload)
         
         return payload
     
-    def _make_request(self, payload: Dict) -> requests.Response:
-        """Make HTTP request to SF Assist API"""
+    def _build_headers(self, stream: bool = False) -> Dict[str, str]:
+        """Request headers, shared by the sync and async transports"""
         headers = {
             "Content-Type": "application/json; charset=utf-8",
             "Accept": "application/json"
@@ -223,17 +391,70 @@ class SFAssistClient:
         if self.api_key:
             headers["api-key"] = self.api_key
         
-        print(f"DEBUG: Making request to {self.base_url}")
-        print(f"DEBUG: Headers: {list(headers.keys())}")
+        # Let the endpoint pick an incremental body when the caller streams
+        if stream:
+            headers["Accept"] = "text/event-stream, application/x-ndjson, application/json"
         
-        response = requests.post(
-            self.base_url,
+        return headers
+    
+    def _tls_verify(self):
+        """Value for the transport's TLS verify option"""
+        return False
+    
+    def _make_request(self, payload: Dict, stream: bool = False, deadline: Deadline = None) -> requests.Response:
+        """
+        Make HTTP request to SF Assist API, retrying transient failures
+        
+        Args:
+            payload: Request payload from _build_payload
+            stream: Read the body incrementally (SSE / NDJSON) instead of buffering it
+            deadline: Turn deadline bounding attempt timeouts and retry backoff
+            
+        Raises:
+            CircuitOpenError: the endpoint's circuit breaker is open
+            DeadlineExceeded: the deadline expired before an attempt
+        """
+        # Serialize (and compress) once - retries, hedges and other endpoints reuse the body
+        # (_send encodes it again, plain, once a 415 turned compression off)
+        encoded = self.codec.encode(payload)
+        
+        def send():
+            if self.balancer is not None:
+                return self.balancer.call(lambda url: self._send(payload, stream, url, encoded, deadline))
+            return self._send(payload, stream, encoded=encoded, deadline=deadline)
+        
+        def attempt():
+            if self.hedge_policy is not None:
+                return hedged_call(send, self.hedge_policy)
+            return send()
+        
+        return call_with_retry(attempt, self.retry_policy, self.circuit_breaker, deadline=deadline)
+    
+    def _send(self, payload: Dict, stream: bool = False, url: str = None,
+              encoded=None, deadline: Deadline = None) -> requests.Response:
+        """Send a single request attempt to url (defaults to base_url), encoded by _make_request"""
+        url = url or self.base_url
+        body, body_headers = self.codec.refresh(payload, encoded)
+        timeout = deadline.timeout(REQUEST_TIMEOUT) if deadline is not None else REQUEST_TIMEOUT
+        headers = self._build_headers(stream)
+        headers.update(body_headers)
+        
+        logger.debug("Making request to %s (stream=%s)", url, stream)
+        
+        response = self.http.post(
+            url,
             headers=headers,
-            json=payload,
-            verify=False,
-            timeout=120
+            data=body,
+            stream=stream,
+            verify=self._tls_verify(),
+            timeout=timeout
         )
         
+        # Gateway does not accept compressed bodies - compression is now off, resend plain
+        if self.codec.rejected(response.status_code, body_headers):
+            response.close()
+            return self._send(payload, stream, url, deadline=deadline)
+        
         return response
     
     class ChatCompletion:
@@ -252,22 +473,155 @@ class SFAssistClient:
                 model: Model name (will use client's configured model)
                 messages: List of messages
                 stream: Whether to stream the response
-                **kwargs: Additional parameters
+                **kwargs: Additional parameters (cache=False bypasses the response cache and
+                    single-flight; priority='background' queues behind interactive calls;
+                    role / escalate pick the model through the model router; deadline=Deadline
+                    caps queueing, request timeouts and retries by the turn's remaining budget;
+                    session / role attribute the token usage, see usage_stats)
                 
             Returns:
                 CompletionResponse object or Iterator[StreamingChunk] for streaming
             """
             # Build payload (messages as array - official structure!)
             payload = self.client._build_payload(messages)
+            if stream and self.client.server_streaming:
+                payload["query"]["stream"] = True
+            
+            role = kwargs.get('role')
+            router = self.client.model_router
+            if router is None or role is None:
+                return self._complete(payload, stream, **kwargs)
+            return router.route(role, payload, lambda routed: self._complete(routed, stream, **kwargs),
+                                stream, escalate=kwargs.get('escalate', False))
+        
+        def batch_create(self, requests: List[Dict], max_concurrency: int = None):
+            """
+            Run independent completions concurrently over the pooled transport
+            
+            Args:
+                requests: create() keyword arguments per request, e.g.
+                    [{"messages": [...]}, {"messages": [...], "role": "report"}]
+                max_concurrency: Requests in flight at the same time
+                    (sfassist.batch_max_concurrency when omitted)
+                
+            Returns:
+                List of BatchResult in input order (.response / .error / .content per item)
+            """
+            if max_concurrency is None:
+                max_concurrency = self.client._get_option('batch_max_concurrency', DEFAULT_BATCH_CONCURRENCY)
+            return run_batch(self.create, requests, max_concurrency)
+        
+        def _complete(self, payload: Dict, stream: bool = False, **kwargs):
+            """Serve a built payload from the cache, an identical in-flight request or the endpoint"""
+            # Response cache / single-flight - pass cache=False for calls that must
+            # reach the model on their own
+            shareable = kwargs.get('cache', True)
+            cache = self.client.response_cache if shareable else None
+            if cache is not None:
+                cached = cache.get(payload)
+                if cached is not None:
+                    return self._cached_response(cached, stream)
+            
+            priority = kwargs.get('priority', PRIORITY_INTERACTIVE)
+            deadline = kwargs.get('deadline')
+            
+            def call():
+                estimated = self.client._acquire_budget(payload, priority, deadline)
+                
+                # Make request
+                response = self.client._make_request(payload, stream=stream, deadline=deadline)
+                
+                result = self._handle_response(response, stream)
+                result = self._account_usage(payload, result, stream, kwargs.get('session'), kwargs.get('role'))
+                if not stream:
+                    self.client.rate_limiter.reconcile(estimated, result.usage.total_tokens)
+                if cache is not None:
+                    result = self._cache_result(cache, payload, result, stream)
+                return result
             
-            # Make request
-            response = self.client._make_request(payload)
+            if not shareable or self.client.inflight is None:
+                return call()
+            key = (payload_cache_key(payload), stream)
+            if stream:
+                return self.client.inflight.do_stream(key, call)
+            return self.client.inflight.do(key, call)
+        
+        def _account_usage(self, payload: Dict, result, stream: bool = False,
+                           session: str = None, role: str = None):
+            """
+            Record the token usage of a fresh completion in the client's usage meter
+            
+            Counts the endpoint leaves out are filled in with the local tokenizer.
+            Streams never report usage and are counted once fully consumed.
+            """
+            if stream:
+                return tee_stream(result, lambda content: self._record_stream_usage(payload, content, session, role))
+            usage = result.usage
+            estimated = fill_usage(usage, payload, result.choices[0].message.content)
+            self.client.usage_meter.record(session or self.client.session_id, role, payload["query"]["model"]["model"],
+                                           usage.prompt_tokens, usage.completion_tokens, estimated)
+            return result
+        
+        def _record_stream_usage(self, payload: Dict, content: str, session: str = None, role: str = None):
+            """Record the locally counted usage of a fully consumed stream"""
+            self.client.usage_meter.record(session or self.client.session_id, role, payload["query"]["model"]["model"],
+                                           count_payload_tokens(payload), count_tokens(content), estimated=True)
+        
+        def _cached_response(self, cached: Dict, stream: bool = False):
+            """
+            Rebuild a completion from a response cache entry
+            
+            Args:
+                cached: Entry returned by ResponseCache.get
+                stream: Whether the caller asked for a streamed completion
+            """
+            if stream:
+                return iter([StreamingChunk(cached['content'])])
+            usage_data = cached.get('usage', {})
+            usage = UsageStats(
+                prompt_tokens=usage_data.get('prompt_tokens', 0),
+                completion_tokens=usage_data.get('completion_tokens', 0),
+                total_tokens=usage_data.get('total_tokens', 0)
+            )
+            return CompletionResponse(cached['content'], usage)
+        
+        def _cache_result(self, cache, payload: Dict, result, stream: bool = False):
+            """
+            Store a fresh completion in the response cache
+            
+            Streams are stored once fully consumed; the chunks are passed through unchanged.
+            """
+            if stream:
+                return tee_stream(result, lambda content: cache.put(payload, content))
+            usage = result.usage
+            cache.put(payload, result.choices[0].message.content, {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            })
+            return result
+        
+        def _handle_response(self, response, stream: bool = False):
+            """
+            Turn an HTTP response into a completion
+            
+            Works for both requests and httpx responses (the async client reuses it
+            for buffered bodies).
             
-            # Handle response
+            Args:
+                response: HTTP response from the SF Assist endpoint
+                stream: Whether the caller asked for a streamed completion
+                
+            Returns:
+                CompletionResponse object or Iterator[StreamingChunk] for streaming
+            """
             if response.status_code == 200:
+                if stream and is_streaming_response(response):
+                    # Real streaming - yield deltas as the endpoint produces them
+                    return self._stream_response(response)
                 try:
                     # Try parsing as JSON first
-                    data = response.json()
+                    data = self.client.codec.parse(response.content)
                     
                     # Extract content from various possible response formats
                     content = None
@@ -285,7 +639,7 @@ class SFAssistClient:
                     else:
                         content = str(data)
                     
-                    print(f"DEBUG: Response received ({len(content)} chars)")
+                    logger.debug("Response received (%d chars)", len(content))
                     
                     # Handle streaming vs non-streaming
                     if stream:
@@ -303,7 +657,7 @@ class SFAssistClient:
                 
                 except (json.JSONDecodeError, ValueError) as e:
                     # If not JSON, treat as plain text
-                    print(f"DEBUG: JSON decode error, treating as plain text: {e}")
+                    logger.debug("JSON decode error, treating as plain text: %s", e)
                     content = response.text
                     
                     if stream:
@@ -314,13 +668,27 @@ class SFAssistClient:
             
             else:
                 # Handle error responses
-                print(f"ERROR: Response status {response.status_code}")
-                print(f"ERROR: Response body: {response.text}")
+                logger.error("Response status %s: %s", response.status_code, response.text)
                 try:
                     error_data = response.json()
-                    raise Exception(f"API Error Response: {json.dumps(error_data, indent=2)}")
+                    raise APIResponseError(f"API Error Response: {json.dumps(error_data, indent=2)}",
+                                           response.status_code)
                 except json.JSONDecodeError:
-                    raise Exception(f"API Error Response ({response.status_code}): {response.text}")
+                    raise APIResponseError(f"API Error Response ({response.status_code}): {response.text}",
+                                           response.status_code)
+        
+        def _stream_response(self, response: requests.Response):
+            """
+            Yield deltas of an incremental (SSE / NDJSON) response as they arrive
+            
+            Args:
+                response: Streaming response from _make_request
+                
+            Yields:
+                StreamingChunk objects
+            """
+            for delta in iter_stream_deltas(response, self.client.stream_flush_interval):
+                yield StreamingChunk(delta)
         
         def _simulate_streaming(self, content: str):
             """
@@ -0,0 +1,167 @@
+import gzip
+import json
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from logger import logger
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+
+DEFAULT_REQUEST_COMPRESSION = COMPRESSION_NONE   # the gateway has to accept Content-Encoding
+DEFAULT_COMPRESSION_MIN_BYTES = 4096             # smaller bodies are sent uncompressed
+DEFAULT_GZIP_LEVEL = 5
+DEFAULT_ZSTD_LEVEL = 3
+UNSUPPORTED_ENCODING_STATUS = 415                # gateway rejected Content-Encoding
+
+
+# ============================================================================
+#                         JSON
+# ============================================================================
+
+def dumps(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from bytes or str; raises ValueError (json.JSONDecodeError) on bad input"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def resolve_compression(name: Optional[str]) -> str:
+    """Normalize a request_compression setting, falling back to gzip when zstandard is missing"""
+    name = str(name or COMPRESSION_NONE).strip().lower()
+    if name in (COMPRESSION_NONE, '', 'false', 'off', 'identity'):
+        return COMPRESSION_NONE
+    if name == COMPRESSION_ZSTD and not ZSTD_AVAILABLE:
+        logger.warning("request_compression=zstd but zstandard is not installed, using gzip")
+        return COMPRESSION_GZIP
+    if name not in (COMPRESSION_GZIP, COMPRESSION_ZSTD):
+        logger.warning("Unknown request_compression %r, sending uncompressed bodies", name)
+        return COMPRESSION_NONE
+    return name
+
+
+# ============================================================================
+#                         REQUEST ENCODER
+# ============================================================================
+
+class RequestEncoder:
+    """
+    Serialize (and optionally compress) request payloads once per request
+
+    Compression is negotiated: a gateway answering 415 to a compressed body
+    turns compression off for the client and the request is resent plain.
+    Body sizes and serialization / parse times are kept for client metrics.
+    """
+
+    def __init__(self, compression: str = DEFAULT_REQUEST_COMPRESSION,
+                 min_bytes: int = DEFAULT_COMPRESSION_MIN_BYTES, level: int = None):
+        """
+        Args:
+            compression: COMPRESSION_NONE, COMPRESSION_GZIP or COMPRESSION_ZSTD
+            min_bytes: Bodies below this size are not compressed
+            level: Compression level (codec default when omitted)
+        """
+        self.compression = resolve_compression(compression)
+        self.min_bytes = min_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "compressed": 0, "raw_bytes": 0, "wire_bytes": 0, "max_raw_bytes": 0,
+            "serialize_seconds": 0.0, "max_serialize_seconds": 0.0,
+            "responses": 0, "response_bytes": 0, "parse_seconds": 0.0,
+        }
+
+    def _compress(self, body: bytes) -> bytes:
+        if self.compression == COMPRESSION_ZSTD:
+            return zstandard.ZstdCompressor(level=self.level or DEFAULT_ZSTD_LEVEL).compress(body)
+        return gzip.compress(body, compresslevel=self.level or DEFAULT_GZIP_LEVEL)
+
+    def encode(self, payload: Dict) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Returns:
+            (body, extra headers) - headers carry Content-Encoding when the body is compressed
+        """
+        start = time.perf_counter()
+        body = dumps(payload)
+        raw_bytes = len(body)
+        headers = {}
+        compression = self.compression
+        if compression != COMPRESSION_NONE and raw_bytes >= self.min_bytes:
+            body = self._compress(body)
+            headers["Content-Encoding"] = compression
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            stats = self._stats
+            stats["requests"] += 1
+            stats["compressed"] += 1 if headers else 0
+            stats["raw_bytes"] += raw_bytes
+            stats["wire_bytes"] += len(body)
+            stats["max_raw_bytes"] = max(stats["max_raw_bytes"], raw_bytes)
+            stats["serialize_seconds"] += elapsed
+            stats["max_serialize_seconds"] = max(stats["max_serialize_seconds"], elapsed)
+        return body, headers
+
+    def refresh(self, payload: Dict, encoded: Tuple[bytes, Dict[str, str]] = None) -> Tuple[bytes, Dict[str, str]]:
+        """encode() result of payload, reusing encoded unless compression was turned off since it was built"""
+        if encoded is None or encoded[1].get("Content-Encoding", self.compression) != self.compression:
+            return self.encode(payload)
+        return encoded
+
+    def rejected(self, status_code: int, headers: Dict[str, str]) -> bool:
+        """True (and compression turned off) when a compressed body was refused by the gateway"""
+        if status_code != UNSUPPORTED_ENCODING_STATUS or "Content-Encoding" not in headers:
+            return False
+        if self.compression != COMPRESSION_NONE:
+            logger.warning("Gateway rejected %s request bodies (HTTP %s), sending uncompressed",
+                           headers["Content-Encoding"], status_code)
+        self.compression = COMPRESSION_NONE
+        return True
+
+    def parse(self, data):
+        """loads() a response body, recording its size and parse time"""
+        start = time.perf_counter()
+        result = loads(data)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["responses"] += 1
+            self._stats["response_bytes"] += len(data)
+            self._stats["parse_seconds"] += elapsed
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        """Request body sizes (raw / on the wire), serialization and response parse times"""
+        with self._lock:
+            stats = dict(self._stats)
+        requests, responses = stats["requests"], stats["responses"]
+        stats["compression"] = self.compression
+        stats["json_encoder"] = 'orjson' if ORJSON_AVAILABLE else 'json'
+        stats["avg_raw_bytes"] = stats["raw_bytes"] / requests if requests else 0.0
+        stats["avg_serialize_seconds"] = stats["serialize_seconds"] / requests if requests else 0.0
+        stats["compression_ratio"] = stats["wire_bytes"] / stats["raw_bytes"] if stats["raw_bytes"] else 1.0
+        stats["avg_parse_seconds"] = stats["parse_seconds"] / responses if responses else 0.0
+        return stats
@@ -0,0 +1,227 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Optional
+
+from logger import logger
+from sfassist_retry import is_retryable_status
+
+
+DEFAULT_HEDGE_PERCENTILE = 95     # hedge once the request is slower than this percentile
+DEFAULT_HEDGE_MIN_DELAY = 2.0     # never hedge earlier than this many seconds
+DEFAULT_HEDGE_MAX_RATIO = 0.05    # at most this fraction of recent requests is hedged
+DEFAULT_HEDGE_MIN_SAMPLES = 20    # latencies needed before hedging starts
+HEDGE_WINDOW = 200                # recent requests kept for percentiles and the hedge budget
+
+
+# ============================================================================
+#                         HEDGE POLICY
+# ============================================================================
+
+class HedgePolicy:
+    """
+    When to send a duplicate request, from the latency of recent ones
+
+    Latency is time until the response starts (headers received), so a long
+    streamed answer does not count as slow. The hedge budget is a sliding
+    window: a hedge is only sent while fewer than max_ratio of the last
+    HEDGE_WINDOW requests were hedged.
+    """
+
+    def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 min_delay: float = DEFAULT_HEDGE_MIN_DELAY,
+                 max_ratio: float = DEFAULT_HEDGE_MAX_RATIO,
+                 min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES):
+        """
+        Args:
+            percentile: Recent-latency percentile after which a hedge is sent
+            min_delay: Lower bound of the hedge delay in seconds
+            max_ratio: Cap of hedged requests over the recent window
+            min_samples: Latency samples required before hedging
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=HEDGE_WINDOW)
+        self._hedged = deque(maxlen=HEDGE_WINDOW)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None while there are too few samples"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
+
+    def start_request(self) -> list:
+        """Count a request; returns its slot in the hedge window, passed to try_hedge()"""
+        slot = [False]  # set to True if this request is hedged
+        with self._lock:
+            self._stats["requests"] += 1
+            self._hedged.append(slot)
+        return slot
+
+    def try_hedge(self, slot: list) -> bool:
+        """Spend hedge budget for the request of slot; False when the recent hedge rate is at max_ratio"""
+        with self._lock:
+            hedged = sum(1 for entry in self._hedged if entry[0])
+            if hedged + 1 > self.max_ratio * len(self._hedged):
+                return False
+            slot[0] = True
+            self._stats["hedged"] += 1
+            return True
+
+    def record_hedge_win(self):
+        with self._lock:
+            self._stats["hedge_wins"] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["samples"] = len(self._latencies)
+        stats["hedge_delay"] = self.hedge_delay()
+        return stats
+
+
+# ============================================================================
+#                         HEDGED CALLS
+# ============================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='sfassist-hedge')
+        return _executor
+
+
+def _close_when_done(future):
+    """Cancel a losing request: drop it if not started, otherwise close its response when it arrives"""
+    if future.cancel():
+        return
+
+    def close(f):
+        if not f.cancelled() and f.exception() is None:
+            f.result().close()
+    future.add_done_callback(close)
+
+
+def _answered(attempt) -> bool:
+    """A finished attempt (Future / Task) that got a response the retry layer would not retry"""
+    if attempt.exception() is not None:
+        return False
+    return not is_retryable_status(getattr(attempt.result(), 'status_code', 200))
+
+
+def _pick_winner(finished: list):
+    """First answered attempt; else the first response (its status / Retry-After reach the retry layer)"""
+    return next((a for a in finished if _answered(a)),
+                next((a for a in finished if a.exception() is None), finished[0]))
+
+
+def hedged_call(send: Callable, policy: HedgePolicy):
+    """
+    Run send() and, if it has not answered within the hedge delay, a duplicate
+
+    The first attempt to answer wins and the other one is cancelled. An
+    attempt that fails - an exception or a retryable status (429 / 5xx) -
+    while the other is still running is ignored in its favour.
+    """
+    slot = policy.start_request()
+    delay = policy.hedge_delay()
+    start = time.monotonic()
+    if delay is None:
+        response = send()
+        policy.record_latency(time.monotonic() - start)
+        return response
+
+    executor = _get_executor()
+    sent_at = []
+    started = threading.Event()
+
+    def run_primary():
+        sent_at.append(time.monotonic())
+        started.set()
+        return send()
+
+    primary = executor.submit(run_primary)
+    # The delay runs from when the request is sent, not from when it was queued for a worker
+    started.wait()
+    start = sent_at[0]
+    done, _ = wait([primary], timeout=max(start + delay - time.monotonic(), 0))
+    if done or not policy.try_hedge(slot):
+        response = primary.result()
+        policy.record_latency(time.monotonic() - start)
+        return response
+
+    logger.debug("No response after %.2fs, sending hedged request", delay)
+    hedge = executor.submit(send)
+    pending = {primary, hedge}
+    finished = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finished.extend(done)
+        if any(_answered(f) for f in done):
+            break
+    winner = _pick_winner(finished)
+    for attempt in (primary, hedge):
+        if attempt is not winner:
+            _close_when_done(attempt)
+    if winner is hedge:
+        policy.record_hedge_win()
+    response = winner.result()
+    policy.record_latency(time.monotonic() - start)
+    return response
+
+
+def _discard(task: asyncio.Task):
+    """Cancel a losing async request, closing its response if it already arrived"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+async def ahedged_call(send: Callable, policy: HedgePolicy):
+    """Async counterpart of hedged_call; send is a coroutine function and the loser is cancelled"""
+    slot = policy.start_request()
+    delay = policy.hedge_delay()
+    start = time.monotonic()
+    primary = asyncio.ensure_future(send())
+    if delay is not None:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if not done and policy.try_hedge(slot):
+            hedge = asyncio.ensure_future(send())
+            pending = {primary, hedge}
+            finished = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finished.extend(done)
+                if any(_answered(t) for t in done):
+                    break
+            winner = _pick_winner(finished)
+            for attempt in (primary, hedge):
+                if attempt is not winner:
+                    _discard(attempt)
+            if winner is hedge:
+                policy.record_hedge_win()
+            response = winner.result()
+            policy.record_latency(time.monotonic() - start)
+            return response
+    response = await primary
+    policy.record_latency(time.monotonic() - start)
+    return response
@@ -0,0 +1,522 @@
+import argparse
+import gzip
+import http.server
+import json
+import math
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import requests
+
+from sfassist_cache import payload_cache_key
+from sfassist_tokens import count_payload_tokens, count_tokens
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_MOCK_PORT = 8765
+DEFAULT_LATENCY = 'lognormal:1.0,0.5'   # time to first byte: median 1s, sigma 0.5
+DEFAULT_CHUNK_INTERVAL = 0.02           # seconds between streamed chunks
+DEFAULT_CHUNK_WORDS = 3                 # words per streamed chunk
+DEFAULT_HANG_SECONDS = 300.0            # injected timeouts hold the request this long
+
+# Markers of the agent prompts (prompts.py) used to pick a canned answer
+KIND_CODE = 'code'          # programmer turn: answer with a python block
+KIND_REPAIR = 'repair'      # CODE_FIX: answer with fixed code
+KIND_INSPECT = 'inspect'    # CODE_INSPECT: bug analysis, no code
+KIND_SUMMARY = 'summary'    # RESULT_PROMPT: explanation + next steps
+PROMPT_MARKERS = (
+    (KIND_INSPECT, 'You are an experienced and insightful inspector'),
+    (KIND_REPAIR, 'You should attempt to fix the bugs'),
+    (KIND_SUMMARY, 'This is the executing result by computer'),
+)
+
+DEFAULT_ANSWERS = {
+    KIND_CODE: (
+        "Let me start by looking at the data.\n"
+        "```python\n"
+        "import numpy as np\n"
+        "import pandas as pd\n"
+        "df = pd.DataFrame({'x': np.arange(10), 'y': np.arange(10) ** 2})\n"
+        "print(df.describe())\n"
+        "```\n"
+    ),
+    KIND_REPAIR: (
+        "I fixed the code by defining the missing variable first.\n"
+        "```python\n"
+        "import pandas as pd\n"
+        "df = pd.DataFrame({'x': range(10)})\n"
+        "print(df.head())\n"
+        "```\n"
+    ),
+    KIND_INSPECT: (
+        "The error is raised because a variable is used before it is defined. "
+        "Define it (or load the data) before calling methods on it."
+    ),
+    KIND_SUMMARY: (
+        "| stat | x |\n|---|---|\n| mean | 4.5 |\n| std | 3.03 |\n\n"
+        "The data has 10 rows with evenly spaced values.\n"
+        "Next, you can:\n[1]Plot the distribution of x.\n[2]Check for outliers.\n[3]Fit a regression model."
+    ),
+}
+
+
+def validate_payload(payload) -> List[Dict]:
+    """
+    Check the query.application / prompt / model shape built by SFAssistClient._build_payload
+
+    Returns:
+        prompt.messages
+
+    Raises:
+        ValueError: describing the first problem found
+    """
+    query = payload.get('query') if isinstance(payload, dict) else None
+    if not isinstance(query, dict):
+        raise ValueError("missing query object")
+    application = query.get('application') or {}
+    missing = [k for k in ('aplctn_cd', 'app_id', 'app_lvl_prefix', 'session_id') if k not in application]
+    if missing:
+        raise ValueError(f"query.application is missing {', '.join(missing)}")
+    if not (query.get('model') or {}).get('model'):
+        raise ValueError("query.model.model is missing")
+    messages = (query.get('prompt') or {}).get('messages')
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("query.prompt.messages must be a non-empty list")
+    if not all(isinstance(m, dict) and 'role' in m and 'content' in m for m in messages):
+        raise ValueError("query.prompt.messages entries need role and content")
+    return messages
+
+
+def classify_request(messages: List[Dict]) -> str:
+    """Agent stage of a request (KIND_*), from the prompt template of its last user message"""
+    last_user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+    for kind, marker in PROMPT_MARKERS:
+        if marker in last_user:
+            return kind
+    return KIND_CODE
+
+
+# ============================================================================
+#                         LATENCY MODEL
+# ============================================================================
+
+class LatencyModel:
+    """
+    Random latency distribution, parsed from "<kind>:<params>"
+
+    fixed:S | uniform:LOW,HIGH | lognormal:MEDIAN,SIGMA | exp:MEAN
+    """
+
+    def __init__(self, spec: str = DEFAULT_LATENCY, rng: random.Random = None):
+        kind, _, params = str(spec).partition(':')
+        self.kind = kind.strip().lower()
+        self.params = [float(p) for p in params.split(',') if p.strip()]
+        self.spec = spec
+        self._rng = rng or random.Random()
+        if self.kind not in ('fixed', 'uniform', 'lognormal', 'exp'):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == 'fixed':
+            return p[0] if p else 0.0
+        if self.kind == 'uniform':
+            return self._rng.uniform(p[0], p[1])
+        if self.kind == 'lognormal':
+            return self._rng.lognormvariate(math.log(p[0]), p[1] if len(p) > 1 else 0.5)
+        return self._rng.expovariate(1.0 / p[0])
+
+    def __repr__(self):
+        return f"LatencyModel({self.spec!r})"
+
+
+# ============================================================================
+#                         RECORDER / REPLAYER
+# ============================================================================
+
+class SessionRecording:
+    """
+    JSONL recording of real SF Assist exchanges, keyed by payload_cache_key
+
+    Each line: {"key", "payload", "status", "content", "latency"}. Replay
+    serves recorded answers for identical payloads (cycling through repeats).
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._entries: Dict[str, List[Dict]] = {}
+        self._order: List[Dict] = []
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            self._add(json.loads(line))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._order)
+
+    def _add(self, entry: Dict):
+        self._entries.setdefault(entry['key'], []).append(entry)
+        self._order.append(entry)
+
+    def record(self, payload: Dict, status: int, content: str, latency: float):
+        entry = {"key": payload_cache_key(payload), "payload": payload, "status": status,
+                 "content": content, "latency": round(latency, 4)}
+        with self._lock:
+            self._add(entry)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def lookup(self, payload: Dict) -> Optional[Dict]:
+        key = payload_cache_key(payload)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[index % len(entries)]
+
+    def payloads(self) -> List[Dict]:
+        """Recorded payloads in file order, for replaying a session as load"""
+        with self._lock:
+            return [e['payload'] for e in self._order]
+
+
+# ============================================================================
+#                         MOCK SERVER
+# ============================================================================
+
+class _MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.server.mock._handle(self)
+
+
+class MockCortexServer:
+    """
+    Local stand-in for the SF Assist / Cortex endpoint
+
+    Accepts the query.application / prompt / model payload of
+    SFAssistClient._build_payload (400 on anything else), answers JSON
+    ({"text", "usage"}) or, when query.stream is set, an SSE stream of
+    OpenAI-style deltas. Latency, error and timeout injection make it
+    usable for load and resilience tests of the full DSA stack: point
+    sfassist.base_url at mock.url.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: str = DEFAULT_LATENCY,
+                 chunk_interval: float = DEFAULT_CHUNK_INTERVAL, chunk_words: int = DEFAULT_CHUNK_WORDS,
+                 error_rate: float = 0.0, error_statuses=(429, 500, 503), timeout_rate: float = 0.0,
+                 hang_seconds: float = DEFAULT_HANG_SECONDS,
+                 answers: Union[Dict[str, str], Callable[[List[Dict]], str]] = None,
+                 api_key: str = None, replay: SessionRecording = None, replay_latency: bool = False,
+                 record: SessionRecording = None, upstream: str = None, upstream_api_key: str = None,
+                 seed: int = None):
+        """
+        Args:
+            host / port: Bind address (port 0 picks a free port)
+            latency: Time-to-first-byte distribution (LatencyModel spec)
+            chunk_interval: Seconds between streamed chunks
+            chunk_words: Words per streamed chunk
+            error_rate: Share of requests answered with one of error_statuses
+            error_statuses: Injected statuses (429 carries Retry-After: 1)
+            timeout_rate: Share of requests held for hang_seconds and dropped
+            answers: Per-kind canned answers (KIND_*) or a callable(messages) -> answer
+            api_key: Require this api-key header (401 otherwise)
+            replay: Serve recorded answers for known payloads, canned answers otherwise
+            replay_latency: Reproduce the recorded latency of replayed answers
+            record: Forward to upstream and append each exchange to this recording
+            upstream / upstream_api_key: Real endpoint used in record mode
+            seed: Seed for latency / error sampling
+        """
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.chunk_interval = chunk_interval
+        self.chunk_words = max(1, chunk_words)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.answers = answers if callable(answers) else dict(DEFAULT_ANSWERS, **(answers or {}))
+        self.api_key = api_key
+        self.replay = replay
+        self.replay_latency = replay_latency
+        self.record = record
+        self.upstream = upstream
+        self.upstream_api_key = upstream_api_key
+        if record is not None and not upstream:
+            raise ValueError("record mode needs an upstream URL")
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _MockHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "streamed": 0, "bad_requests": 0, "errors_injected": 0,
+                       "timeouts_injected": 0, "replay_hits": 0, "replay_misses": 0, "recorded": 0,
+                       "kinds": {}}
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockCortexServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-cortex', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, key: str, kind: str = None):
+        with self._lock:
+            self._stats[key] += 1
+            if kind:
+                self._stats["kinds"][kind] = self._stats["kinds"].get(kind, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, kinds=dict(self._stats["kinds"]))
+
+    # -------------------------------------------------------------- request handling
+
+    def _read_payload(self, handler) -> Optional[Dict]:
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0)))
+        encoding = (handler.headers.get('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                self._send_json(handler, 415, {"error": "zstd request bodies are not supported"})
+                return None
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        try:
+            payload = json.loads(body)
+            validate_payload(payload)
+        except ValueError as e:
+            self._count("bad_requests")
+            self._send_json(handler, 400, {"error": f"Malformed payload: {e}"})
+            return None
+        return payload
+
+    def _handle(self, handler):
+        payload = self._read_payload(handler)
+        if payload is None:
+            return
+        if self.api_key and handler.headers.get('api-key') != self.api_key:
+            self._send_json(handler, 401, {"error": "invalid api-key"})
+            return
+
+        messages = payload['query']['prompt']['messages']
+        kind = classify_request(messages)
+        self._count("requests", kind)
+
+        roll = self.rng.random()
+        if roll < self.timeout_rate:
+            self._count("timeouts_injected")
+            time.sleep(self.hang_seconds)
+            handler.close_connection = True
+            return
+        if roll < self.timeout_rate + self.error_rate:
+            self._count("errors_injected")
+            time.sleep(self.latency.sample())
+            status = self.rng.choice(self.error_statuses)
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            self._send_json(handler, status, {"error": f"injected {status}"}, headers)
+            return
+
+        status, content, delay = self._answer(payload, messages, kind)
+        time.sleep(delay)
+        if status != 200:
+            self._send_json(handler, status, {"error": content})
+        elif payload['query'].get('stream'):
+            self._count("streamed")
+            self._send_stream(handler, content)
+        else:
+            usage = {"prompt_tokens": count_payload_tokens(payload), "completion_tokens": count_tokens(content)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            self._send_json(handler, 200, {"text": content, "usage": usage})
+
+    def _answer(self, payload: Dict, messages: List[Dict], kind: str):
+        """(status, content, delay before the first byte) for a request"""
+        if self.record is not None:
+            return self._forward(payload)
+        if self.replay is not None:
+            entry = self.replay.lookup(payload)
+            if entry is not None:
+                self._count("replay_hits")
+                delay = entry['latency'] if self.replay_latency else self.latency.sample()
+                return entry['status'], entry['content'], delay
+            self._count("replay_misses")
+        content = self.answers(messages) if callable(self.answers) else self.answers.get(kind, self.answers[KIND_CODE])
+        return 200, content, self.latency.sample()
+
+    def _forward(self, payload: Dict):
+        """Record mode: send the payload (non-streamed) to the real endpoint and record the answer"""
+        upstream_payload = json.loads(json.dumps(payload))
+        upstream_payload['query'].pop('stream', None)
+        headers = {"Content-Type": "application/json; charset=utf-8", "Accept": "application/json"}
+        if self.upstream_api_key:
+            headers["api-key"] = self.upstream_api_key
+        start = time.monotonic()
+        response = requests.post(self.upstream, json=upstream_payload, headers=headers, verify=False, timeout=300)
+        latency = time.monotonic() - start
+        try:
+            data = response.json()
+            content = data.get('text') or data.get('response') or data.get('content') or json.dumps(data)
+        except ValueError:
+            content = response.text
+        self.record.record(payload, response.status_code, content, latency)
+        self._count("recorded")
+        return response.status_code, content, 0.0
+
+    # -------------------------------------------------------------- responses
+
+    @staticmethod
+    def _send_json(handler, status: int, data: Dict, headers: Dict[str, str] = None):
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_stream(self, handler, content: str):
+        """SSE body with OpenAI-style deltas, chunk_words words every chunk_interval, then [DONE]"""
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        def write(data: str):
+            raw = data.encode('utf-8')
+            handler.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+            handler.wfile.flush()
+
+        words = content.split(' ')
+        try:
+            for i in range(0, len(words), self.chunk_words):
+                piece = ' '.join(words[i:i + self.chunk_words])
+                if i + self.chunk_words < len(words):
+                    piece += ' '
+                write("data: " + json.dumps({"choices": [{"delta": {"content": piece}}]}) + "\n\n")
+                time.sleep(self.chunk_interval)
+            write("data: [DONE]\n\n")
+            handler.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            handler.close_connection = True
+
+
+# ============================================================================
+#                         LOAD HARNESS
+# ============================================================================
+
+def run_load(client, message_lists: List[List[Dict]], concurrency: int = 8, **create_kwargs) -> Dict:
+    """
+    Send message_lists through client.chat.completions.batch_create and summarize latencies
+
+    Returns:
+        Request / error counts, wall time, throughput and p50 / p95 / p99 latency
+    """
+    requests_ = [dict(create_kwargs, messages=messages) for messages in message_lists]
+    start = time.monotonic()
+    results = client.chat.completions.batch_create(requests_, max_concurrency=concurrency)
+    wall = time.monotonic() - start
+    latencies = sorted(r.latency for r in results if r.ok)
+
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)]
+
+    errors = {}
+    for r in results:
+        if not r.ok:
+            errors[type(r.error).__name__] = errors.get(type(r.error).__name__, 0) + 1
+    return {
+        "requests": len(results), "ok": len(latencies), "errors": errors, "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2) if wall else 0.0,
+        "p50": round(percentile(50), 3), "p95": round(percentile(95), 3), "p99": round(percentile(99), 3),
+    }
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Mock SF Assist / Cortex endpoint and load harness")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help="run the mock endpoint")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=DEFAULT_MOCK_PORT)
+    serve.add_argument('--latency', default=DEFAULT_LATENCY, help="fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA | exp:MEAN")
+    serve.add_argument('--chunk-interval', type=float, default=DEFAULT_CHUNK_INTERVAL)
+    serve.add_argument('--error-rate', type=float, default=0.0)
+    serve.add_argument('--timeout-rate', type=float, default=0.0)
+    serve.add_argument('--api-key')
+    serve.add_argument('--replay', help="JSONL recording to serve answers from")
+    serve.add_argument('--record', help="JSONL file to append forwarded exchanges to")
+    serve.add_argument('--upstream', help="real endpoint URL (record mode)")
+    serve.add_argument('--upstream-api-key')
+    serve.add_argument('--seed', type=int)
+
+    load = sub.add_parser('load', help="replay a recording (or canned prompts) against an endpoint")
+    load.add_argument('--url', required=True)
+    load.add_argument('--replay', help="JSONL recording whose payloads are sent")
+    load.add_argument('--requests', type=int, default=100)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--api-key', default='mock')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        mock = MockCortexServer(
+            host=args.host, port=args.port, latency=args.latency, chunk_interval=args.chunk_interval,
+            error_rate=args.error_rate, timeout_rate=args.timeout_rate, api_key=args.api_key,
+            replay=SessionRecording(args.replay) if args.replay else None,
+            record=SessionRecording(args.record) if args.record else None,
+            upstream=args.upstream, upstream_api_key=args.upstream_api_key, seed=args.seed)
+        print(f"Mock Cortex endpoint on {mock.url} (latency {args.latency}, errors {args.error_rate:.0%})")
+        try:
+            mock._httpd.serve_forever()
+        except KeyboardInterrupt:
+            print(json.dumps(mock.stats(), indent=2))
+        return
+
+    from sfassist_client import SFAssistClient
+    client = SFAssistClient({"sfassist": {"api_key": args.api_key, "base_url": args.url}})
+    if args.replay:
+        payloads = SessionRecording(args.replay).payloads()
+        message_lists = [p['query']['prompt']['messages'] for p in payloads]
+    else:
+        message_lists = [[{"role": "user", "content": f"Analyse the dataset, request {i}"}] for i in range(args.requests)]
+    message_lists = (message_lists * (args.requests // max(len(message_lists), 1) + 1))[:args.requests]
+    print(json.dumps(run_load(client, message_lists, args.concurrency, cache=False), indent=2))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,157 @@
+import threading
+import time
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_POOL_CONNECTIONS = 10     # number of per-host pools kept alive
+DEFAULT_POOL_MAXSIZE = 20         # max open connections per host
+DEFAULT_POOL_BLOCK = False        # block instead of opening extra connections past maxsize
+DEFAULT_POOL_IDLE_TIMEOUT = 60.0  # seconds before idle keep-alive connections are dropped
+
+
+# ============================================================================
+#                         POOLED SESSION
+# ============================================================================
+
+class PooledSession:
+    """
+    Keep-alive HTTP session shared by every SFAssistClient in the process
+
+    Wraps a requests.Session with a tuned HTTPAdapter so consecutive LLM calls
+    reuse the same TCP+TLS connection instead of handshaking on every turn.
+    Connections idle for longer than idle_timeout are evicted before the next
+    request (the Cortex gateway drops them on its side anyway).
+    """
+
+    def __init__(self, pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 pool_block: bool = DEFAULT_POOL_BLOCK,
+                 idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT):
+        """
+        Args:
+            pool_connections: Number of host pools to cache
+            pool_maxsize: Maximum connections kept per host
+            pool_block: Wait for a free connection when a host is at pool_maxsize
+            idle_timeout: Seconds of inactivity after which pooled connections are closed
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.idle_timeout = idle_timeout
+
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._requests_sent = 0
+        self._in_flight = 0
+        self._idle_evictions = 0
+        # Counters of pools that were already closed by idle eviction
+        self._evicted_connections = 0
+        self._evicted_requests = 0
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST through the pooled session"""
+        with self._lock:
+            self._evict_if_idle()
+            self._in_flight += 1
+            self._last_used = time.monotonic()
+        try:
+            return self.session.post(url, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._requests_sent += 1
+                self._last_used = time.monotonic()
+
+    def _evict_if_idle(self):
+        """Close pooled connections that sat idle longer than idle_timeout (lock held)"""
+        if not self.idle_timeout or self._in_flight:
+            return
+        if time.monotonic() - self._last_used <= self.idle_timeout:
+            return
+        opened, served = self._pool_counters()
+        self._evicted_connections += opened
+        self._evicted_requests += served
+        self.adapter.poolmanager.clear()
+        self._idle_evictions += 1
+
+    def _pool_counters(self) -> Tuple[int, int]:
+        """Sum (connections opened, requests served) over the live host pools"""
+        pools = self.adapter.poolmanager.pools
+        opened = served = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += getattr(pool, 'num_connections', 0)
+            served += getattr(pool, 'num_requests', 0)
+        return opened, served
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Connection reuse counters
+
+        Returns:
+            Dict with requests sent, connections opened, connections reused and idle evictions
+        """
+        with self._lock:
+            opened, served = self._pool_counters()
+            opened += self._evicted_connections
+            served += self._evicted_requests
+            return {
+                "requests": self._requests_sent,
+                "connections_opened": opened,
+                "connections_reused": max(served - opened, 0),
+                "idle_evictions": self._idle_evictions,
+                "pool_connections": self.pool_connections,
+                "pool_maxsize": self.pool_maxsize,
+            }
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            self.session.close()
+
+
+# ============================================================================
+#                         PROCESS-WIDE POOLS
+# ============================================================================
+
+_pools: Dict[tuple, PooledSession] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pooled_session(pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                       pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                       pool_block: bool = DEFAULT_POOL_BLOCK,
+                       idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT) -> PooledSession:
+    """
+    Return the process-wide PooledSession for the given pool settings
+
+    Every client built with the same settings shares one session, so the
+    conversation, programmer and inspector clients reuse the same connections.
+    """
+    key = (int(pool_connections), int(pool_maxsize), bool(pool_block), float(idle_timeout))
+    with _pools_lock:
+        pooled = _pools.get(key)
+        if pooled is None:
+            pooled = PooledSession(*key)
+            _pools[key] = pooled
+        return pooled
+
+
+def close_pooled_sessions():
+    """Close and forget every process-wide pool (used on shutdown)"""
+    with _pools_lock:
+        for pooled in _pools.values():
+            pooled.close()
+        _pools.clear()
@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+
+PRIORITY_INTERACTIVE = 'interactive'  # programmer / inspector turns a user is waiting on
+PRIORITY_BACKGROUND = 'background'    # reports, summaries
+PRIORITIES = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 1}
+
+DEFAULT_RATE_LIMIT_RPM = 0               # requests per minute, 0 disables the budget
+DEFAULT_RATE_LIMIT_TPM = 0               # estimated tokens per minute, 0 disables the budget
+DEFAULT_RATE_LIMIT_MAX_WAIT = 120.0      # seconds a request may queue before giving up
+DEFAULT_COMPLETION_TOKEN_ESTIMATE = 512  # tokens budgeted for the answer before usage is known
+ASYNC_POLL_INTERVAL = 0.05               # seconds between budget checks of a queued coroutine
+
+
+class RateLimitTimeout(Exception):
+    """A request waited longer than max_wait for rate-limit budget"""
+
+
+# ============================================================================
+#                         TOKEN BUCKET
+# ============================================================================
+
+class TokenBucket:
+    """Continuously refilling bucket of per-minute budget; not thread-safe on its own"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (0 when it is available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self._level >= amount else (amount - self._level) / self.rate
+
+    def take(self, amount: float, now: float):
+        """Debit amount; may go negative (reconciled usage above the estimate)"""
+        self._refill(now)
+        self._level -= amount
+
+
+# ============================================================================
+#                         RATE LIMITER
+# ============================================================================
+
+class RateLimiter:
+    """
+    Client-side requests/min and tokens/min budget shared by every caller
+
+    Waiters are served strictly by priority lane, then FIFO: while an
+    interactive request is queued, background requests (reports, summaries)
+    do not take budget ahead of it.
+    """
+
+    def __init__(self, requests_per_minute: float = DEFAULT_RATE_LIMIT_RPM,
+                 tokens_per_minute: float = DEFAULT_RATE_LIMIT_TPM,
+                 max_wait: float = DEFAULT_RATE_LIMIT_MAX_WAIT):
+        """
+        Args:
+            requests_per_minute: Request budget (0 = unlimited)
+            tokens_per_minute: Estimated token budget (0 = unlimited)
+            max_wait: Seconds a request may queue before RateLimitTimeout
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._lanes = {name: {"requests": 0, "queued": 0, "total_wait": 0.0, "max_wait": 0.0, "timeouts": 0}
+                       for name in PRIORITIES}
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, tokens: float = 0, priority: str = PRIORITY_INTERACTIVE,
+                max_wait: Optional[float] = None) -> float:
+        """
+        Block until the request fits the budget, then debit it
+
+        Args:
+            tokens: Estimated tokens of the request
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            max_wait: Override of the limiter's max_wait
+
+        Returns:
+            Seconds spent queueing
+
+        Raises:
+            RateLimitTimeout: the budget did not free up within max_wait
+        """
+        if self.requests is None and self.tokens is None:
+            return 0.0
+        lane = priority if priority in PRIORITIES else PRIORITY_INTERACTIVE
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        entry = (PRIORITIES[lane], next(self._seq))
+        with self._cond:
+            self._enqueue(entry, lane)
+            try:
+                while True:
+                    wait, remaining = self._try_take(entry, lane, tokens, start, max_wait)
+                    if wait is None:
+                        break
+                    # Head of the queue sleeps until its budget refills; others until woken
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._dequeue(entry, lane)
+            return self._record(lane, start)
+
+    async def aacquire(self, tokens: float = 0, priority: str = PRIORITY_INTERACTIVE,
+                       max_wait: Optional[float] = None) -> float:
+        """
+        acquire() for coroutines: queues in the same lanes, but waits with asyncio.sleep
+        (polling every ASYNC_POLL_INTERVAL) instead of holding a thread
+        """
+        if self.requests is None and self.tokens is None:
+            return 0.0
+        lane = priority if priority in PRIORITIES else PRIORITY_INTERACTIVE
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        entry = (PRIORITIES[lane], next(self._seq))
+        with self._cond:
+            self._enqueue(entry, lane)
+        try:
+            while True:
+                with self._cond:
+                    wait, remaining = self._try_take(entry, lane, tokens, start, max_wait)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, remaining, ASYNC_POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self._dequeue(entry, lane)
+        with self._cond:
+            return self._record(lane, start)
+
+    def _enqueue(self, entry: tuple, lane: str):
+        heapq.heappush(self._queue, entry)
+        self._lanes[lane]["queued"] += 1
+
+    def _dequeue(self, entry: tuple, lane: str):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._lanes[lane]["queued"] -= 1
+        self._cond.notify_all()
+
+    def _try_take(self, entry: tuple, lane: str, tokens: float, start: float, max_wait: float):
+        """
+        Debit the budget if entry is at the head of the queue and it fits (lock held)
+
+        Returns:
+            (None, None) once debited, else (seconds to wait, seconds left of max_wait)
+
+        Raises:
+            RateLimitTimeout: max_wait has passed
+        """
+        now = time.monotonic()
+        wait = self._wait_time(tokens, now) if self._queue[0] == entry else None
+        if wait == 0.0:
+            if self.requests is not None:
+                self.requests.take(1, now)
+            if self.tokens is not None:
+                self.tokens.take(tokens, now)
+            return None, None
+        remaining = max_wait - (now - start)
+        if remaining <= 0:
+            self._lanes[lane]["timeouts"] += 1
+            raise RateLimitTimeout(f"Rate limit: no budget within {max_wait:.1f}s ({lane})")
+        return (wait if wait is not None else remaining), remaining
+
+    def _record(self, lane: str, start: float) -> float:
+        """Count a request that got its budget; returns its queueing time (lock held)"""
+        waited = time.monotonic() - start
+        stats = self._lanes[lane]
+        stats["requests"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+        return waited
+
+    def reconcile(self, estimated_tokens: float, actual_tokens: float):
+        """Debit (or refund) the difference once the real usage of a request is known"""
+        if self.tokens is None or not actual_tokens:
+            return
+        with self._cond:
+            self.tokens.take(actual_tokens - estimated_tokens, time.monotonic())
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-lane request count, current queue length and queue-wait metrics"""
+        with self._cond:
+            stats = {}
+            for lane, lane_stats in self._lanes.items():
+                stats[lane] = dict(lane_stats)
+                count = lane_stats["requests"]
+                stats[lane]["avg_wait"] = lane_stats["total_wait"] / count if count else 0.0
+            return stats
+
+
+_limiters: Dict[tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint: str, requests_per_minute: float = DEFAULT_RATE_LIMIT_RPM,
+                     tokens_per_minute: float = DEFAULT_RATE_LIMIT_TPM,
+                     max_wait: float = DEFAULT_RATE_LIMIT_MAX_WAIT) -> RateLimiter:
+    """Return the process-wide RateLimiter of an endpoint (the quota is shared by every session)"""
+    key = (endpoint, float(requests_per_minute), float(tokens_per_minute), float(max_wait))
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute, max_wait)
+            _limiters[key] = limiter
+        return limiter
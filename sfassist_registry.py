@@ -0,0 +1,112 @@
+import hashlib
+import threading
+from typing import Dict
+
+from sfassist_client import SFAssistClient
+from sfassist_async import AsyncSFAssistClient
+
+
+# ============================================================================
+#                         SHARED CLIENT REGISTRY
+# ============================================================================
+#
+# Conversation, Programmer and Inspector used to build their own
+# SFAssistClient, so every session start fetched secrets and built pools three
+# times. The registry hands out one thread-safe client per endpoint /
+# application / model / API key for the whole process.
+
+_clients: Dict[tuple, SFAssistClient] = {}
+_async_clients: Dict[tuple, AsyncSFAssistClient] = {}
+_key_locks: Dict[tuple, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _setting(section, key: str, default=None):
+    if isinstance(section, dict):
+        value = section.get(key, default)
+    else:
+        value = getattr(section, key, default)
+    return default if value is None else value
+
+
+def client_key(config) -> tuple:
+    """
+    Registry key for a config: (endpoint(s), application, model, AWS env/region, API key hash)
+
+    Resolves the same section SFAssistClient.__init__ reads, without building a
+    client (which would fetch secrets). Sessions with different API keys get
+    different clients; the key itself is only kept as a hash.
+    """
+    if isinstance(config, dict):
+        section = config.get('sfassist', config)
+    else:
+        section = getattr(config, 'sfassist', config)
+    return (
+        str(_setting(section, 'base_url', '')).rstrip('/'),
+        str(_setting(section, 'base_urls', '')),
+        _setting(section, 'aplctn_cd', 'aedl'),
+        _setting(section, 'app_id', 'aedl'),
+        _setting(section, 'app_lvl_prefix', ''),
+        _setting(section, 'session_id', 'dsa_session'),
+        _setting(section, 'model', 'snowflake-llama-3.3-70b'),
+        _setting(section, 'env', 'dev'),
+        _setting(section, 'region_name', 'us-east-2'),
+        hashlib.sha256(str(_setting(section, 'api_key', '')).encode()).hexdigest(),
+    )
+
+
+def _lock_for(key: tuple) -> threading.Lock:
+    with _registry_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def get_shared_client(config) -> SFAssistClient:
+    """
+    Return the process-wide SFAssistClient for this config
+
+    Concurrent callers with the same key wait for a single construction, so a
+    session start performs at most one secrets fetch.
+
+    Args:
+        config: Config dict/object accepted by SFAssistClient
+    """
+    key = client_key(config)
+    with _lock_for(key):
+        client = _clients.get(key)
+        if client is None:
+            client = SFAssistClient(config)
+            _clients[key] = client
+            _async_clients.pop(key, None)
+        return client
+
+
+def get_shared_async_client(config) -> AsyncSFAssistClient:
+    """Return the process-wide AsyncSFAssistClient wrapping get_shared_client(config)"""
+    key = client_key(config)
+    client = get_shared_client(config)
+    with _lock_for(key):
+        aclient = _async_clients.get(key)
+        if aclient is None or aclient.sync_client is not client:
+            aclient = AsyncSFAssistClient(client)
+            _async_clients[key] = aclient
+        return aclient
+
+
+def refresh_shared_clients() -> int:
+    """
+    Refresh credentials of every registered client
+
+    Returns:
+        Number of clients whose credentials were refreshed
+    """
+    with _registry_lock:
+        clients = list(_clients.values())
+    return sum(1 for client in clients if client.refresh_credentials())
+
+
+def clear_shared_clients():
+    """Forget every registered client (tests / config reload)"""
+    with _registry_lock:
+        _clients.clear()
+        _async_clients.clear()
+        _key_locks.clear()
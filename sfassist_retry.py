@@ -0,0 +1,316 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+import requests
+
+try:
+    import httpx
+    _HTTPX_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+except ImportError:
+    _HTTPX_ERRORS = ()
+
+
+DEFAULT_RETRY_MAX_ATTEMPTS = 4          # total attempts, first one included
+DEFAULT_RETRY_BASE_DELAY = 0.5          # seconds, doubled per attempt
+DEFAULT_RETRY_MAX_DELAY = 20.0          # cap of the computed backoff
+DEFAULT_RETRY_MAX_RETRY_AFTER = 60.0    # longer Retry-After values are not waited for
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 5   # consecutive failures that open the circuit
+DEFAULT_BREAKER_RECOVERY_TIMEOUT = 30.0  # seconds before a probe request is let through
+
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+RETRYABLE_EXCEPTIONS = (requests.Timeout, requests.ConnectionError) + _HTTPX_ERRORS
+
+
+class CircuitOpenError(Exception):
+    """The endpoint's circuit is open; the request was not sent"""
+
+
+class APIResponseError(Exception):
+    """The endpoint answered with an error status (kept in status_code)"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """429 / 5xx / 408 are transient; other statuses are returned to the caller as-is"""
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+# ============================================================================
+#                         RETRY POLICY
+# ============================================================================
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After"""
+
+    def __init__(self, max_attempts: int = DEFAULT_RETRY_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+                 max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+                 max_retry_after: float = DEFAULT_RETRY_MAX_RETRY_AFTER):
+        """
+        Args:
+            max_attempts: Total attempts per request (1 disables retries)
+            base_delay: Backoff of the first retry in seconds
+            max_delay: Upper bound of the exponential backoff
+            max_retry_after: Give up instead of honouring a longer Retry-After
+        """
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Seconds to sleep before retry number attempt + 1
+
+        Returns:
+            The delay, or None when the server asks for a longer wait than max_retry_after
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is None:
+            return backoff
+        if retry_after > self.max_retry_after:
+            return None
+        return max(retry_after, backoff)
+
+
+# ============================================================================
+#                         CIRCUIT BREAKER
+# ============================================================================
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker
+
+    closed: requests flow; failure_threshold consecutive failures open it.
+    open: requests fail fast with CircuitOpenError for recovery_timeout seconds.
+    half_open: one probe request is let through; success closes the circuit,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout: float = DEFAULT_BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"failures": 0, "successes": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError unless a request may be sent now
+
+        Returns:
+            True when the request is the half-open probe; it must end in record_success,
+            record_failure or release_probe
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            retry_in = max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0)
+        raise CircuitOpenError(f"Circuit open for {self.name}; endpoint degraded, retry in {retry_in:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            self._state = self.CLOSED
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Let another probe through after one ended without an outcome (e.g. its task was cancelled)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._stats["opened"] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self._current_state()
+            stats["consecutive_failures"] = self._failures
+        return stats
+
+
+_breakers: Dict[tuple, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str, failure_threshold: int = DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                        recovery_timeout: float = DEFAULT_BREAKER_RECOVERY_TIMEOUT) -> CircuitBreaker:
+    """Return the process-wide CircuitBreaker of an endpoint"""
+    key = (endpoint, int(failure_threshold), float(recovery_timeout))
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, failure_threshold, recovery_timeout)
+            _breakers[key] = breaker
+        return breaker
+
+
+# ============================================================================
+#                         RETRY LOOPS
+# ============================================================================
+
+def _retry_delay(policy: RetryPolicy, attempt: int, response, deadline=None) -> Optional[float]:
+    if attempt + 1 >= policy.max_attempts:
+        return None
+    retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+    delay = policy.delay(attempt, retry_after)
+    # No retry that could only start after the turn's deadline
+    if delay is not None and deadline is not None and deadline.remaining() is not None \
+            and delay >= deadline.remaining():
+        return None
+    return delay
+
+
+def call_with_retry(send: Callable, policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None,
+                    sleep: Callable[[float], None] = time.sleep, deadline=None):
+    """
+    Run send() with retries on transient failures
+
+    Retryable statuses are retried until attempts run out, then the last
+    response is returned for the caller's normal error handling. Other
+    statuses (including 4xx) count as a healthy endpoint.
+
+    A deadline (deadline.Deadline) stops retries whose backoff would end past it.
+
+    Raises:
+        CircuitOpenError: the endpoint's circuit is open
+        DeadlineExceeded: the deadline expired before an attempt
+        RETRYABLE_EXCEPTIONS: timeouts / connection errors on the last attempt
+    """
+    attempt = 0
+    while True:
+        if deadline is not None:
+            deadline.check('LLM request')
+        probe = breaker.before_call() if breaker is not None else False
+        try:
+            response = send()
+        except RETRYABLE_EXCEPTIONS as e:
+            if breaker is not None:
+                breaker.record_failure()
+            delay = _retry_delay(policy, attempt, None, deadline)
+            if delay is None:
+                raise
+            print(f"⚠️ Request failed ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s")
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled / interrupted: no verdict on the endpoint, but the probe slot must not leak
+            if probe:
+                breaker.release_probe()
+            raise
+        else:
+            if not is_retryable_status(response.status_code):
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+            if breaker is not None:
+                breaker.record_failure()
+            delay = _retry_delay(policy, attempt, response, deadline)
+            if delay is None:
+                return response
+            print(f"⚠️ Response status {response.status_code}, retry {attempt + 1} in {delay:.2f}s")
+            response.close()
+        sleep(delay)
+        attempt += 1
+
+
+async def acall_with_retry(send: Callable, policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None,
+                           deadline=None):
+    """Async counterpart of call_with_retry; send is a coroutine function"""
+    attempt = 0
+    while True:
+        if deadline is not None:
+            deadline.check('LLM request')
+        probe = breaker.before_call() if breaker is not None else False
+        try:
+            response = await send()
+        except RETRYABLE_EXCEPTIONS as e:
+            if breaker is not None:
+                breaker.record_failure()
+            delay = _retry_delay(policy, attempt, None, deadline)
+            if delay is None:
+                raise
+            print(f"⚠️ Request failed ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s")
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled / interrupted: no verdict on the endpoint, but the probe slot must not leak
+            if probe:
+                breaker.release_probe()
+            raise
+        else:
+            if not is_retryable_status(response.status_code):
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+            if breaker is not None:
+                breaker.record_failure()
+            delay = _retry_delay(policy, attempt, response, deadline)
+            if delay is None:
+                return response
+            print(f"⚠️ Response status {response.status_code}, retry {attempt + 1} in {delay:.2f}s")
+            await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
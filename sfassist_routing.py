@@ -0,0 +1,222 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from deadline import DeadlineExceeded
+from sfassist_ratelimit import RateLimitTimeout
+from sfassist_retry import RETRYABLE_EXCEPTIONS, CircuitOpenError, is_retryable_status
+from sfassist_tokens import count_payload_tokens, count_tokens
+
+
+ROLE_PROGRAMMER = 'programmer'          # code generation and repairs
+ROLE_INSPECTOR = 'inspector'            # bug analysis of failed code
+ROLE_RESULT_SUMMARY = 'result_summary'  # RESULT_PROMPT explanation of execution output
+ROLE_REPORT = 'report'                  # document_generation
+
+DEFAULT_ROLE_TIERS = {
+    ROLE_PROGRAMMER: 'large',
+    ROLE_INSPECTOR: 'small',
+    ROLE_RESULT_SUMMARY: 'small',
+    ROLE_REPORT: 'small',
+}
+DEFAULT_ESCALATION_TIER = 'large'
+
+
+def _get(section, key: str, default=None):
+    if section is None:
+        return default
+    if isinstance(section, dict):
+        value = section.get(key, default)
+    else:
+        value = getattr(section, key, default)
+    return default if value is None else value
+
+
+def _as_dict(section) -> Dict:
+    if section is None:
+        return {}
+    if isinstance(section, dict):
+        return dict(section)
+    return {k: v for k, v in vars(section).items() if not k.startswith('_')}
+
+
+# ============================================================================
+#                         MODEL ROUTER
+# ============================================================================
+
+class ModelRouter:
+    """
+    Map agent roles to model tiers, escalating to the large tier on failure
+
+    Each call records per-role latency (to the last chunk for streams),
+    prompt/completion tokens and the model used, so the role -> tier mapping
+    can be tuned from real traffic.
+    """
+
+    def __init__(self, tiers: Dict[str, str], roles: Dict[str, str] = None,
+                 escalation_tier: str = DEFAULT_ESCALATION_TIER, default_model: str = None):
+        """
+        Args:
+            tiers: Tier name -> model (e.g. {"large": "claude-4-sonnet", "small": "llama3.1-70b"})
+            roles: Role -> tier name (DEFAULT_ROLE_TIERS when omitted)
+            escalation_tier: Tier used after a failure or when the caller escalates
+            default_model: Model for roles / tiers that are not configured
+        """
+        self.tiers = dict(tiers)
+        self.roles = dict(DEFAULT_ROLE_TIERS if roles is None else roles)
+        self.escalation_tier = escalation_tier
+        self.default_model = default_model
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict] = {}
+
+    @classmethod
+    def from_config(cls, section, default_model: str) -> Optional['ModelRouter']:
+        """Build from the sfassist.model_routing section, None when routing is disabled"""
+        if not _get(section, 'enabled', False):
+            return None
+        return cls(
+            tiers=_as_dict(_get(section, 'tiers')),
+            roles=_as_dict(_get(section, 'roles')) or None,
+            escalation_tier=_get(section, 'escalation_tier', DEFAULT_ESCALATION_TIER),
+            default_model=default_model
+        )
+
+    def model_for(self, role: str, escalate: bool = False) -> str:
+        """Model serving role (the escalation tier's model when escalate is set)"""
+        tier = self.escalation_tier if escalate else self.roles.get(role)
+        return self.tiers.get(tier) or self.default_model
+
+    @property
+    def escalation_model(self) -> str:
+        return self.tiers.get(self.escalation_tier) or self.default_model
+
+    def route(self, role: str, payload: Dict, complete: Callable, stream: bool = False,
+              escalate: bool = False):
+        """
+        Run complete(payload) on the role's model, retrying on the escalation model if it fails
+
+        Args:
+            role: ROLE_* name
+            payload: Request payload; its model is set in place
+            complete: Sends the payload and returns a completion / chunk iterator
+            stream: Whether complete returns a chunk iterator
+            escalate: Start on the escalation tier (e.g. after a failed repair round)
+        """
+        model = self._set_model(payload, self.model_for(role, escalate))
+        start = time.monotonic()
+        try:
+            result = complete(payload)
+        except Exception as e:
+            self._count(role, model, 'failures')
+            bigger = self.escalation_model
+            if not bigger or bigger == model or not self._escalates(e):
+                raise
+            print(f"⚠️ {role} call on {model} failed, escalating to {bigger}")
+            self._count(role, model, 'escalations')
+            model = self._set_model(payload, bigger)
+            start = time.monotonic()
+            try:
+                result = complete(payload)
+            except Exception:
+                self._count(role, model, 'failures')
+                raise
+        if stream:
+            return self._track_stream(role, model, payload, result, start)
+        self._record(role, model, payload, start, result.choices[0].message.content, result.usage)
+        return result
+
+    async def aroute(self, role: str, payload: Dict, complete: Callable, stream: bool = False,
+                     escalate: bool = False):
+        """Async counterpart of route; complete is a coroutine function"""
+        model = self._set_model(payload, self.model_for(role, escalate))
+        start = time.monotonic()
+        try:
+            result = await complete(payload)
+        except Exception as e:
+            self._count(role, model, 'failures')
+            bigger = self.escalation_model
+            if not bigger or bigger == model or not self._escalates(e):
+                raise
+            print(f"⚠️ {role} call on {model} failed, escalating to {bigger}")
+            self._count(role, model, 'escalations')
+            model = self._set_model(payload, bigger)
+            start = time.monotonic()
+            try:
+                result = await complete(payload)
+            except Exception:
+                self._count(role, model, 'failures')
+                raise
+        if stream:
+            return self._atrack_stream(role, model, payload, result, start)
+        self._record(role, model, payload, start, result.choices[0].message.content, result.usage)
+        return result
+
+    @staticmethod
+    def _escalates(error: Exception) -> bool:
+        """
+        Whether a failure is the model's (error answer, unusable output) and worth a bigger model
+
+        Open circuits, rate-limit and deadline timeouts, transport errors and retryable
+        statuses (retries already spent) concern the shared endpoint - a second model
+        would only hit them again.
+        """
+        if isinstance(error, (CircuitOpenError, RateLimitTimeout, DeadlineExceeded) + RETRYABLE_EXCEPTIONS):
+            return False
+        status_code = getattr(error, 'status_code', None)
+        return status_code is None or not is_retryable_status(status_code)
+
+    @staticmethod
+    def _set_model(payload: Dict, model: str) -> str:
+        if model:
+            payload["query"]["model"]["model"] = model
+        return payload["query"]["model"]["model"]
+
+    def _track_stream(self, role: str, model: str, payload: Dict, chunks, start: float):
+        parts = []
+        for chunk in chunks:
+            if chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(role, model, payload, start, ''.join(parts))
+
+    async def _atrack_stream(self, role: str, model: str, payload: Dict, chunks, start: float):
+        parts = []
+        async for chunk in chunks:
+            if chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(role, model, payload, start, ''.join(parts))
+
+    def _role_metrics(self, role: str) -> Dict:
+        return self._metrics.setdefault(role, {
+            "calls": 0, "failures": 0, "escalations": 0, "total_latency": 0.0, "max_latency": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "models": {}
+        })
+
+    def _count(self, role: str, model: str, key: str):
+        with self._lock:
+            self._role_metrics(role)[key] += 1
+
+    def _record(self, role: str, model: str, payload: Dict, start: float, content: str, usage=None):
+        latency = time.monotonic() - start
+        # Fall back to local counts when the endpoint does not report usage
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or count_payload_tokens(payload)
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or count_tokens(content)
+        with self._lock:
+            metrics = self._role_metrics(role)
+            metrics["calls"] += 1
+            metrics["total_latency"] += latency
+            metrics["max_latency"] = max(metrics["max_latency"], latency)
+            metrics["prompt_tokens"] += prompt_tokens
+            metrics["completion_tokens"] += completion_tokens
+            metrics["models"][model] = metrics["models"].get(model, 0) + 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-role calls, failures, escalations, latency and token totals"""
+        with self._lock:
+            stats = {}
+            for role, metrics in self._metrics.items():
+                stats[role] = dict(metrics, models=dict(metrics["models"]))
+                calls = metrics["calls"]
+                stats[role]["avg_latency"] = metrics["total_latency"] / calls if calls else 0.0
+            return stats
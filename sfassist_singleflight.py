@@ -0,0 +1,332 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator
+
+
+# ============================================================================
+#                         STREAM BROADCAST
+# ============================================================================
+
+class StreamBroadcast:
+    """
+    Fan one chunk iterator out to several subscribers
+
+    Chunks are recorded as they are pulled, so a subscriber that joins late
+    replays what it missed and then follows live. Whichever subscriber needs
+    the next chunk pulls it from the source, so the stream keeps going even if
+    the caller that started it stops reading. The source is closed when the
+    last subscriber goes away before the end.
+    """
+
+    def __init__(self, source: Iterator, on_finish: Callable[[], None]):
+        self._source = source
+        self._on_finish = on_finish
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._subscribers = 0
+        self._lock = threading.Lock()
+        self._pull_lock = threading.Lock()
+
+    def subscribe(self) -> Iterator:
+        with self._lock:
+            self._subscribers += 1
+        return self._iterate()
+
+    def _iterate(self) -> Iterator:
+        index = 0
+        try:
+            while True:
+                with self._lock:
+                    if index < len(self._chunks):
+                        chunk = self._chunks[index]
+                        index += 1
+                    elif self._done:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    else:
+                        chunk = None
+                if chunk is None:
+                    self._pull(index)
+                    continue
+                yield chunk
+        finally:
+            self._unsubscribe()
+
+    def _pull(self, index: int):
+        """Fetch the chunk after index from the source unless another subscriber already did"""
+        with self._pull_lock:
+            with self._lock:
+                if index < len(self._chunks) or self._done:
+                    return
+            try:
+                chunk = next(self._source)
+            except StopIteration:
+                self._finish()
+                return
+            except BaseException as e:
+                self._finish(e)
+                raise
+            with self._lock:
+                self._chunks.append(chunk)
+
+    def _finish(self, error: BaseException = None):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+            self._error = error
+        self._on_finish()
+
+    def _unsubscribe(self):
+        with self._lock:
+            self._subscribers -= 1
+            abandoned = self._subscribers == 0 and not self._done
+        if abandoned:
+            # Nobody is reading any more - drop the connection and the in-flight entry
+            self._finish(RuntimeError("Stream abandoned by every subscriber"))
+            close = getattr(self._source, 'close', None)
+            if close is not None:
+                with self._pull_lock:
+                    close()
+
+
+class AsyncStreamBroadcast:
+    """asyncio counterpart of StreamBroadcast for an async chunk iterator (one event loop)"""
+
+    def __init__(self, source: AsyncIterator, on_finish: Callable[[], None]):
+        self._source = source
+        self._on_finish = on_finish
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._subscribers = 0
+        self._pulling: asyncio.Task = None  # read of the next chunk, shared by every subscriber
+
+    def subscribe(self) -> AsyncIterator:
+        self._subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator:
+        index = 0
+        try:
+            while True:
+                if index < len(self._chunks):
+                    chunk = self._chunks[index]
+                    index += 1
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    await self._pull(index)
+                    continue
+                yield chunk
+        finally:
+            await self._unsubscribe()
+
+    async def _pull(self, index: int):
+        """Fetch the chunk after index from the source unless another subscriber already did"""
+        if index < len(self._chunks) or self._done:
+            return
+        if self._pulling is None:
+            self._pulling = asyncio.ensure_future(self._read_next())
+        # shield: a cancelled subscriber must not cancel the read the others wait on
+        await asyncio.shield(self._pulling)
+
+    async def _read_next(self):
+        try:
+            chunk = await self._source.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+        except BaseException as e:
+            self._finish(e)  # subscribers raise it from _iterate
+        else:
+            self._chunks.append(chunk)
+        finally:
+            self._pulling = None
+
+    def _finish(self, error: BaseException = None):
+        if self._done:
+            return
+        self._done = True
+        self._error = error
+        self._on_finish()
+
+    async def _unsubscribe(self):
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self._done:
+            # Nobody is reading any more - drop the connection and the in-flight entry
+            self._finish(RuntimeError("Stream abandoned by every subscriber"))
+            pulling = self._pulling
+            if pulling is not None:
+                pulling.cancel()
+                await asyncio.wait([pulling])
+            aclose = getattr(self._source, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+
+# ============================================================================
+#                         SINGLE FLIGHT
+# ============================================================================
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait for and share its result (or exception). Streamed results are
+    shared through a StreamBroadcast, so every caller gets its own iterator
+    over the same response.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, object] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    def _join(self, key: Hashable):
+        """Return (entry, is_leader) for key, registering a new call when none is in flight"""
+        with self._lock:
+            self._stats["calls"] += 1
+            entry = self._calls.get(key)
+            if entry is not None:
+                self._stats["coalesced"] += 1
+                return entry, False
+            entry = _Call()
+            self._calls[key] = entry
+            return entry, True
+
+    def do(self, key: Hashable, fn: Callable):
+        """Run fn() once per key among concurrent callers and return its result"""
+        call, leader = self._join(key)
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._forget(key, call)
+            call.event.set()
+
+    def do_stream(self, key: Hashable, fn: Callable[[], Iterator]) -> Iterator:
+        """
+        Stream counterpart of do()
+
+        fn() opens the stream (errors raised while opening are shared like in
+        do()); the returned iterator is broadcast to every caller until it ends.
+        """
+        entry, leader = self._join(key)
+        if not leader:
+            if isinstance(entry, StreamBroadcast):
+                return entry.subscribe()
+            entry.event.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result.subscribe()
+
+        try:
+            broadcast = StreamBroadcast(iter(fn()), lambda: self._forget(key, broadcast))
+        except BaseException as e:
+            entry.error = e
+            self._forget(key, entry)
+            entry.event.set()
+            raise
+        entry.result = broadcast
+        stream = broadcast.subscribe()
+        with self._lock:
+            # Later callers subscribe straight to the broadcast
+            if self._calls.get(key) is entry:
+                self._calls[key] = broadcast
+        entry.event.set()
+        return stream
+
+    def _forget(self, key: Hashable, entry):
+        with self._lock:
+            if self._calls.get(key) is entry:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Total and coalesced call counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutine calls"""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, object] = {}  # asyncio.Task, or AsyncStreamBroadcast once a stream is open
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable):
+        """Await fn() once per key among concurrent callers and return its result"""
+        self._stats["calls"] += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        else:
+            self._stats["coalesced"] += 1
+        # shield: a cancelled caller must not cancel the request the others wait on
+        return await asyncio.shield(task)
+
+    async def do_stream(self, key: Hashable, fn: Callable[[], Awaitable[AsyncIterator]]) -> AsyncIterator:
+        """
+        Stream counterpart of do()
+
+        fn() opens the stream (errors raised while opening are shared like in
+        do()); the async iterator it returns is broadcast to every caller until it ends.
+        """
+        self._stats["calls"] += 1
+        entry = self._tasks.get(key)
+        if entry is None:
+            entry = asyncio.ensure_future(self._open_stream(key, fn))
+            self._tasks[key] = entry
+        else:
+            self._stats["coalesced"] += 1
+        if isinstance(entry, AsyncStreamBroadcast):
+            return entry.subscribe()
+        broadcast = await asyncio.shield(entry)
+        return broadcast.subscribe()
+
+    async def _open_stream(self, key: Hashable, fn: Callable[[], Awaitable[AsyncIterator]]) -> AsyncStreamBroadcast:
+        task = asyncio.current_task()
+        try:
+            source = await fn()
+        except BaseException:
+            self._forget(key, task)
+            raise
+        broadcast = AsyncStreamBroadcast(source, lambda: self._forget(key, broadcast))
+        if self._tasks.get(key) is task:
+            # Later callers subscribe straight to the broadcast
+            self._tasks[key] = broadcast
+        return broadcast
+
+    def _forget(self, key: Hashable, entry):
+        if self._tasks.get(key) is entry:
+            del self._tasks[key]
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._tasks)
+        return stats
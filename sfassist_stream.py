@@ -0,0 +1,231 @@
+import json
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+
+STREAMING_CONTENT_TYPES = ('text/event-stream', 'application/x-ndjson', 'application/jsonl',
+                           'application/json-seq')
+
+DEFAULT_FLUSH_INTERVAL = 0.05  # seconds between UI-facing chunks
+
+
+class StreamError(Exception):
+    """Error event received in the middle of a streamed completion"""
+
+
+def is_streaming_response(response) -> bool:
+    """True when the endpoint answered with an incremental (SSE / NDJSON) body"""
+    content_type = response.headers.get('Content-Type', '').lower()
+    return any(t in content_type for t in STREAMING_CONTENT_TYPES)
+
+
+def is_sse_response(response) -> bool:
+    """True for a text/event-stream body (as opposed to NDJSON)"""
+    return 'text/event-stream' in response.headers.get('Content-Type', '').lower()
+
+
+def extract_delta(data) -> Optional[str]:
+    """
+    Extract the text delta from one streamed event
+
+    Handles the OpenAI-style chunk used by Cortex ({"choices": [{"delta": {"content"}}]}),
+    Anthropic-style content_block_delta ({"delta": {"text"}}) and the flat
+    text/response/content keys the non-streaming path already accepts.
+    """
+    if isinstance(data, str):
+        return data
+    if not isinstance(data, dict):
+        return None
+    if 'choices' in data and data['choices']:
+        choice = data['choices'][0]
+        delta = choice.get('delta') or choice.get('message') or {}
+        return delta.get('content') or delta.get('text') or choice.get('text')
+    if 'delta' in data and isinstance(data['delta'], dict):
+        return data['delta'].get('text') or data['delta'].get('content')
+    if 'message' in data and isinstance(data['message'], dict):
+        return data['message'].get('content')
+    for key in ('text', 'response', 'content'):
+        if isinstance(data.get(key), str):
+            return data[key]
+    return None
+
+
+def decode_event(event: str, raw: str) -> Tuple[bool, Optional[str]]:
+    """
+    Decode one SSE event / NDJSON line
+
+    Returns:
+        (done, delta) - done is True on the [DONE] sentinel
+
+    Raises:
+        StreamError: the endpoint reported an error mid-stream
+    """
+    if raw.strip() == '[DONE]':
+        return True, None
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, ValueError):
+        data = raw
+    if event == 'error' or (isinstance(data, dict) and data.get('error')):
+        raise StreamError(f"API Error Response (stream): {raw}")
+    return False, extract_delta(data) or None
+
+
+class LineSplitter:
+    """Split raw body blocks into decoded lines without waiting for a full read buffer"""
+
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, block: bytes) -> List[str]:
+        self._pending += block
+        *lines, self._pending = self._pending.split(b'\n')
+        return [line.rstrip(b'\r').decode('utf-8', errors='replace') for line in lines]
+
+    def flush(self) -> List[str]:
+        pending, self._pending = self._pending, b''
+        return [pending.rstrip(b'\r').decode('utf-8', errors='replace')] if pending else []
+
+
+class SSEParser:
+    """Incremental text/event-stream parser; multi-line data fields are joined per the SSE spec"""
+
+    def __init__(self):
+        self._event = 'message'
+        self._data = []
+
+    def feed_line(self, line: str) -> Optional[Dict]:
+        """Consume one line, returning a complete {"event", "data"} dict when one ends"""
+        if not line:
+            return self.flush()
+        if line.startswith(':'):
+            return None  # keep-alive comment
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'event':
+            self._event = value
+        elif field == 'data':
+            self._data.append(value)
+        return None
+
+    def flush(self) -> Optional[Dict]:
+        event = {"event": self._event, "data": '\n'.join(self._data)} if self._data else None
+        self._event, self._data = 'message', []
+        return event
+
+
+class DeltaCoalescer:
+    """
+    Merge deltas so the caller sees at most one chunk per flush_interval seconds
+
+    The first delta always passes through immediately (time to first token).
+    """
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = None
+
+    def push(self, delta: str) -> Optional[str]:
+        self._buffer.append(delta)
+        now = time.monotonic()
+        if self._last_flush is None or now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._buffer:
+            return None
+        text, self._buffer = ''.join(self._buffer), []
+        return text
+
+
+def _line_payload(parser: Optional[SSEParser], line: str) -> Optional[Tuple[str, str]]:
+    """Turn one body line into an (event, raw data) pair; parser is None for NDJSON"""
+    if parser is None:
+        return ('message', line) if line.strip() else None
+    event = parser.feed_line(line)
+    return (event['event'], event['data']) if event else None
+
+
+def _iter_payloads(response: requests.Response) -> Iterator[Tuple[str, str]]:
+    """Yield (event, raw data) pairs of an SSE or NDJSON body as lines arrive"""
+    splitter = LineSplitter()
+    parser = SSEParser() if is_sse_response(response) else None
+    # chunk_size=None reads whatever has arrived instead of waiting for a full buffer
+    for block in response.iter_content(chunk_size=None):
+        for line in splitter.feed(block):
+            if (payload := _line_payload(parser, line)):
+                yield payload
+    for line in splitter.flush():
+        if (payload := _line_payload(parser, line)):
+            yield payload
+    if parser is not None and (event := parser.flush()):
+        yield event['event'], event['data']
+
+
+async def _aiter_payloads(response):
+    """Async counterpart of _iter_payloads for an httpx streaming response"""
+    splitter = LineSplitter()
+    parser = SSEParser() if is_sse_response(response) else None
+    async for block in response.aiter_bytes():
+        for line in splitter.feed(block):
+            if (payload := _line_payload(parser, line)):
+                yield payload
+    for line in splitter.flush():
+        if (payload := _line_payload(parser, line)):
+            yield payload
+    if parser is not None and (event := parser.flush()):
+        yield event['event'], event['data']
+
+
+def iter_stream_deltas(response: requests.Response,
+                       flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> Iterator[str]:
+    """
+    Yield text deltas of a streamed completion as they arrive
+
+    Deltas are coalesced (see DeltaCoalescer) so Gradio is not re-rendered for
+    every token. The response is closed when the iterator finishes so the
+    connection goes back to the pool.
+
+    Args:
+        response: requests.Response opened with stream=True
+        flush_interval: Minimum seconds between yielded chunks (0 disables coalescing)
+    """
+    coalescer = DeltaCoalescer(flush_interval)
+    try:
+        for event, raw in _iter_payloads(response):
+            done, delta = decode_event(event, raw)
+            if done:
+                break
+            if delta and (text := coalescer.push(delta)):
+                yield text
+        if text := coalescer.flush():
+            yield text
+    finally:
+        response.close()
+
+
+async def aiter_stream_deltas(response, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+    """
+    Async counterpart of iter_stream_deltas
+
+    Args:
+        response: httpx.Response from AsyncClient.send(..., stream=True)
+        flush_interval: Minimum seconds between yielded chunks (0 disables coalescing)
+    """
+    coalescer = DeltaCoalescer(flush_interval)
+    try:
+        async for event, raw in _aiter_payloads(response):
+            done, delta = decode_event(event, raw)
+            if done:
+                break
+            if delta and (text := coalescer.push(delta)):
+                yield text
+        if text := coalescer.flush():
+            yield text
+    finally:
+        await response.aclose()
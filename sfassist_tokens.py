@@ -0,0 +1,164 @@
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+ENCODING_NAME = "cl100k_base"  # same encoding Conversation.count_tokens uses
+TOKENS_PER_MESSAGE = 4         # role / separator overhead per chat message
+CHARS_PER_TOKEN = 4            # fallback estimate when no encoding can be loaded
+USAGE_GROUPS = ('session', 'role', 'model')
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """tiktoken encoding, loaded once; None if tiktoken or its BPE file is unavailable"""
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            if TIKTOKEN_AVAILABLE:
+                try:
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    print(f"⚠️ tiktoken encoding unavailable, estimating tokens from length: {e}")
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text (length-based estimate without tiktoken)"""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return max(len(text) // CHARS_PER_TOKEN, 1)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Prompt tokens of a chat message list, including per-message overhead"""
+    total = 0
+    for message in messages:
+        content = message.get('content') or ''
+        total += TOKENS_PER_MESSAGE + count_tokens(content if isinstance(content, str) else str(content))
+    return total + 2 if messages else 0
+
+
+def count_payload_tokens(payload: Dict) -> int:
+    """Prompt tokens of an SF Assist payload built by _build_payload"""
+    return count_message_tokens(payload.get('query', {}).get('prompt', {}).get('messages', []))
+
+
+def fill_usage(usage, payload: Dict, completion: str) -> bool:
+    """
+    Fill token counts the endpoint left out (zero) in a UsageStats, in place
+
+    Returns:
+        True when any count was computed locally
+    """
+    estimated = False
+    if not usage.prompt_tokens:
+        usage.prompt_tokens = count_payload_tokens(payload)
+        estimated = True
+    if not usage.completion_tokens:
+        usage.completion_tokens = count_tokens(completion)
+        estimated = True
+    if estimated or not usage.total_tokens:
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+    return estimated
+
+
+# ============================================================================
+#                         USAGE METER
+# ============================================================================
+
+SUMMED_FIELDS = ("requests", "estimated_requests", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def _empty_usage() -> Dict[str, int]:
+    return dict.fromkeys(SUMMED_FIELDS + ("max_prompt_tokens",), 0)
+
+
+class UsageMeter:
+    """
+    Token usage of completed requests, kept per (session, role, model)
+
+    Counts reported by the endpoint are used as is; the rest (every streamed
+    response, and responses without usage) come from the local tokenizer and
+    are flagged in "estimated_requests". max_prompt_tokens shows context
+    growth of a session / role. Cache hits never reach the meter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[tuple, Dict[str, int]] = {}
+
+    def record(self, session: Optional[str], role: Optional[str], model: Optional[str],
+               prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        key = (session or 'default', role or 'default', model or 'unknown')
+        with self._lock:
+            entry = self._usage.get(key)
+            if entry is None:
+                entry = self._usage[key] = _empty_usage()
+            entry["requests"] += 1
+            entry["estimated_requests"] += 1 if estimated else 0
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["total_tokens"] += prompt_tokens + completion_tokens
+            entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], prompt_tokens)
+
+    def records(self, session: str = None) -> List[Dict]:
+        """One row per (session, role, model), optionally for one session only"""
+        with self._lock:
+            items = [(key, dict(entry)) for key, entry in self._usage.items()]
+        rows = []
+        for key, entry in items:
+            if session is not None and key[0] != session:
+                continue
+            entry.update(zip(USAGE_GROUPS, key))
+            rows.append(entry)
+        return rows
+
+    def totals(self, by: str = 'role', session: str = None) -> Dict[str, Dict[str, int]]:
+        """
+        Usage summed by 'session', 'role' or 'model'
+
+        Args:
+            by: Grouping key
+            session: Only count requests of this session
+        """
+        if by not in USAGE_GROUPS:
+            raise ValueError(f"by must be one of {USAGE_GROUPS}, got {by!r}")
+        totals: Dict[str, Dict[str, int]] = {}
+        for row in self.records(session):
+            group = totals.setdefault(row[by], _empty_usage())
+            for field in SUMMED_FIELDS:
+                group[field] += row[field]
+            group["max_prompt_tokens"] = max(group["max_prompt_tokens"], row["max_prompt_tokens"])
+        return totals
+
+    def reset(self, session: str = None):
+        """Forget all usage, or that of one session"""
+        with self._lock:
+            if session is None:
+                self._usage.clear()
+            else:
+                for key in [key for key in self._usage if key[0] == session]:
+                    del self._usage[key]
+
+
+_usage_meter = UsageMeter()
+
+
+def get_usage_meter() -> UsageMeter:
+    """Process-wide usage meter shared by every client"""
+    return _usage_meter
@@ -0,0 +1,120 @@
+from typing import Dict, List
+
+
+# ============================================================================
+#                         RESPONSE CLASSES
+# ============================================================================
+# Fixed, slotted classes with the OpenAI-style attribute surface callers use:
+#   response.choices[0].message.content / response.usage.total_tokens
+#   chunk.choices[0].delta.content
+# Streaming builds one StreamingChunk per delta, so these stay free of
+# per-instance __dict__ and per-instance classes.
+
+class UsageStats:
+    """Token usage statistics"""
+    __slots__ = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = total_tokens
+
+    def __repr__(self):
+        return (f"UsageStats(prompt_tokens={self.prompt_tokens}, "
+                f"completion_tokens={self.completion_tokens}, total_tokens={self.total_tokens})")
+
+
+class Message:
+    """Chat message of a completion"""
+    __slots__ = ('role', 'content')
+
+    def __init__(self, role: str = "assistant", content: str = ""):
+        self.role = role
+        self.content = content
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+
+class Delta:
+    """Incremental content of a streaming chunk"""
+    __slots__ = ('content',)
+
+    def __init__(self, content: str = ""):
+        self.content = content
+
+    def __repr__(self):
+        return f"Delta(content={self.content!r})"
+
+
+class Choice:
+    """Response choice"""
+    __slots__ = ('message', 'finish_reason', 'delta')
+
+    def __init__(self, message: Dict[str, str], finish_reason: str = "stop"):
+        self.message = Message(message.get('role', 'assistant'), message.get('content', ''))
+        self.finish_reason = finish_reason
+        self.delta = Delta(self.message.content)
+
+
+class StreamingChoice:
+    """Choice of a streaming chunk (delta only)"""
+    __slots__ = ('delta', 'finish_reason')
+
+    def __init__(self, delta: Delta, finish_reason: str = None):
+        self.delta = delta
+        self.finish_reason = finish_reason
+
+
+class CompletionResponse:
+    """Response from completion API"""
+    __slots__ = ('choices', 'usage')
+
+    def __init__(self, content: str, usage: UsageStats):
+        self.choices: List[Choice] = [Choice({"role": "assistant", "content": content})]
+        self.usage = usage
+
+
+class StreamingChunk:
+    """Streaming chunk response"""
+    __slots__ = ('choices',)
+
+    def __init__(self, content: str):
+        self.choices: List[StreamingChoice] = [StreamingChoice(Delta(content))]
+
+
+# ============================================================================
+#                         MICROBENCHMARK
+# ============================================================================
+
+class _DynamicStreamingChunk:
+    """Previous chunk model (a new Delta and Choice class per chunk), kept for comparison"""
+    def __init__(self, content: str):
+        delta = type('Delta', (), {'content': content})()
+        choice = type('Choice', (), {'delta': delta})()
+        self.choices = [choice]
+
+
+def _benchmark(chunks: int = 500, rounds: int = 20):
+    """Time and peak memory of building one streamed turn of chunks with each model"""
+    import gc
+    import timeit
+    import tracemalloc
+
+    def build(cls):
+        return [cls('token ') for _ in range(chunks)]
+
+    for name, cls in (("type() per chunk", _DynamicStreamingChunk), ("__slots__", StreamingChunk)):
+        seconds = min(timeit.repeat(lambda: build(cls), number=1, repeat=rounds))
+        gc.collect()
+        tracemalloc.start()
+        kept = build(cls)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print(f"{name:<18} {chunks} chunks: {seconds * 1000:7.2f} ms, "
+              f"peak {peak / 1024:8.1f} KiB ({peak / chunks:6.0f} B/chunk)")
+
+
+if __name__ == '__main__':
+    _benchmark()
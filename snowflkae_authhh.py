@@ -4,10 +4,86 @@ import traceback
 import boto3
 import re
 import json
+import copy
+import os
+import time
+import hashlib
+import threading
 
-__token= None
 s3 = boto3.client('s3')
 
+# Secrets Manager responses are cached in-process for SECRETS_CACHE_TTL seconds;
+# forced refreshes of the same secret are throttled to one per SECRETS_MIN_REFRESH
+SECRETS_CACHE_TTL = int(os.getenv('DSA_SECRETS_TTL', '300'))
+SECRETS_MIN_REFRESH = int(os.getenv('DSA_SECRETS_MIN_REFRESH', '30'))
+__secrets_clients = {}
+__secrets_cache = {}
+__secrets_lock = threading.Lock()
+__cert_digests = {}
+
+# OAuth tokens are refreshed in the background TOKEN_REFRESH_MARGIN seconds before expiry
+TOKEN_REFRESH_MARGIN = int(os.getenv('DSA_TOKEN_REFRESH_MARGIN', '60'))
+TOKEN_DEFAULT_TTL = int(os.getenv('DSA_TOKEN_DEFAULT_TTL', '300'))
+__token_cache = {}
+__token_locks = {}
+__token_refreshing = set()
+__token_cache_lock = threading.Lock()
+
+def get_secrets_client(region_name):
+    """
+    Return the process-wide secretsmanager client for a region
+    :param region_name: region on aws (ex us-east-1)
+    :return: boto3 secretsmanager client
+    """
+    with __secrets_lock:
+        client = __secrets_clients.get(region_name)
+        if client is None:
+            session = boto3.session.Session()
+            client = session.client(
+                service_name='secretsmanager',
+                region_name=region_name
+            )
+            __secrets_clients[region_name] = client
+        return client
+
+def get_cached_secret_value(log, region_name, secret_name, force_refresh= False, ttl= None):
+    """
+    get_secret_value with an in-process TTL cache
+    :param log: basic logger
+    :param region_name: region on aws (ex us-east-1)
+    :param secret_name: secret id such as dev/api/aedl
+    :param force_refresh: skip the cache (ex after an auth failure)
+    :param ttl: cache lifetime in seconds, defaults to SECRETS_CACHE_TTL
+    :return: get_secret_value response
+    """
+    ttl = SECRETS_CACHE_TTL if ttl is None else ttl
+    key = (region_name, secret_name)
+    cached = __secrets_cache.get(key)
+    now = time.monotonic()
+    if cached:
+        expires_at, fetched_at, response = cached
+        fresh = expires_at > now
+        if (fresh and not force_refresh) or (force_refresh and now - fetched_at < SECRETS_MIN_REFRESH):
+            log.debug(f'{secret_name} served from secrets cache')
+            return response
+    log.debug(secret_name)
+    response = get_secrets_client(region_name).get_secret_value(
+        SecretId=secret_name
+    )
+    if ttl > 0:
+        __secrets_cache[key] = (time.monotonic() + ttl, time.monotonic(), response)
+    return response
+
+def invalidate_secrets(secret_name= None):
+    """
+    Drop cached secrets so the next lookup goes to Secrets Manager
+    :param secret_name: secret id to drop, all secrets when None
+    """
+    with __secrets_lock:
+        for key in list(__secrets_cache):
+            if secret_name is None or key[1] == secret_name:
+                __secrets_cache.pop(key, None)
+
 def get_es_request(log, env, region_name, aplctn_cd, auth_type= None, key_index= None, headers ={}, params= {}, body= {}):
     """
     Perform API GET calls for Elastic Search
@@ -133,7 +209,7 @@ def post_es_request(log, env, region_name, aplctn_cd, auth_type= None, key_index
         log.critical(traceback.format_exc())
         raise error
 
-def get_es_secrets(log, env, region_name, aplctn_cd, auth_type):
+def get_es_secrets(log, env, region_name, aplctn_cd, auth_type, force_refresh= False):
     """
     Get the ES secrets from secret manager
     :param log: basic logger
@@ -141,19 +217,12 @@ def get_es_secrets(log, env, region_name, aplctn_cd, auth_type):
     :param region_name: region on aws (ex us-east-1)
     :param aplctn_cd: aplctn_cd such as edl, cii etc.
     :param auth_type: authentication type such as basic etc.
+    :param force_refresh: bypass the secrets cache
     :return: username, password and url
     """
     secret_name = f"{env}/es/{aplctn_cd}"
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
     try:
-        log.debug(secret_name)
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
+        get_secret_value_response = get_cached_secret_value(log, region_name, secret_name, force_refresh)
     except ClientError as error:
         secret_error_handling(log, error)
     else:
@@ -177,43 +246,118 @@ def get_es_secrets(log, env, region_name, aplctn_cd, auth_type):
         log.critical(error)
         raise error
 
-def get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args= {}):
-    global __token
+def _fetch_token(log, env, region_name, aplctn_cd, auth_type, app_id, prov_dict, optional_args= {}, force_refresh= False):
+    """
+    Request a new OAuth token from the provider
+    :return: token and its lifetime in seconds (None when the provider does not say)
+    """
+    prov_type= prov_dict['type']
+    prov_url= prov_dict['url']
+    prov_headers= copy.deepcopy(prov_dict.get('headers', {}))
+    prov_body= copy.deepcopy(prov_dict.get('body', {}))
+    prov_params= copy.deepcopy(prov_dict.get('params', {}))
+    prov_req_type= prov_dict.get('request_type', 'post')
+    prov_token= prov_dict.get('token')
+    prov_params, prov_headers, prov_body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= prov_headers, body= prov_body, params= prov_params, force_refresh= force_refresh)
+
+    if prov_headers.get('Content-Type','') == 'application/json':
+        prov_body = json.dumps(prov_body)
+
+    if prov_req_type == 'post':
+        if cert_path:
+            resp = requests.post(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= cert_path, **optional_args)
+        else:
+            resp = requests.post(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= False, **optional_args)
+    else:
+        if cert_path:
+            resp = requests.get(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= cert_path, **optional_args)
+        else:
+            resp = requests.get(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= False, **optional_args)
+    if resp.status_code == 200:
+        log.info('API Call authorization is successful')
+        resp= resp.json()
+        expires_in= resp.get('expires_in') if isinstance(resp, dict) else None
+        token= None
+        for i in prov_token:
+            token= resp.get(i)
+            resp=resp.get(i)
+        return token, expires_in
+    else:
+        log.error('API Call authorization has failed')
+        raise InvalidStatus(f'Token request failed with status code = {resp.status_code}')
+
+def _token_lock(key):
+    with __token_cache_lock:
+        return __token_locks.setdefault(key, threading.Lock())
+
+def _store_token(key, token, expires_in):
+    ttl= float(expires_in) if expires_in else TOKEN_DEFAULT_TTL
+    now= time.monotonic()
+    __token_cache[key]= {
+        'token': token,
+        'fetched_at': now,
+        'expires_at': now + ttl,
+        'refresh_at': now + max(ttl - TOKEN_REFRESH_MARGIN, ttl / 2),
+    }
+
+def _refresh_token_in_background(log, key, fetch_args):
+    """Refresh a token that is about to expire without blocking the caller"""
+    with __token_cache_lock:
+        if key in __token_refreshing:
+            return
+        __token_refreshing.add(key)
+
+    def refresh():
+        try:
+            with _token_lock(key):
+                entry= __token_cache.get(key)
+                if entry and time.monotonic() < entry['refresh_at']:
+                    return  # refreshed by a foreground caller meanwhile
+                token, expires_in= _fetch_token(*fetch_args)
+                _store_token(key, token, expires_in)
+                log.info('OAuth token refreshed ahead of expiry')
+        except Exception as error:
+            log.error(f'Background token refresh failed, current token is kept until expiry: {error}')
+        finally:
+            with __token_cache_lock:
+                __token_refreshing.discard(key)
+
+    threading.Thread(target=refresh, name='token-refresh', daemon=True).start()
+
+def get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args= {}, force_refresh= False):
+    """
+    Get an OAuth token, cached per (env, aplctn_cd, app_id, provider) until it expires
+    :param log: basic logger
+    :param env: environment string (ex dev, sit, prod)
+    :param region_name: region on aws (ex us-east-1)
+    :param aplctn_cd: Application code such as cii, aedl etc
+    :param auth_type: Authentication Type such as oauth2
+    :param app_id: APP Id such as edw, cii etc
+    :param request: api request with the provider section
+    :param force_refresh: ignore the cached token (ex after a 401)
+    :return: token
+    """
     try:
         prov_dict= request.get('provider')
         if prov_dict:
-            prov_type= prov_dict['type']
-            prov_url= prov_dict['url']
-            prov_headers= prov_dict.get('headers', {})
-            prov_body= prov_dict.get('body', {})
-            prov_params= prov_dict.get('params', {})
-            prov_req_type= prov_dict.get('request_type', 'post')
-            prov_token= prov_dict.get('token')
-            prov_params, prov_headers, prov_body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= prov_headers, body= prov_body, params= prov_params)
-
-            if prov_headers.get('Content-Type','') == 'application/json':
-                prov_body = json.dumps(prov_body)
-
-            if prov_req_type == 'post':
-                if cert_path:
-                    resp = requests.post(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= cert_path, **optional_args)
-                else:
-                    resp = requests.post(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= False, **optional_args)
-            else:
-                if cert_path:
-                    resp = requests.get(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= cert_path, **optional_args)
-                else:
-                    resp = requests.get(url= prov_url, params=prov_params, headers=prov_headers, data=prov_body, verify= False, **optional_args)
-            if resp.status_code == 200:
-                log.info('API Call authorization is successful')
-                resp= resp.json()
-                for i in prov_token:
-                    __token= resp.get(i)
-                    resp=resp.get(i)
-            else:
-                log.error('API Call authorization has failed')
-                raise
-            return __token
+            key= (env, aplctn_cd, app_id, prov_dict['type'])
+            fetch_args= (log, env, region_name, aplctn_cd, auth_type, app_id, prov_dict, optional_args)
+            requested_at= time.monotonic()
+            entry= __token_cache.get(key)
+            if entry and not force_refresh and requested_at < entry['expires_at']:
+                if requested_at >= entry['refresh_at']:
+                    _refresh_token_in_background(log, key, fetch_args)
+                return entry['token']
+
+            # Callers waiting on the same refresh share its result
+            with _token_lock(key):
+                entry= __token_cache.get(key)
+                usable= entry and time.monotonic() < entry['expires_at']
+                if usable and (not force_refresh or entry['fetched_at'] >= requested_at):
+                    return entry['token']
+                token, expires_in= _fetch_token(*fetch_args, force_refresh= force_refresh)
+                _store_token(key, token, expires_in)
+            return token
     except Exception as err:
         raise err
 
@@ -229,7 +373,6 @@ def get_api_request(log, env, region_name, aplctn_cd, request, response= {}, req
     :param response: api response
     :return: JSON response
     """
-    global __token
     try:
 
         auth_type= request.get('authentication')
@@ -242,23 +385,35 @@ def get_api_request(log, env, region_name, aplctn_cd, request, response= {}, req
         aplctn_cd= request.get('api_aplctn_cd',aplctn_cd)
         prov_type= 'na'
 
+        # Per call, not a module global: concurrent calls for other providers must not swap tokens
+        token= None
         if auth_type == 'oauth2' and request_token:
-            __token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args)
+            token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args)
         elif request_token == False:
-            __token = token_id
+            token = token_id
 
-        if __token:
-            headers= json.loads(json.dumps(headers).replace('${token}',__token))
+        templates= copy.deepcopy((params, headers, body))
 
-        cert_path= None
-        if auth_type in ('api_key','oauth2','oauth1', 'basicauth'):
-            params, headers, body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= headers, body= body, params= params)
+        def send(token, force_refresh= False):
+            params, headers, body= copy.deepcopy(templates)
+            if token:
+                headers= json.loads(json.dumps(headers).replace('${token}',token))
+            cert_path= None
+            if auth_type in ('api_key','oauth2','oauth1', 'basicauth'):
+                params, headers, body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= headers, body= body, params= params, force_refresh= force_refresh)
 
-        verify= cert_path if cert_path else False
-        if files:
-            resp = requests.get(url, params=params, headers=headers, files=files, verify= verify, **optional_args)
-        else:
-            resp = requests.get(url, params=params, headers=headers, data=body, files=files, verify= verify, **optional_args)
+            verify= cert_path if cert_path else False
+            if files:
+                return requests.get(url, params=params, headers=headers, files=files, verify= verify, **optional_args)
+            return requests.get(url, params=params, headers=headers, data=body, files=files, verify= verify, **optional_args)
+
+        resp = send(token)
+        # Token expired early or secret rotated since it was cached (file uploads cannot be replayed)
+        if resp.status_code in (401, 403) and auth_type in ('api_key','oauth2','oauth1', 'basicauth') and not files:
+            log.info('API call unauthorized, retrying with refreshed secrets')
+            if auth_type == 'oauth2' and request_token:
+                token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args, force_refresh= True)
+            resp = send(token, force_refresh= True)
 
         if resp.status_code == 200:
             log.info(f'API GET Request Call is successful with status code = {resp.status_code}')
@@ -300,7 +455,6 @@ def post_api_request(log, env, region_name, aplctn_cd, request, response= {}, re
     :param body: Body for API call
     :return: JSON response
     """
-    global __token
     try:
         auth_type= request.get('authentication')
         params= request.get('params')
@@ -311,26 +465,38 @@ def post_api_request(log, env, region_name, aplctn_cd, request, response= {}, re
         app_id= request.get('api_app_id')
         aplctn_cd= request.get('api_aplctn_cd',aplctn_cd)
         prov_type= 'na'
+        # Per call, not a module global: concurrent calls for other providers must not swap tokens
+        token= None
         if auth_type == 'oauth2' and request_token:
-            __token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args)
+            token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args)
         elif request_token == False:
-            __token = token_id
+            token = token_id
 
-        if __token:
-            headers= json.loads(json.dumps(headers).replace('${token}',__token))
+        templates= copy.deepcopy((params, headers, body))
 
-        cert_path= None
-        if auth_type in ('api_key','oauth2','oauth1', 'basicauth'):
-            params, headers, body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= headers, body= body, params= params)
+        def send(token, force_refresh= False):
+            params, headers, body= copy.deepcopy(templates)
+            if token:
+                headers= json.loads(json.dumps(headers).replace('${token}',token))
+            cert_path= None
+            if auth_type in ('api_key','oauth2','oauth1', 'basicauth'):
+                params, headers, body, cert_path= get_api_secrets(log= log, env= env, region_name= region_name, aplctn_cd= aplctn_cd, auth_type= auth_type, provider= prov_type, app_id= app_id, headers= headers, body= body, params= params, force_refresh= force_refresh)
 
-        if headers.get('Content-Type') !='application/x-www-form-urlencoded':
-            body=json.dumps(body)
+            if headers.get('Content-Type') !='application/x-www-form-urlencoded':
+                body=json.dumps(body)
 
-        verify= cert_path if cert_path else False
-        if files:
-            resp = requests.post(url, params=params, headers=headers, files=files, verify= verify, **optional_args)
-        else:
-            resp = requests.post(url, params=params, headers=headers, data=body, files=files, verify= verify, **optional_args)
+            verify= cert_path if cert_path else False
+            if files:
+                return requests.post(url, params=params, headers=headers, files=files, verify= verify, **optional_args)
+            return requests.post(url, params=params, headers=headers, data=body, files=files, verify= verify, **optional_args)
+
+        resp = send(token)
+        # Token expired early or secret rotated since it was cached (file uploads cannot be replayed)
+        if resp.status_code in (401, 403) and auth_type in ('api_key','oauth2','oauth1', 'basicauth') and not files:
+            log.info('API call unauthorized, retrying with refreshed secrets')
+            if auth_type == 'oauth2' and request_token:
+                token = get_token(log, env, region_name, aplctn_cd, auth_type, app_id, request, optional_args, force_refresh= True)
+            resp = send(token, force_refresh= True)
 
         if resp.status_code == 200:
             log.info(f'API POST Request Call is successful with status code = {resp.status_code}')
@@ -358,7 +524,7 @@ def post_api_request(log, env, region_name, aplctn_cd, request, response= {}, re
         log.critical(traceback.format_exc())
         raise error
 
-def get_api_secrets(log, env, region_name, aplctn_cd, auth_type, provider, app_id, params= {}, headers= {}, body= {}):
+def get_api_secrets(log, env, region_name, aplctn_cd, auth_type, provider, app_id, params= {}, headers= {}, body= {}, force_refresh= False):
     """
     Get the API secrets from secret manager
     :param log: basic logger
@@ -366,20 +532,13 @@ def get_api_secrets(log, env, region_name, aplctn_cd, auth_type, provider, app_i
     :param env: environment string (ex dev, sit, prod)
     :param aplctn_cd: aplctn_cd such as edl, cii etc.
     :param provider: OAuth2 provider can be PING etc.
+    :param force_refresh: bypass the secrets cache (ex after a 401)
     :return: username and password
     """
     aplctn_cd = aplctn_cd.lower()
     secret_name = f'{env}/api/{aplctn_cd}'
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
     try:
-        log.debug(secret_name)
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
+        get_secret_value_response = get_cached_secret_value(log, region_name, secret_name, force_refresh)
     except ClientError as error:
         secret_error_handling(log, error)
     else:
@@ -438,7 +597,7 @@ def get_api_secrets(log, env, region_name, aplctn_cd, auth_type, provider, app_i
         log.critical(error)
         raise error
 
-def get_certificate_path(log, env, region_name, aplctn_cd):
+def get_certificate_path(log, env, region_name, aplctn_cd, force_refresh= False):
     """
     Get the certificate from secret manager
     :param log: basic logger
@@ -446,19 +605,12 @@ def get_certificate_path(log, env, region_name, aplctn_cd):
     :param env: environment string (ex dev, sit, prod)
     :param aplctn_cd: aplctn_cd such as edl, cii etc.
     :param provider: OAuth2 provider can be PING etc.
+    :param force_refresh: bypass the secrets cache
     :return: username and password
     """
     secret_name = f'{env}/api/cert/{aplctn_cd}'
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
     try:
-        log.debug(secret_name)
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
+        get_secret_value_response = get_cached_secret_value(log, region_name, secret_name, force_refresh)
         if 'SecretString' in get_secret_value_response:
             secret = get_secret_value_response['SecretString']
         else:
@@ -470,11 +622,30 @@ def get_certificate_path(log, env, region_name, aplctn_cd):
     except ClientError as error:
         return False
 
-def download_cert(logger, cert_path, cert_val):
+def download_cert(logger, cert_path, cert_val= None, cert_val_lst= None):
+    """
+    Write a certificate to disk, skipping the write when the content is unchanged
+    :param logger: basic logger
+    :param cert_path: destination file
+    :param cert_val: certificate text
+    :param cert_val_lst: certificate chain (list or text), used when cert_val is not given
+    """
     try:
-        file = open(cert_path, "w")
-        file.write(cert_val)
-        file.close()
+        if cert_val is None:
+            cert_val = '\n'.join(cert_val_lst) if isinstance(cert_val_lst, (list, tuple)) else cert_val_lst
+        digest = hashlib.sha256(cert_val.encode()).hexdigest()
+        if __cert_digests.get(cert_path) == digest and os.path.exists(cert_path):
+            return cert_path
+        cert_dir = os.path.dirname(cert_path)
+        if cert_dir:
+            os.makedirs(cert_dir, exist_ok=True)
+        # Write then rename so concurrent requests never read a half-written cert
+        tmp_path = f'{cert_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, "w") as file:
+            file.write(cert_val)
+        os.replace(tmp_path, cert_path)
+        __cert_digests[cert_path] = digest
+        return cert_path
     except Exception as error:
         logger.error(error)
         raise error
@@ -503,7 +674,7 @@ def override_api_dict(log, provider, app_id, ip_dict, op_dict, type):
             override_api_dict(log, provider, app_id, ip_dict, j, type)
     return op_dict
 
-def verify_api_key(log, env, region_name, aplctn_cd, app_id, api_key):
+def verify_api_key(log, env, region_name, aplctn_cd, app_id, api_key, force_refresh= False):
     """
     Get the API key from secret manager
     :param log: basic logger
@@ -512,19 +683,12 @@ def verify_api_key(log, env, region_name, aplctn_cd, app_id, api_key):
     :param aplctn_cd: aplctn_cd such as edl, cii etc.
     :param app_id: APP Id such as edw, cii etc
     :param api_key: API Key to verify.
+    :param force_refresh: bypass the secrets cache
     :return: dictionary with api key
     """
     secret_name = f'{env}/api/{aplctn_cd}'
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
     try:
-        log.debug(secret_name)
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
+        get_secret_value_response = get_cached_secret_value(log, region_name, secret_name, force_refresh)
     except ClientError as error:
         secret_error_handling(log, error)
     else:
@@ -537,6 +701,9 @@ def verify_api_key(log, env, region_name, aplctn_cd, app_id, api_key):
         secret = json.loads(secret)
         app_api_key = secret.get(f"{app_id}_api_key", secret.get("api_key"))
         if app_api_key != api_key:
+            if not force_refresh:
+                # The key may have been rotated since it was cached
+                return verify_api_key(log, env, region_name, aplctn_cd, app_id, api_key, force_refresh= True)
             log.error(f'API Key Verify Failed ***')
             return False
         return True
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from sfassist_retry import (CircuitBreaker, CircuitOpenError, RetryPolicy, acall_with_retry,
+                            call_with_retry)
+
+
+class _Response:
+    status_code = 200
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+
+def test_cancelled_async_probe_releases_the_half_open_slot():
+    breaker = _half_open_breaker()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def main():
+        probe = asyncio.ensure_future(acall_with_retry(hang, RetryPolicy(), breaker))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            await acall_with_retry(hang, RetryPolicy(), breaker)  # the probe holds the slot
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok():
+            return _Response()
+
+        return await acall_with_retry(ok, RetryPolicy(), breaker)
+
+    assert asyncio.run(main()).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_sync_probe_releases_the_half_open_slot():
+    breaker = _half_open_breaker()
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        call_with_retry(interrupted, RetryPolicy(), breaker)
+    assert call_with_retry(_Response, RetryPolicy(), breaker).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_before_call_reports_only_the_half_open_probe():
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0.05)
+    assert breaker.before_call() is False
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()